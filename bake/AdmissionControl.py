@@ -0,0 +1,141 @@
+###############################################################################
+# Copyright (c) 2013 INRIA
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation;
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Authors: Daniel Camara  <daniel.camara@inria.fr>
+#          Mathieu Lacage <mathieu.lacage@sophia.inria.fr>
+###############################################################################
+'''
+ AdmissionControl.py
+
+ Decides when the build of a module may start, and with how many jobs,
+ looking at the number of CPUs, the load and the memory of the host.
+'''
+
+import os
+import threading
+
+class AdmissionControl:
+    """ Admission control of the module builds. A build is held back while
+    the host is overloaded or short of memory, unless it is the only one
+    running, and its jobs are limited to the memory available.
+    """
+
+    # megabytes a compile job is expected to use, if the module does not
+    # say otherwise with its memory_per_job build attribute
+    DEFAULT_MEMORY_PER_JOB = 1024
+    # seconds between two checks of the host while a build is held back
+    POLL_INTERVAL = 1
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._running = 0
+
+    @classmethod
+    def cpus(cls):
+        """ Number of CPUs this process may run on."""
+
+        if hasattr(os, 'sched_getaffinity'):
+            return max(1, len(os.sched_getaffinity(0)))
+        import multiprocessing
+        return multiprocessing.cpu_count()
+
+    @classmethod
+    def memory(cls):
+        """ Megabytes of memory available on the host, None if unknown."""
+
+        try:
+            with open('/proc/meminfo') as meminfo:
+                for line in meminfo:
+                    if line.startswith('MemAvailable:'):
+                        return int(line.split()[1]) // 1024
+        except (IOError, ValueError, IndexError):
+            pass
+        try:
+            return (os.sysconf('SC_AVPHYS_PAGES') *
+                    os.sysconf('SC_PAGE_SIZE') // (1024 * 1024))
+        except (ValueError, OSError, AttributeError):
+            return None
+
+    @classmethod
+    def load(cls):
+        """ Load average of the last minute, None if unknown."""
+
+        try:
+            return os.getloadavg()[0]
+        except (OSError, AttributeError):
+            return None
+
+    def default_jobs(self, memory_per_job=None):
+        """ Jobs the host can afford: one per CPU, as long as there is
+        memory for them."""
+
+        return self._limit(self.cpus(), memory_per_job, self.memory())
+
+    def _limit(self, jobs, memory_per_job, memory):
+        """ Limits the jobs to the available memory. The load is not used
+        here, it lags behind and includes the builds that just finished.
+        """
+
+        if memory_per_job is None:
+            memory_per_job = self.DEFAULT_MEMORY_PER_JOB
+        if memory is not None:
+            jobs = min(jobs, memory // max(1, memory_per_job))
+        return max(1, jobs)
+
+    def _pressure(self, memory_per_job, memory, load):
+        """ Verifies if the host is too busy to start a new build."""
+
+        if memory_per_job is None:
+            memory_per_job = self.DEFAULT_MEMORY_PER_JOB
+        if memory is not None and memory < memory_per_job:
+            return True
+        if load is not None and load >= self.cpus():
+            return True
+        return False
+
+    def admit(self, jobs=-1, memory_per_job=None, max_jobs=None, 
+              shared=False):
+        """ Waits until a new build may start and returns the number of
+        jobs it should use. Jobs of -1 means as many as the host affords.
+        If the jobs are shared through a jobserver, the CPUs are already
+        under control and the load is not taken into account.
+        Every admitted build has to call release when it is over.
+        """
+
+        with self._condition:
+            while True:
+                memory = self.memory()
+                load = None
+                if not shared:
+                    load = self.load()
+                if (self._running == 0 or
+                    not self._pressure(memory_per_job, memory, load)):
+                    break
+                self._condition.wait(self.POLL_INTERVAL)
+            self._running = self._running + 1
+
+        if jobs is None or jobs <= 0:
+            jobs = self.cpus()
+        if max_jobs is not None and max_jobs > 0:
+            jobs = min(jobs, max_jobs)
+        return self._limit(jobs, memory_per_job, memory)
+
+    def release(self):
+        """ Signals the end of an admitted build."""
+
+        with self._condition:
+            self._running = self._running - 1
+            self._condition.notify_all()
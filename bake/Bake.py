@@ -37,15 +37,23 @@ import os
 import distro
 import signal
 import copy
+import threading
 import requests
 import bake.Utils
 from bake.Configuration import Configuration
 from bake.ModuleEnvironment import ModuleEnvironment
 from bake.ModuleLogger import StdoutModuleLogger, LogfileModuleLogger, LogdirModuleLogger
 from optparse import OptionParser
-from bake.Dependencies import Dependencies, DependencyUnmet
+from bake.Dependencies import Dependencies, DependencyUnmet, CycleDetected
+from bake.Jobserver import Jobserver
+from bake.AdmissionControl import AdmissionControl
+from bake.HostLimiter import HostLimiter
+from bake.Trace import Trace, NoSpan
+from bake.BuildCache import BuildCache
+from bake.DownloadCache import DownloadCache
+from bake.CompilerCache import CompilerCache
 from bake.Exceptions import MetadataError
-from bake.Utils import ColorTool
+from bake.Utils import ColorTool, ThreadOutput
 from bake.Exceptions import TaskError 
 from bake.ModuleSource import SystemDependency 
 from bake.ModuleBuild import NoneModuleBuild
@@ -73,7 +81,10 @@ class Bake:
     main_options = "" 
     
     def __init__(self):
-        pass
+        # optional dependencies chain, computed once per Bake instance
+        self.dependencyChain = None
+        # timeline of the run, if asked for with --trace
+        self._tracer = None
     
     def _error(self, string):
         """ Handles hard exceptions, the kind of exceptions Bake should not 
@@ -169,6 +180,7 @@ class Bake:
                 # ignore old modules that do not exist in the new configuration
                 continue
             new_module.installed = old_module.installed
+            new_module.durations = old_module.durations
 
         # copy which modules are enabled into new config
         for old_module in old_config.enabled():
@@ -220,6 +232,15 @@ class Bake:
                           dest="enable_minimal", default=None,
                           help="Disable all non-mandatory dependencies.")
 
+    def _module_jobs_options(self, parser):
+        """ Allows the parser to recognize the --module-jobs option."""
+
+        parser.add_option("--module-jobs", action="store", type="int",
+                          dest="module_jobs", default=1,
+                          help="Number of modules to process in parallel,"
+                          " each one as soon as all its dependencies are"
+                          " done. Default: %default.")
+
     def resolve_contrib_dependencies (self, module, fmod, configuration):
         """ Handles the contrib type dependencies"""
         for dep in module.dependencies ():
@@ -634,10 +655,50 @@ class Bake:
         self._save_resource_configuration(configuration)
         
         
-    dependencyChain=None
-    def _iterate(self, configuration, functor, targets, follow_optional=True):
+    def _print_summary(self, deps):
+        """ Prints which modules succeeded, failed or were skipped because
+        they depend on modules that failed."""
+
+        def names(targets, exclude=[]):
+            result = []
+            for target in targets:
+                if target.name() not in result and target.name() not in exclude:
+                    result.append(target.name())
+            return result
+        failed = names(deps.failed())
+        skipped = names(deps.skipped(), failed)
+        succeeded = names(deps.resolved(), failed + skipped)
+
+        colorTool = ColorTool()
+        color = colorTool.OK
+        if failed:
+            color = colorTool.FAIL
+        colorTool.cPrintln(color, ' > Summary: %d succeeded, %d failed, %d'
+                           ' skipped' % (len(succeeded), len(failed), 
+                                         len(skipped)))
+        if failed:
+            colorTool.cPrintln(colorTool.FAIL, '   >> Failed: ' + 
+                               ', '.join(failed))
+        if skipped:
+            colorTool.cPrintln(colorTool.WARNING, '   >> Skipped, depend on'
+                               ' failed modules: ' + ', '.join(skipped))
+
+    def _iterate(self, configuration, functor, targets, follow_optional=True,
+                 jobs=1, prefetch=None, phase=None, keep_going=False,
+                 download_jobs=None):
         """Iterates over the configuration modules applying the functor 
-        function and solve reminding dependencies.
+        function and solve reminding dependencies. Up to jobs modules, 
+        whose dependencies are already solved, are processed in parallel.
+        If prefetch is given, it is applied to each module as a separate 
+        step, that can run in background, and that has to finish before 
+        the functor is applied to the module. The time the phase, and the
+        prefetch download, took on previous runs, defines which modules
+        are on the critical path and so should be processed first.
+        With keep_going, a failed module only stops the modules that 
+        depend on it, and a summary is printed at the end. Up to 
+        download_jobs prefetch steps, by default jobs, run in parallel.
+        The messages of the modules processed in parallel are printed when
+        each module is done.
         """
         
         deps = Dependencies()
@@ -651,17 +712,53 @@ class Bake:
 #        
 #        
         
+        # modules processed in parallel should not write the 
+        # configuration file at the same time
+        lock = threading.Lock()
+        tracer = self._tracer
+        parallel = jobs > 1 or prefetch is not None
         class Wrapper:
-            def __init__(self, module):
+            def __init__(self, module, functor, step=phase):
                 self._module = module
+                self._functor = functor
+                self._step = step or functor.__name__
             def function(self):
-                retval = functor(self._module)
-                configuration.write()
+                span = NoSpan()
+                if tracer is not None:
+                    span = tracer.span(self._module._name, 'module',
+                                       {'step': self._step})
+                if parallel:
+                    ThreadOutput.start()
+                try:
+                    with span:
+                        retval = self._functor(self._module)
+                finally:
+                    if parallel:
+                        ThreadOutput.stop()
+                with lock:
+                    configuration.write()
                 return retval
+        class Prefetch:
+            """ The prefetch step of a module, resolved as a target of its
+            own, on which the module itself depends."""
+            def __init__(self, module):
+                self._module = module
+                self._name = module._name
+                self._source = module._source
+            def name(self):
+                return self._name
         # for all the modules saves the configuration
         for m in configuration.modules():
-            wrapper = Wrapper(m)
-            deps.add_dst(m, wrapper.function)
+            wrapper = Wrapper(m, functor)
+            cost = None
+            if phase is not None:
+                cost = m.duration(phase)
+            deps.add_dst(m, wrapper.function, cost=cost)
+            if prefetch is not None:
+                step = Prefetch(m)
+                deps.add_dst(step, Wrapper(m, prefetch, 'prefetch').function, 
+                             group='prefetch', cost=m.duration('download'))
+                deps.add_dep(step, m)
         # Review the dependencies of all the configured modules
         for m in configuration.modules():
             for dependency in m.dependencies():                
@@ -680,8 +777,16 @@ class Bake:
                     if follow_optional or not dependency.is_optional():
                         deps.add_dep(src, m, optional=dependency.is_optional())
                         
+        limits = None
+        if prefetch is not None:
+            limits = {'prefetch': download_jobs or jobs}
         try:
-            deps.resolve(targets)
+            try:
+                deps.resolve(targets, n=jobs, limits=limits, 
+                             keep_going=keep_going)
+            finally:
+                if keep_going:
+                    self._print_summary(deps)
 #            deps.dump2(sys.stdout)
         except DependencyUnmet as error:
             if not error.method() =='':
@@ -690,6 +795,9 @@ class Bake:
                  errorAppend = ' failed'
                
             self._error(' Critical dependency, module "' + error.failed().name()+'"' + errorAppend)
+        except CycleDetected as error:
+            self._error(' Dependency cycle between the modules: ' + 
+                        ' -> '.join([m.name() for m in error.cycle()]))
 
     def _read_config(self, config, directory=None):
         """Reads the configuration file."""
@@ -734,6 +842,11 @@ class Bake:
         parser.add_option("--stop-on-error", action="store_true", 
                           dest="stopOnError", default=False,
                           help="Stop on the first error found and do not advance while the error is not corrected.")
+        parser.add_option("--keep-going", action="store_true", 
+                          dest="keep_going", default=False,
+                          help="When a module fails, skip only the modules"
+                          " that depend on it, keep processing all the others"
+                          " and print a summary at the end.")
         parser.add_option("-s", "--start", action="store", type="string",
                           dest="start", default="",
                           help="Process all modules enabled starting from the module specified.")
@@ -775,54 +888,125 @@ class Bake:
             configuration.compute_installdir(), 
             configuration.compute_sourcedir(), 
             Bake.main_options.debug)
+        env.tracer = self._tracer
         return configuration, env
 
-    def _do_operation(self, config, options, functor, directory=None):
-        """Applies the function, passed as parameter, over the options."""
+    def _do_operation(self, config, options, functor, directory=None,
+                      prefetch=None, phase=None, keep_going=False):
+        """Applies the function, passed as parameter, over the options. 
+        If prefetch is given it is applied to each module before the
+        function, overlapped with the function applied to other modules.
+        The phase names the recorded module durations used to order them.
+        With keep_going the modules that do not depend on a failed module
+        are still processed.
+        """
         
         configuration, env = self.createEnvironment(config, options, directory)
         must_disable = []
-        if options.one != '':
-            if options.all or options.start != '' or options.after != '':
-                self._error('incompatible options')
-            module = configuration.lookup(options.one)
-            functor(configuration, module, env)
-            configuration.write()
-        elif options.all:
-            if options.start != '' or options.after != '':
-                self._error('incompatible options')
-            def _iterator(module):
-                return functor (configuration, module, env)
-            self._iterate(configuration, _iterator, configuration.modules())
-        elif options.start != '':
-            if options.after != '':
-                self._error('incompatible options')
-            must_process = []
-            first_module = configuration.lookup(options.start)
-            def _iterator(module):
-                if module == first_module:
-                    must_process.append(0)
-                if len(must_process) != 0:
-                    return functor (configuration, module, env)
-                else:
-                    return True
-            self._iterate(configuration, _iterator, configuration.enabled())
-        elif options.after != '':
-            # this is a list because the inner function below
-            # is not allowed to modify the outer function reference
-            must_process = [] 
-            first_module = configuration.lookup(options.after)
-            def _iterator(module):
-                if len(must_process) != 0:
-                    return functor (configuration, module, env)
-                elif module == first_module:
-                    must_process.append(1)
-                return True
-            self._iterate(configuration, _iterator, configuration.enabled())
+        jobs = getattr(options, 'module_jobs', 1)
+        download_jobs = None
+        if hasattr(options, 'download_jobs'):
+            download_jobs = options.download_jobs or jobs
+            env.downloads = HostLimiter(download_jobs, options.host_jobs)
+            env.git_defaults = {'depth': options.git_depth,
+                                'filter': options.git_filter,
+                                'single_branch': options.git_single_branch}
+            if phase == 'download':
+                jobs = download_jobs
+        if getattr(options, 'download_cache', ''):
+            env.download_cache = DownloadCache(options.download_cache, 
+                                               options.git_dissolve)
+        if keep_going and options.stopOnError:
+            self._error('incompatible options: --keep-going and '
+                        '--stop-on-error')
+        if prefetch is not None and (options.one != '' or options.start != ''
+                                     or options.after != ''):
+            # only the whole set of modules is overlapped, otherwise each 
+            # module is simply prefetched right before the function
+            step = prefetch
+            process = functor
+            def functor(configuration, module, env):
+                step(configuration, module, env)
+                return process(configuration, module, env)
+            prefetch = None
+        jobserver = None
+        if jobs > 1 and phase == 'build' and Jobserver.supported():
+            # modules built at the same time share one budget of jobs
+            size = options.jobs
+            if size <= 0:
+                size = AdmissionControl().default_jobs()
+            jobserver = Jobserver(size)
+            env.jobserver = jobserver
+        if jobs > 1 or prefetch is not None:
+            # each module processed in parallel needs its own environment
+            def _env():
+                return env.fork()
         else:
-            def _iterator(module):
-                return functor (configuration, module, env)
-            self._iterate(configuration, _iterator, configuration.enabled())
+            def _env():
+                return env
+        _prefetch_iterator = None
+        if prefetch is not None:
+            def _prefetch_iterator(module):
+                return prefetch (configuration, module, _env())
+        try:
+            if options.one != '':
+                if options.all or options.start != '' or options.after != '':
+                    self._error('incompatible options')
+                module = configuration.lookup(options.one)
+                functor(configuration, module, env)
+                configuration.write()
+            elif options.all:
+                if options.start != '' or options.after != '':
+                    self._error('incompatible options')
+                def _iterator(module):
+                    return functor (configuration, module, _env())
+                self._iterate(configuration, _iterator, configuration.modules(),
+                              jobs=jobs, prefetch=_prefetch_iterator, phase=phase,
+                              keep_going=keep_going, download_jobs=download_jobs)
+            elif options.start != '':
+                if options.after != '':
+                    self._error('incompatible options')
+                if jobs > 1:
+                    # the modules before the first one would be processed too
+                    self._error('incompatible options: --start and'
+                                ' parallel jobs')
+                must_process = []
+                first_module = configuration.lookup(options.start)
+                def _iterator(module):
+                    if module == first_module:
+                        must_process.append(0)
+                    if len(must_process) != 0:
+                        return functor (configuration, module, env)
+                    else:
+                        return True
+                self._iterate(configuration, _iterator, configuration.enabled(),
+                              phase=phase, keep_going=keep_going)
+            elif options.after != '':
+                if jobs > 1:
+                    self._error('incompatible options: --after and'
+                                ' parallel jobs')
+                # this is a list because the inner function below
+                # is not allowed to modify the outer function reference
+                must_process = [] 
+                first_module = configuration.lookup(options.after)
+                def _iterator(module):
+                    if len(must_process) != 0:
+                        return functor (configuration, module, env)
+                    elif module == first_module:
+                        must_process.append(1)
+                    return True
+                self._iterate(configuration, _iterator, configuration.enabled(),
+                              phase=phase, keep_going=keep_going)
+            else:
+                def _iterator(module):
+                    return functor (configuration, module, _env())
+                self._iterate(configuration, _iterator, configuration.enabled(),
+                              jobs=jobs, prefetch=_prefetch_iterator, phase=phase,
+                              keep_going=keep_going, download_jobs=download_jobs)
+        finally:
+            if jobserver is not None:
+                env.jobserver = None
+                jobserver.close()
         return env
 
     def _get_enabled_ns(self, config):
@@ -876,11 +1060,41 @@ class Bake:
     def _deploy(self, config, args):
         """Handles the deploy command line option."""
 
+        parser = self._option_parser('deploy')
+        self._download_options(parser)
+        self._build_options(parser)
+        self._module_jobs_options(parser)
+        parser.add_option('--pipeline', action='store_true', 
+                          dest='pipeline', default=False,
+                          help='Start building each module as soon as its'
+                          ' source and its dependencies are ready, while the'
+                          ' other modules are still being downloaded.')
+        (options, args_left) = parser.parse_args(args)
+
         print("Downloading, building and installing the selected modules and dependencies.")
         print("Please, be patient, this may take a while!")
-        returnValue = self._download(config, args);
-        if not returnValue:
-            return self._build(config, args)
+        if options.pipeline:
+            env = self._do_operation(config, options, 
+                                     self._build_functor(options),
+                                     prefetch=self._download_functor(options),
+                                     phase='build', 
+                                     keep_going=options.keep_going)
+        else:
+            self._do_operation(config, options, 
+                               self._download_functor(options),
+                               phase='download', keep_going=options.keep_going)
+            # with keep going the modules whose download failed are
+            # skipped by the build, instead of stopping it
+            if not options.keep_going:
+                self._check_source_code(config, options)
+            env = self._do_operation(config, options, 
+                                     self._build_functor(options),
+                                     phase='build', 
+                                     keep_going=options.keep_going)
+        self._print_compiler_cache()
+
+        if not options.no_environment_file:
+            env.create_environment_file(options.environment_file_identification)
 
 
     def _getconf(self, config, args):
@@ -943,16 +1157,78 @@ class Bake:
             self._deploy(config, [])
 
     
-    def _download(self, config, args):
-        """Handles the download command line option."""
+    def _download_options(self, parser):
+        """ Allows the parser to recognize the download options."""
 
-        parser = self._option_parser('download')
         parser.add_option("--force_download", action='store_true', 
                           dest='force_download', default=False,
                           help='Force the download of all modules again')
+        parser.add_option("--download-jobs", action="store", type="int",
+                          dest="download_jobs", default=0,
+                          help="Number of downloads to run in parallel,"
+                          " including the ones of the sources of a same"
+                          " module. By default as many as the modules"
+                          " processed in parallel.")
+        parser.add_option("--host-jobs", action="store", type="int",
+                          dest="host_jobs", 
+                          default=HostLimiter.DEFAULT_HOST_JOBS,
+                          help="Maximum number of downloads from a same"
+                          " host running in parallel, 0 for no limit."
+                          " Default: %default.")
+        parser.add_option("--git-depth", action="store", type="string",
+                          dest="git_depth", default='',
+                          help="Number of commits of history the git"
+                          " downloads fetch, for the modules without a"
+                          " depth attribute. By default the whole history.")
+        parser.add_option("--git-filter", action="store", type="string",
+                          dest="git_filter", default='',
+                          help="Partial clone filter of the git downloads,"
+                          " for the modules without a filter attribute,"
+                          " e.g. blob:none.")
+        parser.add_option("--git-single-branch", action="store_true",
+                          dest="git_single_branch", default=False,
+                          help="Fetch only the branch and revision to"
+                          " checkout in the git downloads, for the modules"
+                          " without a single_branch attribute.")
+        self._download_cache_options(parser)
+
+    def _download_cache_options(self, parser):
+        """ Allows the parser to recognize the download cache options."""
+
+        parser.add_option("--download-cache", action="store", type="string",
+                          dest="download_cache", 
+                          default=os.environ.get('BAKE_DOWNLOAD_CACHE', ''),
+                          help="Directory of the download cache, that may be"
+                          " shared by all the workspaces of the machine. It"
+                          " keeps a mirror of each git and mercurial"
+                          " repository, the downloads and updates only fetch"
+                          " from the network what the mirror does not have."
+                          " It also keeps the archives that have a sha256"
+                          " attribute. Default:"
+                          " the BAKE_DOWNLOAD_CACHE environment variable,"
+                          " if set.")
+        parser.add_option("--git-dissolve", action="store_true",
+                          dest="git_dissolve", default=False,
+                          help="Copy the objects of the mirrors of the"
+                          " download cache into the git downloads. Without"
+                          " it the downloads read the objects from the"
+                          " mirrors, that must then stay in place.")
+
+    def _download(self, config, args):
+        """Handles the download command line option."""
+
+        parser = self._option_parser('download')
+        self._download_options(parser)
+        self._module_jobs_options(parser)
 
         
         (options, args_left) = parser.parse_args(args)
+        self._do_operation(config, options, self._download_functor(options),
+                           phase='download', keep_going=options.keep_going)
+
+    def _download_functor(self, options):
+        """ Returns the function that downloads one module."""
+
         def _do_download(configuration, module, env):
             
             if module._source.name() == 'none':
@@ -1024,12 +1300,13 @@ class Bake:
                                 ' for module "%s". Try to call \"%s check\"\n' % 
                                 (tool, module.name(), 
                                  os.path.basename(sys.argv[0])))
-        self._do_operation(config, options, _do_download)
+        return _do_download
 
     def _update(self, config, args):
         """Handles the update command line option."""
 
         parser = self._option_parser('update')
+        self._download_cache_options(parser)
         (options, args_left) = parser.parse_args(args)
         self._check_source_version(config, options)
 
@@ -1090,20 +1367,131 @@ class Bake:
         self._do_operation(config, options, _do_check, directory)
 
 
-    def _build(self, config, args):
-        """Handles the build command line option."""
-        
-        parser = self._option_parser('build')
-        parser.add_option('-j', '--jobs', help='Allow N jobs at once.'
+    def _build_cache_options(self, parser):
+        """ Allows the parser to recognize the build cache options."""
+
+        parser.add_option('--build-cache', help='Directory of the build cache.'
+                          ' The modules whose sources, build options,'
+                          ' toolchain and dependencies did not change since'
+                          ' a build stored on it, have their installed files'
+                          ' restored from it instead of being built. It may'
+                          ' be shared by workspaces at other paths.'
+                          ' Default: the BAKE_BUILD_CACHE environment'
+                          ' variable, if set.', action='store', type='string',
+                          dest='build_cache', 
+                          default=os.environ.get('BAKE_BUILD_CACHE', ''))
+        parser.add_option('--build-cache-size', help='Size budget of the build'
+                          ' cache, e.g. 500M or 20G. The least recently used'
+                          ' builds are evicted when it is exceeded, and the'
+                          ' cache prune command prunes the cache to it.'
+                          ' Default: the BAKE_BUILD_CACHE_SIZE environment'
+                          ' variable, if set, otherwise unlimited.', 
+                          action='store', type='string', 
+                          dest='build_cache_size', 
+                          default=os.environ.get('BAKE_BUILD_CACHE_SIZE', ''))
+
+    def _build_options(self, parser):
+        """ Allows the parser to recognize the build options."""
+
+        parser.add_option('-j', '--jobs', help='Allow N jobs at once. When'
+                          ' several modules are built in parallel they share'
+                          ' the N jobs through a make jobserver. By default,'
+                          ' one job per CPU, as long as there is memory for'
+                          ' them.'
                           ,type='int', action='store', 
                           dest='jobs', default=-1)
         parser.add_option('--force-clean', help='Forces the call of the clean'
                           ' option for the build.', action="store_true", 
                           default=False, dest='force_clean')
+        parser.add_option('--force', help='Builds the modules even if their'
+                          ' sources, build options and dependencies did not'
+                          ' change since their last build.', 
+                          action="store_true", default=False, dest='force')
+        self._build_cache_options(parser)
+        parser.add_option('--compiler-cache', help='Compiler cache to build'
+                          ' the C and C++ code through: ccache, sccache, or'
+                          ' auto for the first one installed. Waf builds also'
+                          ' use the waf object cache, WAFCACHE. The'
+                          ' compiler_cache attribute of a module overrides it.'
+                          ' Default: %default.', type='choice', 
+                          choices=['auto', 'ccache', 'sccache', 'none'],
+                          dest='compiler_cache', default='none')
+        parser.add_option('--fused-install', help='Builds and installs the'
+                          ' modules with a single run of waf, make or cmake,'
+                          ' that goes through the dependencies of the'
+                          ' module only once. The fused_install attribute of'
+                          ' a module overrides it.', action='store_true',
+                          dest='fused_install', default=False)
+        parser.add_option('--staged-install', help='Installs each module'
+                          ' in a staging directory, with DESTDIR, and then'
+                          ' moves its files to the installation directory.'
+                          ' The files installed by the modules are then'
+                          ' known exactly, even when they are built in'
+                          ' parallel. Only the autotools, cmake, waf and'
+                          ' python modules are staged, the installation of'
+                          ' the other ones may ignore DESTDIR. The default'
+                          ' with --module-jobs greater than 1. The'
+                          ' staged_install attribute of a module overrides'
+                          ' it.', action='store_true',
+                          dest='staged_install', default=False)
+        parser.add_option('--shared-config-cache', help='Runs the configure'
+                          ' scripts of the autotools modules with an autoconf'
+                          ' cache shared by the modules built with the same'
+                          ' toolchain, so that the same checks are not run'
+                          ' again for each module. The shared_config_cache'
+                          ' attribute of a module overrides it.', 
+                          action='store_true', dest='shared_config_cache', 
+                          default=False)
+
+    def _build(self, config, args):
+        """Handles the build command line option."""
+        
+        parser = self._option_parser('build')
+        self._build_options(parser)
+        self._module_jobs_options(parser)
         (options, args_left) = parser.parse_args(args)
         #self._check_build_version(config, options)
         self._check_source_code(config, options)
         
+        env = self._do_operation(config, options, self._build_functor(options),
+                                 phase='build', keep_going=options.keep_going)
+        self._print_compiler_cache()
+        
+        if not options.no_environment_file:
+            env.create_environment_file(options.environment_file_identification)
+
+    def _print_compiler_cache(self):
+        """ Reports the hit rate of the compiler caches used by the run."""
+
+        for compiler_cache in CompilerCache.used():
+            print(' >> ' + compiler_cache.report())
+
+    def _fingerprint(self, configuration, module, env):
+        """ Current fingerprint of the module, that includes the ones of the
+        modules it depends on."""
+
+        dependencies = []
+        for dependency in module.dependencies():
+            src = configuration.lookup(dependency._name)
+            if src is None or src in configuration.disabled():
+                continue
+            dependencies.append((src.name(), src.fingerprint))
+        return module.current_fingerprint(env, dependencies)
+
+    def _build_functor(self, options):
+        """ Returns the function that builds one module."""
+        
+        admission = AdmissionControl()
+        cache = None
+        if options.build_cache:
+            cache = BuildCache(options.build_cache, 
+                               self._cache_size(options.build_cache_size))
+        compiler_cache = None
+        if options.compiler_cache != 'none':
+            compiler_cache = CompilerCache.get(options.compiler_cache)
+            if compiler_cache is None:
+                print(' > No compiler cache (%s) found, building without it' % 
+                      options.compiler_cache)
         def _do_build(configuration, module, env):
             
             if isinstance(module._source, SystemDependency) or isinstance(module._build, NoneModuleBuild) :
@@ -1120,11 +1508,47 @@ class Bake:
                 print
 
             env._sudoEnabled=options.call_with_sudo
+            env.compiler_cache = compiler_cache
+            env.fused_install = options.fused_install
+            env.shared_config_cache = options.shared_config_cache
+            # the monitors of the modules built in parallel would see the
+            # files of each other, the modules that cannot be staged are 
+            # monitored one at a time
+            env.staged_install = (options.staged_install or 
+                                  getattr(options, 'module_jobs', 1) > 1)
             ModuleEnvironment._stopOnError=options.stopOnError
+
+            # nothing changed since the last build
+            if not options.force and not options.force_clean and \
+               module.is_up_to_date(self._fingerprint(configuration, module, 
+                                                      env)):
+                module.keep_build(env)
+                module.update_libpath(env)
+                return True
+            module.fingerprint = None
                 
             if module.check_build_version(env):
-                retval = module.build(env, options.jobs, options.force_clean)
+                cached = None
+                if cache is not None:
+                    cached = cache.entry(configuration, module, env)
+                    if cached is not None and module.restore(env, cached):
+                        module.fingerprint = self._fingerprint(configuration,
+                                                               module, env)
+                        module.update_libpath(env)
+                        return True
+                # waits for the host to have room for the build
+                jobs = admission.admit(options.jobs, 
+                                       module.get_build().memory_per_job,
+                                       module.get_build().max_jobs,
+                                       shared=env.jobserver is not None)
+                try:
+                    retval = module.build(env, jobs, options.force_clean, 
+                                          cached)
+                finally:
+                    admission.release()
                 if retval:
+                    module.fingerprint = self._fingerprint(configuration, 
+                                                           module, env)
                     module.update_libpath(env)
                 return retval
             else:
@@ -1132,10 +1556,63 @@ class Bake:
                 print("   >> Unavailable building tool for module %s, install %s" 
                       %(module.name(),module._build.name()))
 
-        env = self._do_operation(config, options, _do_build)
-        
-        if not options.no_environment_file:
-            env.create_environment_file(options.environment_file_identification)
+        return _do_build
+
+    def _cache_size(self, size):
+        """ Converts the size budget of the build cache to bytes."""
+
+        if not size:
+            return 0
+        try:
+            return BuildCache.parse_size(size)
+        except ValueError as e:
+            self._error(str(e))
+
+    def _cache(self, config, args):
+        """Handles the cache command line option."""
+
+        parser = OptionParser(usage='usage: %prog cache [options] '
+                              'stats|prune|verify')
+        self._build_cache_options(parser)
+        (options, args_left) = parser.parse_args(args)
+
+        if not options.build_cache:
+            self._error('No build cache given, use --build-cache or set'
+                        ' BAKE_BUILD_CACHE')
+        if len(args_left) != 1 or not args_left[0] in ['stats', 'prune', 
+                                                       'verify']:
+            self._error('Expected one of stats, prune or verify')
+        cache = BuildCache(options.build_cache, 
+                           self._cache_size(options.build_cache_size))
+
+        if args_left[0] == 'stats':
+            stats = cache.stats()
+            print(' Build cache: %s' % cache.directory())
+            print('   Entries: %d, of %d modules' % (stats['entries'], 
+                                                    stats['modules']))
+            budget = 'unlimited'
+            if cache.max_size() > 0:
+                budget = BuildCache.format_size(cache.max_size())
+            print('   Size: %s, budget: %s' % 
+                  (BuildCache.format_size(stats['size']), budget))
+            if stats['oldest'] is not None:
+                import time
+                print('   Last used: %s, least recently: %s' % 
+                      (time.ctime(stats['latest']), 
+                       time.ctime(stats['oldest'])))
+        elif args_left[0] == 'prune':
+            if cache.max_size() <= 0:
+                self._error('No size to prune the cache to, use'
+                            ' --build-cache-size or set BAKE_BUILD_CACHE_SIZE')
+            (removed, freed) = cache.prune(cache.max_size())
+            print(' >> Removed %d entries, %s freed' % 
+                  (removed, BuildCache.format_size(freed)))
+        else:
+            (checked, corrupted) = cache.verify()
+            for key in corrupted:
+                print(' >> Removed corrupted entry %s' % key)
+            print(' >> Verified %d entries, %d corrupted' % 
+                  (checked, len(corrupted)))
 
     def _clean(self, config, args):
         """Handles the clean command line option."""
@@ -1648,6 +2125,8 @@ class Bake:
   download     : Download all modules enabled during configure
   update       : Update the source tree of all modules enabled during configure
   build        : Build all modules enabled during configure
+  cache        : Show the statistics of (stats), prune or verify the build 
+                 cache
   clean        : Cleanup the source tree of all modules built previously
   shell        : Start a shell and setup relevant environment variables
   uninstall    : Remove all files that were installed during build
@@ -1673,6 +2152,11 @@ To get more help about each command, try:
         parser.add_option("-V", action="store_true",
                           dest="version", default=False, 
                           help='Prints the version of Bake' )
+        parser.add_option("--trace", action="store", type="string",
+                          dest="trace", default="",
+                          help="Writes the timeline of the run, in the Chrome"
+                          " Trace Event format, to the given file. It can be"
+                          " opened in chrome://tracing or Perfetto.")
         parser.disable_interspersed_args()
         (options, args_left) = parser.parse_args(argv[1:])
         
@@ -1705,6 +2189,7 @@ To get more help about each command, try:
                 ['download', self._download],
                 ['update', self._update],
                 ['build', self._build],
+                ['cache', self._cache],
                 ['clean', self._clean],
                 ['shell', self._shell],
                 ['uninstall', self._uninstall],
@@ -1717,20 +2202,30 @@ To get more help about each command, try:
                ]
         recognizedCommand = False
         
-        for name, function in ops: 
-            if args_left[0].lower() == name:
-                recognizedCommand = True
-                if options.debug:
-                    function(config=options.config_file, args=args_left[1:])
-                else:
-                    try:
+        if options.trace:
+            self._tracer = Trace(options.trace)
+        try:
+            for name, function in ops: 
+                if args_left[0].lower() == name:
+                    recognizedCommand = True
+                    if options.debug:
                         function(config=options.config_file, args=args_left[1:])
-                    except Exception as e:
-                        print ('\n'+ str(e))
-                        sys.exit(1)
-                    except TaskError as e:
-                        print ('\n'+e.reason)
-                        sys.exit(1)
+                    else:
+                        try:
+                            function(config=options.config_file, args=args_left[1:])
+                        except Exception as e:
+                            print ('\n'+ str(e))
+                            sys.exit(1)
+                        except TaskError as e:
+                            print ('\n'+e.reason)
+                            sys.exit(1)
+        finally:
+            if self._tracer is not None:
+                try:
+                    self._tracer.write()
+                except IOError as e:
+                    print (' > Could not write the trace %s: %s' % 
+                           (options.trace, str(e)))
                         
         if not recognizedCommand:
             print (' >> Unrecognized option: ' + args_left[0])
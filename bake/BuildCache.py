@@ -0,0 +1,593 @@
+###############################################################################
+# Copyright (c) 2013 INRIA
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation;
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Authors: Daniel Camara  <daniel.camara@inria.fr>
+#          Mathieu Lacage <mathieu.lacage@sophia.inria.fr>
+###############################################################################
+'''
+ BuildCache.py
+
+ Content addressed cache of the module builds. The files a module
+ installs are stored under a key computed from everything the build
+ depends on, so that the next build with the same key restores them
+ instead of running the build tools again.
+
+ The cache directory may be shared by all the workspaces of a machine,
+ or mounted over NFS. The entries are shared by the workspaces whatever
+ their installation directory: the text files and links that refer to it
+ are rewritten when an entry is restored in another workspace. Only the 
+ entries with binary files that refer to it, e.g. through an rpath, are 
+ kept apart for each installation directory. Entries are only published
+ and removed with renames, so that concurrent builds never see an entry half written, 
+ and the least recently used entries are evicted to keep the cache 
+ within its size budget.
+'''
+
+import os
+import re
+import sys
+import time
+import json
+import shutil
+import hashlib
+import platform
+import tarfile
+import tempfile
+import threading
+import subprocess
+
+from bake.ModuleSource import SystemDependency, NoneModuleSource
+from bake.Utils import VCS_DIRECTORIES
+
+class BuildCacheEntry:
+    """ The place of one module build in the cache."""
+
+    def __init__(self, cache, key):
+        self._cache = cache
+        self._key = key
+
+    def key(self):
+        return self._key
+
+    def restore(self, installdir):
+        return self._cache.restore(self._key, installdir)
+
+    def store(self, name, installdir, files):
+        return self._cache.store(self._key, name, installdir, files)
+
+class BuildCache:
+    """ Build cache stored on a directory. The key of a module is the hash
+    of its source tree, or of its VCS revision, of its source and build 
+    attributes, of the toolchain and of the keys of the modules it depends
+    on. The entries whose binary files refer to the installation directory
+    are stored under the hash of the key and of that directory. The 
+    modification time of the manifest of an entry is the last time the 
+    entry was used.
+    """
+
+    VERSION = 2
+    MANIFEST = 'manifest'
+    ARCHIVE = 'files.tar.gz'
+    # prefixes of the entries being written, and being removed
+    TMP = '.tmp-'
+    TRASH = '.trash-'
+    # seconds after which a temporary entry is considered abandoned
+    ABANDONED = 24 * 3600
+    UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 
+             'T': 1024 ** 4}
+    # never part of the hash of a source tree
+    SKIP = VCS_DIRECTORIES
+    # output of the toolchain identification commands, per process
+    _tools = dict()
+
+    def __init__(self, directory, max_size=0):
+        self._directory = os.path.abspath(directory)
+        self._max_size = max_size
+        self._keys = dict()
+        self._lock = threading.Lock()
+
+    def directory(self):
+        return self._directory
+
+    def max_size(self):
+        """ Size budget of the cache in bytes, 0 if unlimited."""
+        return self._max_size
+
+    @classmethod
+    def parse_size(cls, size):
+        """ Converts sizes as 500M or 20G to bytes."""
+
+        match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)B?\s*$', 
+                         str(size).upper())
+        if not match:
+            raise ValueError('Invalid size: %s' % size)
+        return int(float(match.group(1)) * cls.UNITS[match.group(2)])
+
+    @classmethod
+    def format_size(cls, size):
+        """ Converts bytes to a human readable size."""
+
+        for unit in ['T', 'G', 'M', 'K']:
+            if size >= cls.UNITS[unit]:
+                return '%.1f %sB' % (float(size) / cls.UNITS[unit], unit)
+        return '%d B' % size
+
+    def entry(self, configuration, module, env):
+        """ Returns the cache entry of the module, None if the module cannot
+        be cached, e.g. its sources are not there."""
+
+        key = self.key(configuration, module, env)
+        if key is None:
+            return None
+        return BuildCacheEntry(self, key)
+
+    def key(self, configuration, module, env):
+        """ Computes the key of the module, None if it cannot be computed."""
+
+        with self._lock:
+            if module.name() in self._keys:
+                return self._keys[module.name()]
+
+        source = module.get_source()
+        build = module.get_build()
+        fields = [('bake-cache', self.VERSION), ('module', module.name()),
+                  ('source', source.name()), ('build', build.name()),
+                  ('toolchain', self._toolchain(module))]
+        for prefix, block in [('source.', source), ('build.', build)]:
+            for attribute in sorted(block.attributes(), 
+                                    key=lambda a: a.name):
+                fields.append((prefix + attribute.name, str(attribute.value)))
+
+        tree = self._tree(module, env)
+        fields.append(('tree', tree))
+        key = None
+        if tree is not None:
+            key = ''
+            for dependency in sorted(module.dependencies(), 
+                                     key=lambda d: d._name):
+                src = configuration.lookup(dependency._name)
+                if src is None or src in configuration.disabled():
+                    fields.append(('dependency.' + dependency._name, None))
+                    continue
+                depkey = self.key(configuration, src, env)
+                if depkey is None:
+                    key = None
+                    break
+                fields.append(('dependency.' + dependency._name, depkey))
+        if key is not None:
+            key = hashlib.sha256(repr(fields).encode('utf-8')).hexdigest()
+
+        with self._lock:
+            self._keys[module.name()] = key
+        return key
+
+    def _tree(self, module, env):
+        """ Identifies the source tree of the module, by its revision if the
+        VCS knows it, or by the hash of its files."""
+
+        source = module.get_source()
+        if isinstance(source, SystemDependency):
+            return ''
+        directory = module.get_source().attribute('module_directory').value
+        env.start_source(module.name(), directory or module.name())
+        try:
+            srcdir = env.srcdir
+            if not os.path.isdir(srcdir):
+                if isinstance(source, NoneModuleSource):
+                    return ''
+                return None
+            revision = source.revision(env)
+        finally:
+            env.end_source()
+        if revision is not None:
+            return revision
+
+        skip = set()
+        objdir = module.get_build().objdir
+        if objdir:
+            skip.add(os.path.normpath(os.path.join(srcdir, objdir)))
+        return self.hash_tree(srcdir, skip)
+
+    @classmethod
+    def hash_tree(cls, directory, skip=set()):
+        """ Hash of the names, modes and contents of the files of the 
+        directory, not entering the skipped directories."""
+
+        digest = hashlib.sha256()
+        for root, dirs, files in os.walk(directory):
+            dirs[:] = sorted([d for d in dirs if not d in cls.SKIP and 
+                              not os.path.join(root, d) in skip])
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                relative = os.path.relpath(path, directory)
+                digest.update(relative.encode('utf-8', 'replace') + b'\0')
+                if os.path.islink(path):
+                    digest.update(b'l' + 
+                                  os.readlink(path).encode('utf-8', 'replace'))
+                    continue
+                try:
+                    digest.update(('%o' % (os.stat(path).st_mode & 0o111))
+                                  .encode('ascii'))
+                    with open(path, 'rb') as f:
+                        while True:
+                            block = f.read(1024 * 1024)
+                            if not block:
+                                break
+                            digest.update(block)
+                except (IOError, OSError):
+                    digest.update(b'?')
+        return digest.hexdigest()
+
+    def _toolchain(self, module):
+        """ Identifies the compilers and the build tool of the module."""
+
+        commands = []
+        for variable, default in [('CC', 'cc'), ('CXX', 'c++')]:
+            compiler = None
+            attribute = module.get_build().attribute(variable)
+            if attribute is not None and attribute.value != '':
+                compiler = attribute.value
+            else:
+                compiler = os.environ.get(variable, default)
+            commands.append(compiler.split()[:1] + ['--version'])
+        tool = module.get_build().name()
+        if tool in ['make', 'autotools']:
+            commands.append(['make', '--version'])
+        elif tool == 'cmake':
+            commands.append(['cmake', '--version'])
+        identity = [sys.platform, platform.machine(), sys.version.split()[0]]
+        for command in commands:
+            identity.append(self._tool(command))
+        return identity
+
+    @classmethod
+    def _tool(cls, command):
+        """ First line of the version of the given tool, '' if it is not 
+        available."""
+
+        key = ' '.join(command)
+        if not key in cls._tools:
+            version = ''
+            try:
+                popen = subprocess.Popen(command, stdout=subprocess.PIPE,
+                                         stderr=subprocess.PIPE)
+                out = popen.communicate()[0].decode('utf-8', 'replace')
+                if popen.returncode == 0 and out.strip():
+                    version = out.strip().splitlines()[0]
+            except OSError:
+                pass
+            cls._tools[key] = version
+        return cls._tools[key]
+
+    def _makedirs(self, dirname):
+        """ Creates the directory, other processes may be creating it too."""
+
+        if not os.path.isdir(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError:
+                if not os.path.isdir(dirname):
+                    raise
+
+    def _path(self, key):
+        return os.path.join(self._directory, key[:2], key)
+
+    @classmethod
+    def _prefix(cls, installdir):
+        return os.path.normpath(os.path.abspath(installdir))
+
+    @classmethod
+    def _pinned_key(cls, key, prefix):
+        """ The key of the entry of a build that can only be restored in
+        the given installation directory."""
+
+        return hashlib.sha256(repr((key, prefix)).encode('utf-8')).hexdigest()
+
+    @classmethod
+    def _refers(cls, path, prefix):
+        """ Finds if the file contains the prefix, and if it is a binary
+        file. Returns a (contains, binary) tuple."""
+
+        prefix = prefix.encode(sys.getfilesystemencoding())
+        contains = False
+        binary = False
+        tail = b''
+        with open(path, 'rb') as f:
+            while True:
+                block = f.read(1024 * 1024)
+                if not block:
+                    break
+                if b'\0' in block:
+                    binary = True
+                # the prefix may span two blocks
+                if prefix in tail + block:
+                    contains = True
+                if contains and binary:
+                    break
+                tail = block[-len(prefix) + 1:]
+        return (contains, binary)
+
+    @classmethod
+    def _relocate(cls, path, old, new):
+        """ Replaces the old prefix by the new one in the text file or in 
+        the target of the link."""
+
+        if os.path.islink(path):
+            target = os.readlink(path)
+            os.unlink(path)
+            os.symlink(new + target[len(old):], path)
+            return
+        encoding = sys.getfilesystemencoding()
+        with open(path, 'rb') as f:
+            content = f.read()
+        # installed files are often read only
+        mode = os.stat(path).st_mode
+        os.chmod(path, mode | 0o200)
+        try:
+            with open(path, 'wb') as f:
+                f.write(content.replace(old.encode(encoding), 
+                                        new.encode(encoding)))
+        finally:
+            os.chmod(path, mode)
+
+    def restore(self, key, installdir):
+        """ Extracts the files stored under the key on the installation 
+        directory and returns their list, or None if they are not there."""
+
+        prefix = self._prefix(installdir)
+        for key in [key, self._pinned_key(key, prefix)]:
+            path = self._path(key)
+            try:
+                # once opened, the files stay readable even if the entry is
+                # evicted by another build meanwhile
+                with open(os.path.join(path, self.MANIFEST)) as f:
+                    manifest = json.load(f)
+                old = manifest.get('prefix', prefix)
+                if old != prefix and manifest.get('pinned'):
+                    continue
+                archive = tarfile.open(os.path.join(path, self.ARCHIVE), 
+                                       'r:gz')
+            except (IOError, OSError, ValueError, tarfile.TarError):
+                continue
+            try:
+                try:
+                    if hasattr(tarfile, 'tar_filter'):
+                        archive.extractall(installdir, filter='tar')
+                    else:
+                        archive.extractall(installdir)
+                finally:
+                    archive.close()
+                # built in another workspace
+                if old != prefix:
+                    for f in manifest.get('relocate', []):
+                        self._relocate(os.path.join(installdir, f), old, 
+                                       prefix)
+            except (IOError, OSError, KeyError, tarfile.TarError):
+                return None
+            self._touch(key)
+            return [os.path.join(installdir, f) for f in manifest['files']]
+        return None
+
+    def store(self, key, name, installdir, files):
+        """ Stores the installed files of the module under the key. The entry
+        becomes visible at once, when it is complete. Returns False if 
+        nothing was stored."""
+
+        relative = []
+        for f in sorted(set(files)):
+            f = os.path.relpath(f, installdir)
+            if not f.startswith(os.pardir) and \
+               os.path.lexists(os.path.join(installdir, f)):
+                relative.append(f)
+        prefix = self._prefix(installdir)
+        if not relative:
+            return False
+        # the same build is in the cache already, it was used again
+        for existing in [key, self._pinned_key(key, prefix)]:
+            if os.path.isdir(self._path(existing)):
+                self._touch(existing)
+                return True
+
+        # the files that refer to the installation directory
+        relocate = []
+        pinned = []
+        for f in relative:
+            name = os.path.join(installdir, f)
+            if os.path.islink(name):
+                if os.readlink(name).startswith(prefix + os.sep):
+                    relocate.append(f)
+                continue
+            try:
+                (contains, binary) = self._refers(name, prefix)
+            except (IOError, OSError):
+                continue
+            if contains and binary:
+                pinned.append(f)
+            elif contains:
+                relocate.append(f)
+        if pinned:
+            key = self._pinned_key(key, prefix)
+        path = self._path(key)
+
+        tmp = None
+        try:
+            self._makedirs(os.path.dirname(path))
+            tmp = tempfile.mkdtemp(prefix=self.TMP, dir=self._directory)
+            # readable by the other users of a shared cache
+            os.chmod(tmp, 0o755)
+            archive = tarfile.open(os.path.join(tmp, self.ARCHIVE), 'w:gz')
+            try:
+                for f in relative:
+                    archive.add(os.path.join(installdir, f), arcname=f, 
+                                recursive=False)
+            finally:
+                archive.close()
+            with open(os.path.join(tmp, self.MANIFEST), 'w') as f:
+                json.dump({'module': name, 'key': key, 'files': relative,
+                           'prefix': prefix, 'relocate': relocate,
+                           'pinned': pinned,
+                           'size': os.path.getsize(os.path.join(tmp, 
+                                                                self.ARCHIVE)),
+                           'sha256': self._hash_file(os.path.join(tmp, 
+                                                             self.ARCHIVE))},
+                          f)
+            os.rename(tmp, path)
+            tmp = None
+        except (IOError, OSError, tarfile.TarError):
+            # e.g. another build stored the same entry first
+            return os.path.isdir(path)
+        finally:
+            if tmp is not None:
+                shutil.rmtree(tmp, ignore_errors=True)
+        if self._max_size > 0:
+            self.prune(self._max_size)
+        return True
+
+    def _touch(self, key):
+        """ Makes the entry the most recently used one."""
+
+        try:
+            os.utime(os.path.join(self._path(key), self.MANIFEST), None)
+        except OSError:
+            # entries of other users on a shared cache
+            pass
+
+    @classmethod
+    def _hash_file(cls, path):
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            while True:
+                block = f.read(1024 * 1024)
+                if not block:
+                    break
+                digest.update(block)
+        return digest.hexdigest()
+
+    def entries(self):
+        """ Lists the entries of the cache as (key, manifest, size, last 
+        use) tuples. The manifest is None if it cannot be read."""
+
+        result = []
+        if not os.path.isdir(self._directory):
+            return result
+        for prefix in sorted(os.listdir(self._directory)):
+            parent = os.path.join(self._directory, prefix)
+            if prefix.startswith('.') or not os.path.isdir(parent):
+                continue
+            try:
+                keys = sorted(os.listdir(parent))
+            except OSError:
+                continue
+            for key in keys:
+                path = os.path.join(parent, key)
+                try:
+                    last_use = os.path.getmtime(os.path.join(path, 
+                                                             self.MANIFEST))
+                    with open(os.path.join(path, self.MANIFEST)) as f:
+                        manifest = json.load(f)
+                    size = manifest['size']
+                except (IOError, OSError, ValueError, KeyError):
+                    # entries removed meanwhile are not listed
+                    manifest = None
+                    last_use = 0
+                    try:
+                        size = sum([os.path.getsize(os.path.join(path, f))
+                                    for f in os.listdir(path)])
+                    except OSError:
+                        continue
+                result.append((key, manifest, size, last_use))
+        return result
+
+    def remove(self, key):
+        """ Removes the entry. It is first renamed, so that nobody starts
+        to read it while it is being deleted."""
+
+        trash = os.path.join(self._directory, 
+                             self.TRASH + key + '-' + str(os.getpid()) + 
+                             '-' + str(threading.current_thread().ident))
+        try:
+            os.rename(self._path(key), trash)
+        except OSError:
+            # already removed by someone else
+            return False
+        shutil.rmtree(trash, ignore_errors=True)
+        return True
+
+    def prune(self, max_size):
+        """ Evicts the least recently used entries until the cache fits
+        in max_size bytes, and removes the abandoned temporary entries.
+        Returns the number of entries removed and the bytes freed."""
+
+        if os.path.isdir(self._directory):
+            now = time.time()
+            for name in os.listdir(self._directory):
+                path = os.path.join(self._directory, name)
+                try:
+                    abandoned = now - os.path.getmtime(path) > self.ABANDONED
+                except OSError:
+                    continue
+                if name.startswith(self.TRASH) or \
+                   (name.startswith(self.TMP) and abandoned):
+                    shutil.rmtree(path, ignore_errors=True)
+
+        entries = self.entries()
+        total = sum([size for key, manifest, size, last_use in entries])
+        removed = 0
+        freed = 0
+        entries.sort(key=lambda e: e[3])
+        for key, manifest, size, last_use in entries:
+            if total <= max_size:
+                break
+            if self.remove(key):
+                removed = removed + 1
+                freed = freed + size
+            total = total - size
+        return (removed, freed)
+
+    def verify(self):
+        """ Checks the entries against the hash of their archives, and 
+        removes the corrupted ones. Returns the number of entries checked
+        and the list of the corrupted ones."""
+
+        corrupted = []
+        entries = self.entries()
+        for key, manifest, size, last_use in entries:
+            path = self._path(key)
+            try:
+                valid = (manifest is not None and manifest['key'] == key and
+                         self._hash_file(os.path.join(path, self.ARCHIVE)) == 
+                         manifest['sha256'])
+            except (IOError, OSError, KeyError):
+                valid = False
+            if not valid:
+                corrupted.append(key)
+                self.remove(key)
+        return (len(entries), corrupted)
+
+    def stats(self):
+        """ Returns the number of entries, of distinct modules, the size
+        and the oldest and latest last use of the entries."""
+
+        entries = self.entries()
+        modules = set([manifest['module'] for key, manifest, size, last_use 
+                       in entries if manifest is not None])
+        uses = [last_use for key, manifest, size, last_use in entries 
+                if last_use > 0]
+        return {'entries': len(entries), 'modules': len(modules),
+                'size': sum([size for key, manifest, size, last_use 
+                             in entries]),
+                'oldest': min(uses) if uses else None, 
+                'latest': max(uses) if uses else None}
@@ -0,0 +1,223 @@
+###############################################################################
+# Copyright (c) 2013 INRIA
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation;
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Authors: Daniel Camara  <daniel.camara@inria.fr>
+#          Mathieu Lacage <mathieu.lacage@sophia.inria.fr>
+###############################################################################
+'''
+ CompilerCache.py
+
+ Compiler caches, ccache and sccache, the C and C++ code of the modules
+ can be built through, so that clean rebuilds do not compile again the
+ translation units that did not change.
+'''
+
+import os
+import re
+import json
+import threading
+import subprocess
+
+class CompilerCache:
+    """ One compiler cache tool. The statistics of the tool are taken when
+    it is first used, to report the hits and misses of the run.
+    """
+
+    TOOLS = ['ccache', 'sccache']
+    # the tools already looked for, by name
+    _caches = dict()
+    _lock = threading.Lock()
+
+    def __init__(self, name, path):
+        self._name = name
+        self._path = path
+        self._used = False
+        self._start = self.stats()
+
+    @classmethod
+    def which(cls, program):
+        """ Finds the program on the PATH, None if it is not there."""
+
+        for directory in os.environ.get('PATH', '').split(os.pathsep):
+            path = os.path.join(directory, program)
+            if os.path.isfile(path) and os.access(path, os.X_OK):
+                return path
+        return None
+
+    @classmethod
+    def get(cls, tool='auto'):
+        """ Returns the compiler cache of the given name, or the first one 
+        installed for auto. None if it is not installed."""
+
+        if tool == 'auto':
+            for name in cls.TOOLS:
+                cache = cls.get(name)
+                if cache is not None:
+                    return cache
+            return None
+        if not tool in cls.TOOLS:
+            return None
+        with cls._lock:
+            if not tool in cls._caches:
+                path = cls.which(tool)
+                cls._caches[tool] = None
+                if path is not None:
+                    cls._caches[tool] = CompilerCache(tool, path)
+            return cls._caches[tool]
+
+    @classmethod
+    def used(cls):
+        """ The compiler caches some module was built through."""
+
+        with cls._lock:
+            return [c for c in cls._caches.values() 
+                    if c is not None and c._used]
+
+    def name(self):
+        return self._name
+
+    def path(self):
+        return self._path
+
+    def launcher(self):
+        """ The program the compilers have to be launched through."""
+
+        self._used = True
+        return self._path
+
+    def wrap(self, compiler):
+        """ The compiler command run through the cache."""
+
+        first = compiler.split()[:1]
+        if first and os.path.basename(first[0]) == self._name:
+            return compiler
+        return self.launcher() + ' ' + compiler
+
+    def _output(self, args):
+        try:
+            popen = subprocess.Popen([self._path] + args, 
+                                     stdout=subprocess.PIPE, 
+                                     stderr=subprocess.PIPE)
+            out = popen.communicate()[0].decode('utf-8', 'replace')
+        except OSError:
+            return None
+        if popen.returncode != 0:
+            return None
+        return out
+
+    def stats(self):
+        """ Total (hits, misses) of the cache, None if unknown."""
+
+        if self._name == 'sccache':
+            out = self._output(['--show-stats', '--stats-format=json'])
+            if out is not None:
+                return self.parse_sccache_json(out)
+            return self.parse_sccache_stats(self._output(['--show-stats']))
+        out = self._output(['--print-stats'])
+        if out is not None:
+            return self.parse_ccache_print_stats(out)
+        # ccache < 3.7 only has the human readable statistics
+        return self.parse_ccache_stats(self._output(['-s']))
+
+    @classmethod
+    def parse_ccache_print_stats(cls, out):
+        """ Parses the tab separated counters of ccache --print-stats."""
+
+        counters = dict()
+        for line in out.splitlines():
+            fields = line.split('\t')
+            if len(fields) == 2 and fields[1].strip().isdigit():
+                counters[fields[0].strip()] = int(fields[1])
+        hits = (counters.get('direct_cache_hit', 0) + 
+                counters.get('preprocessed_cache_hit', 0))
+        return (hits, counters.get('cache_miss', 0))
+
+    @classmethod
+    def parse_sccache_json(cls, out):
+        """ Parses the statistics of sccache in json."""
+
+        try:
+            stats = json.loads(out)['stats']
+            return (sum(stats['cache_hits']['counts'].values()),
+                    sum(stats['cache_misses']['counts'].values()))
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return None
+
+    @classmethod
+    def _counters(cls, out, names):
+        """ Sums the counters of the human readable statistics whose name
+        is in names, None if there is none of them."""
+
+        if out is None:
+            return None
+        counters = dict()
+        for line in out.splitlines():
+            match = re.match(r'^\s*(\S.*?)\s+(\d+)\s*$', line)
+            if match is not None:
+                counters[match.group(1).lower()] = int(match.group(2))
+        if not [name for name in names[0] + names[1] if name in counters]:
+            return None
+        return tuple([sum([counters.get(name, 0) for name in group]) 
+                      for group in names])
+
+    @classmethod
+    def parse_ccache_stats(cls, out):
+        """ Parses the statistics of ccache -s, before ccache 4."""
+
+        return cls._counters(out, (['cache hit (direct)', 
+                                    'cache hit (preprocessed)'],
+                                   ['cache miss']))
+
+    @classmethod
+    def parse_sccache_stats(cls, out):
+        """ Parses the statistics of sccache --show-stats."""
+
+        return cls._counters(out, (['cache hits'], ['cache misses']))
+
+    def run_stats(self):
+        """ The (hits, misses) of the run, None if unknown."""
+
+        end = self.stats()
+        if end is None:
+            return None
+        if self._start is None or end[0] < self._start[0] or \
+           end[1] < self._start[1]:
+            # the statistics were reset meanwhile, e.g. the sccache server
+            # was restarted
+            return end
+        return (end[0] - self._start[0], end[1] - self._start[1])
+
+    def report(self):
+        """ Line reporting the hit rate of the run."""
+
+        stats = self.run_stats()
+        if stats is None:
+            return 'Compiler cache (%s): statistics not available' % self._name
+        hits, misses = stats
+        rate = 0.0
+        if hits + misses > 0:
+            rate = 100.0 * hits / (hits + misses)
+        return ('Compiler cache (%s): %d hits, %d misses, %.1f%% hit rate' % 
+                (self._name, hits, misses, rate))
+
+    @classmethod
+    def wafcache(cls):
+        """ Directory of the object cache of waf, unless the user set one."""
+
+        if os.environ.get('WAFCACHE'):
+            return os.environ['WAFCACHE']
+        return os.path.join(os.path.expanduser('~'), '.cache', 'bake', 
+                            'wafcache')
@@ -304,6 +304,27 @@ class Configuration:
             installed_node = ET.Element('installed', {'value' : installed})
             node.append(installed_node)
 
+    def _read_durations(self, node):
+        """ Reads the time the phases of the module took on previous runs."""
+        
+        durations = dict()
+        for duration_node in node.findall('duration'):
+            try:
+                durations[duration_node.get('phase')] = \
+                    float(duration_node.get('value', ''))
+            except ValueError:
+                pass
+        return durations
+
+    def _write_durations(self, node, durations):
+        """ Generates the XML nodes to register the time the phases of the
+        module took."""
+        
+        for phase in sorted(durations):
+            duration_node = ET.Element('duration', 
+                                       {'phase' : phase,
+                                        'value' : '%.3f' % durations[phase]})
+            node.append(duration_node)
     
     def _read_metadata(self, et):
         """ Reads the elements from the xml configuration files and add it to 
@@ -318,6 +339,7 @@ class Configuration:
             min_ver = module_node.get('min_version')
             max_ver = module_node.get('max_version')
             installed = self._read_installed(module_node)
+            durations = self._read_durations(module_node)
 
             source_node = module_node.find('source')
             source = self._create_obj_from_node(source_node, ModuleSource, 
@@ -334,7 +356,8 @@ class Configuration:
                             
             module = Module(name, source, build, mtype, min_ver, max_ver, dependencies=dependencies,
                             built_once=bool(module_node.get('built_once', '').upper()=='TRUE'),
-                            installed=installed)
+                            installed=installed, durations=durations,
+                            fingerprint=module_node.get('fingerprint', None))
             self._modules.append(module)
 
     def _write_metadata(self, root):
@@ -351,8 +374,11 @@ class Configuration:
                 module_attrs['min_version'] = module.minver()
             if module.is_built_once():
                 module_attrs['built_once'] = 'True'
+            if module.fingerprint:
+                module_attrs['fingerprint'] = module.fingerprint
             module_node = ET.Element('module', module_attrs)
             self._write_installed(module_node, module.installed)
+            self._write_durations(module_node, module.durations)
 
             # registers the values, possible changed ones, from the source and
             # build XML tags of each module
@@ -35,13 +35,22 @@
 ''' 
 
 import copy
+import heapq
 import sys
+import threading
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
 from bake.Exceptions import TaskError 
 from bake.ModuleSource import SystemDependency
 
-class CycleDetected:
-    def __init__(self):
-        return
+class CycleDetected(Exception):
+    def __init__(self, cycle=[]):
+        self._cycle = cycle
+    def cycle(self):
+        """ The targets on the cycle, the first one repeated at the end."""
+        return self._cycle
 
 class DependencyUnmet(Exception):
     def __init__(self, failed, method=''):
@@ -66,11 +75,16 @@ class DependencyLink():
 class Target:
     """ Target modules meta information."""
         
-    def __init__(self, dst, context):
+    def __init__(self, dst, context, group=None, cost=None):
         self._dst = dst
         self._src = []
         self._optional = dict()
         self._context = context
+        self._group = group
+        if cost is None:
+            cost = 1
+        self._cost = cost
+        self._priority = cost
         self._dirty = True
     def is_dirty(self):
         return self._dirty
@@ -79,9 +93,11 @@ class Target:
     def clean(self):
         self._dirty = False
     def add_src(self, src, optional):
-        assert src not in self._src
+        assert src not in self._optional
         self._src.append(src)
         self._optional[src] = optional
+    def has_src(self, src):
+        return src in self._optional
     def dst(self):
         return self._dst
     def src(self):
@@ -91,13 +107,21 @@ class Target:
         return self._optional[src]
     def context(self):
         return self._context
+    def group(self):
+        return self._group
+    def cost(self):
+        return self._cost
+    def priority(self):
+        return self._priority
+    def set_priority(self, priority):
+        self._priority = priority
 
 class Dependencies:
     def __init__(self): 
         # a dictionnary that maps a string (key) to the only instance
         # of the class Target that has this string as its target.
         self._targets = dict()
-        # a dictionnary that maps a string (key) to the list of 
+        # a dictionnary that maps a string (key) to the set of 
         # instances of the class Target that have this string in their
         # source list
         self._sources = dict()
@@ -105,46 +129,68 @@ class Dependencies:
         self._items = []
         # Are we currently executing the resolve method. ?
         self._resolving = False
-        # is there any target that is dirty ?
-        self._dirty = False
+        # state of the running resolution: the targets it has to resolve, 
+        # the ones being resolved, the number of unfinished sources of each
+        # target and, per group, the heap of targets ready to be resolved
+        self._requested = set()
+        self._live = set()
+        self._running = set()
+        self._pending = dict()
+        self._ready = dict()
+        # in keep going mode a failed target only stops the targets that
+        # depend on it, the results are kept for the final summary
+        self._keep_going = False
+        self._resolved = []
+        self._failed = []
+        self._skipped = []
+        self._unmet = None
+        # maps the name of each module to its optional chain information
+        self.dependencies = dict()
+        # protects the graph when targets are resolved in parallel and the 
+        # callbacks add new dependencies
+        self._lock = threading.RLock()
         
-    def add_dst(self, dst, context = None):
-        """ Add the dependence"""
+    def add_dst(self, dst, context = None, group = None, cost = None):
+        """ Add the dependence. When resolving in parallel, the targets of 
+        a group run under the group's own limit instead of the global one.
+        The cost is the expected time to resolve the target, used to start
+        the longest chains of targets first.
+        """
         
         # if the module passed as parameter, dst, is in fact a list of modules
         if isinstance(dst,list):
-            return [self.add_dst(d,context) for d in dst]
-        # the dependency is already recorded. nothing to do.
-        if dst in self._targets:
-            return
-        # update dependency information
-        target = Target(dst, context)
-        self._targets[dst] = target
-        # mark dirty target and its depending targets
-        self._update_dirty(target)
+            return [self.add_dst(d,context,group,cost) for d in dst]
+        with self._lock:
+            # the dependency is already recorded. nothing to do.
+            if dst in self._targets:
+                return
+            # update dependency information
+            target = Target(dst, context, group, cost)
+            self._targets[dst] = target
+            # mark dirty target and its depending targets
+            self._update_dirty(target)
 
     def add_dep(self, src, dst, optional = False):
         """ Registers a dependency regarding one module to another."""
         
         # if the dependence is in fact for a list of dependencies
         if isinstance(src,list):
-            return [self.add_dep(s,dst) for s in src]
-        assert dst in self._targets
-        # the dependency is already recorded. nothing to do.
-        target = self._targets[dst]
-        if src in target.src ():
-            return
-
-        # record new dependency
-        target = self._targets[dst]
-        target.add_src(src, optional)
-        if not src in self._sources:
-            self._sources[src] = [target]
-        elif target not in self._sources[src]:
-            self._sources[src].append(target)
-
-        # mark dirty target and its depending targets
-        self._update_dirty(target)
+            return [self.add_dep(s,dst,optional) for s in src]
+        with self._lock:
+            assert dst in self._targets
+            # the dependency is already recorded. nothing to do.
+            target = self._targets[dst]
+            if target.has_src(src):
+                return
+
+            # record new dependency
+            target.add_src(src, optional)
+            if not src in self._sources:
+                self._sources[src] = set()
+            self._sources[src].add(target)
+
+            # mark dirty target and its depending targets
+            self._update_dirty(target, src)
 
 #    def rec_dump(self,target):
 #        """ Debugging purpose function to visualize the targets."""
@@ -172,47 +218,70 @@ class Dependencies:
                 f.write('"' + src._name + '" -> "' + target.dst()._name + '";\n')
         f.write('}')
 
-    def resolve(self, targets, callback = None, n=1):
-        """ Resolve dependencies wrapper function."""
+    def resolve(self, targets, callback = None, n=1, limits=None, 
+                keep_going=False):
+        """ Resolve dependencies wrapper function. Up to n targets are 
+        resolved at the same time, and limits may map a group of targets 
+        to the number of targets of that group allowed to run in parallel.
+        With keep_going, a failed target does not stop the resolution, 
+        only the targets that depend on it are skipped, and the error is
+        raised at the end.
+        """
         
         # raise exceptions to signal errors:
-        # todo:
         #  CycleDetected ()
         #  DependencyUnmet ()
         
         if isinstance(targets,str):
             targets = [targets]
             
-        self._resolving = True
-        if n == 1:
-            self._resolve_serial(targets, callback)
-        else:
-            self._resolve_parallel(targets, callback, n)
-            
-        self._resolving = False
-
-    def _update_dirty(self,target):
-        """Registers dependency added modules for later treatment."""
+        with self._lock:
+            self._keep_going = keep_going
+            self._start(targets)
+            self._resolving = True
+        try:
+            if (n is None or n <= 1) and not limits:
+                self._resolve_serial(targets, callback)
+            else:
+                self._resolve_parallel(targets, callback, n or 1, limits)
+            if self._unmet is not None:
+                raise self._unmet
+        finally:
+            with self._lock:
+                self._resolving = False
+                self._live = set()
+                self._running = set()
+                self._pending = dict()
+                self._ready = dict()
+
+    def _update_dirty(self, target, src=None):
+        """Registers dependency added modules for later treatment. The 
+        src is the new dependency of the target, if any."""
         
         if self._resolving:
             depending = self._depend_on([target])
+            # the targets that were finished, and have to be resolved again
+            reopened = [i for i in depending 
+                        if i in self._live and not self._unfinished(i)]
             for i in depending:
                 i.dirty()
-            self._dirty = True
+            self._splice(target, reopened, src)
 
     # return list of targets which depend on the input
     # target, including the input target itself.
     def _depend_on(self,targets):
         """ Finds the list of modules that depends on the target module."""
         
-        workqueue = copy.copy(targets)
+        workqueue = list(targets)
+        seen = set(workqueue)
         deps = []
         while len(workqueue) > 0:
             i = workqueue.pop()
-            if i not in deps:
-                deps.append(i)
-            if i.dst() in self._sources:
-                workqueue.extend(self._sources[i.dst()])
+            deps.append(i)
+            for j in self._sources.get(i.dst(), ()):
+                if j not in seen:
+                    seen.add(j)
+                    workqueue.append(j)
         return deps
 
     # return list of targets which need to be resolved
@@ -220,20 +289,20 @@ class Dependencies:
     def _dependencies_of(self,targets):
         """ Finds the list of dependencies of the target module."""
         
-        # XXX: should detect cycles here.
         workqueue = [self._targets[target] 
                      for target in targets 
                         if target in self._targets]
-        
+        seen = set(workqueue)
         deps = []
         while len(workqueue) > 0:
             i = workqueue.pop()
-            if i not in deps:
-                deps.append(i)
-
+            deps.append(i)
             for src in i.src():
                 if src in self._targets:
-                    workqueue.append(self._targets[src])
+                    source = self._targets[src]
+                    if source not in seen:
+                        seen.add(source)
+                        workqueue.append(source)
         return deps
 
     def _is_leaf(self, target):
@@ -248,219 +317,582 @@ class Dependencies:
                 return False
         return True
 
+    def _key(self, target):
+        """ Deterministic sort key of the target, used to break ties."""
+
+        name = getattr(target.dst(), '_name', target.dst())
+        return (str(name), str(target.group()))
+
+    def _prioritize(self, to_resolve, members=None):
+        """ Sets the priority of each target to the cost of the longest 
+        path, i.e. the critical path, from the target to the end of the
+        resolution. The paths go through the targets in members, by default
+        the targets to resolve, whose priorities are not changed.
+        """
+
+        resolve_set = set(to_resolve)
+        if members is None:
+            members = resolve_set
+        dependents = dict()
+        pending = dict()
+        for target in to_resolve:
+            dependents[target] = [dst for dst in 
+                                  self._sources.get(target.dst(), [])
+                                  if dst in members]
+            pending[target] = len([dst for dst in dependents[target] 
+                                   if dst in resolve_set])
+
+        # go backwards, from the targets nobody depends upon, to the leaves
+        workqueue = [i for i in to_resolve if pending[i] == 0]
+        while len(workqueue) > 0:
+            target = workqueue.pop()
+            longest = 0
+            for dst in dependents[target]:
+                longest = max(longest, dst.priority())
+            target.set_priority(target.cost() + longest)
+            for src in target.src():
+                if src in self._targets and self._targets[src] in resolve_set:
+                    source = self._targets[src]
+                    pending[source] -= 1
+                    if pending[source] == 0:
+                        workqueue.append(source)
+
     # return sorted list of targets such that the first
     # items must be 'resolved' first.
     def _sort(self,targets):
-        """ Organize the modules putting on the head the resolved ones."""
+        """ Organize the modules putting on the head the resolved ones. 
+        Among the targets that can be resolved, the ones on the longest 
+        path to the end of the resolution come first.
+        """
         
         # to calculate this, we first collect the set of targets to
         # 'resolve'. i.e., the targets that 'targets' depends upon.
         to_resolve = self._dependencies_of(targets)
-        
-        # then, we collect the set of targets that are the leaves
-        # of the dependency graph to initialize our workqueue
-        leaves = [i for i in to_resolve if self._is_leaf(i)]
-        workqueue = leaves
-        prio = dict()
-        
-        # let's initialize the piority of every item to zero.
-        for work in to_resolve:
-            prio[work] = 0
-            
-        # and, now, we update the priority so that the
-        # deepest targets of the dependency tree have the highest
-        # priority.
-        while len(workqueue) > 0:
-            source = workqueue.pop()
-            if not source.dst() in self._sources:
-                continue
-            for dst in self._sources[source.dst()]:
-                if dst not in to_resolve:
-                    continue
-                prio[dst] = max(prio[dst], prio[source] + 1)
-                workqueue.append(dst)
+        self._prioritize(to_resolve)
 
-        # now, build an inverted dictionary of priorities
-        # we want to find the list of targets for each priority
-        prio_inverted = dict()
+        resolve_set = set(to_resolve)
+        pending = dict()
         for target in to_resolve:
-            if prio[target] in prio_inverted:
-                prio_inverted[prio[target]].append(target)
-            else:
-                prio_inverted[prio[target]] = [target]
-               
-        # generate a sorted list of targets, lowest-priority first
+            pending[target] = len([src for src in target.src() 
+                                   if src in self._targets and 
+                                   self._targets[src] in resolve_set])
+
+        # then, we start from the leaves of the dependency graph and
+        # always pick the target with the highest priority
+        heap = []
+        for target in to_resolve:
+            if pending[target] == 0:
+                heapq.heappush(heap, self._heap_entry(target))
         sorted_targets = []
-        for key in sorted(prio_inverted.keys()):
-            sorted_targets.extend(sorted(prio_inverted[key], key=self.cmp_to_key(self._cmp)))
-        # convert the list of targets into a list of steps
+        while len(heap) > 0:
+            target = heapq.heappop(heap)[-1]
+            sorted_targets.append(target)
+            for dst in self._sources.get(target.dst(), []):
+                if dst not in resolve_set:
+                    continue
+                pending[dst] -= 1
+                if pending[dst] == 0:
+                    heapq.heappush(heap, self._heap_entry(dst))
+
+        # whatever could not be sorted is waiting on a cycle
+        if len(sorted_targets) != len(to_resolve):
+            done = set(sorted_targets)
+            left = [i for i in to_resolve if i not in done]
+            cycles = self._cycles(left)
+            raise CycleDetected(self._cycle_path(cycles[0]))
         return sorted_targets
-    def cmp_to_key(self, mycmp):
-        'Convert a cmp= function into a key= function'
-        class K(object):
-            def __init__(self, obj, *args):
-                self.obj = obj
-            def __lt__(self, other):
-                return mycmp(self.obj, other.obj) < 0
-            def __gt__(self, other):
-                return mycmp(self.obj, other.obj) > 0
-            def __eq__(self, other):
-                return mycmp(self.obj, other.obj) == 0
-            def __le__(self, other):
-                return mycmp(self.obj, other.obj) <= 0
-            def __ge__(self, other):
-                return mycmp(self.obj, other.obj) >= 0
-            def __ne__(self, other):
-                return mycmp(self.obj, other.obj) != 0
-        return K
-
-
-    def _cmp(self, a, b):
-        return (id(b.dst())-id(a.dst()));
-
-    def _is_clean(self,targets):
-        """ Returns true if the target is clean, resolved, and False if it 
-        is dirty, i.e. not all the dependencies resolved yet.
+
+    def _successors(self, target, members):
+        """ Targets, among members, that directly depend on the target."""
+
+        return sorted([i for i in self._sources.get(target.dst(), ()) 
+                       if i in members], key=self._key)
+
+    def _cycles(self, targets):
+        """ Finds the cycles among the given targets, i.e. the strongly 
+        connected components of the graph, using Tarjan's algorithm.
         """
 
-        for target in targets:
-            if target in self._targets:
-                if self._targets[target].is_dirty():
-                    return False
-        return True
+        members = set(targets)
+        index = dict()
+        lowlink = dict()
+        stack = []
+        on_stack = set()
+        components = []
+        for root in sorted(targets, key=self._key):
+            if root in index:
+                continue
+            index[root] = lowlink[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            # iterative depth first search, to not hit the recursion limit
+            work = [(root, iter(self._successors(root, members)))]
+            while len(work) > 0:
+                node, successors = work[-1]
+                advanced = False
+                for succ in successors:
+                    if succ not in index:
+                        index[succ] = lowlink[succ] = len(index)
+                        stack.append(succ)
+                        on_stack.add(succ)
+                        work.append((succ, 
+                                     iter(self._successors(succ, members))))
+                        advanced = True
+                        break
+                    elif succ in on_stack:
+                        lowlink[node] = min(lowlink[node], index[succ])
+                if advanced:
+                    continue
+                work.pop()
+                if len(work) > 0:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        i = stack.pop()
+                        on_stack.discard(i)
+                        component.append(i)
+                        if i is node:
+                            break
+                    if (len(component) > 1 or 
+                        node in self._successors(node, members)):
+                        components.append(component)
+        return components
+
+    def _cycle_path(self, component):
+        """ Returns one cycle, as a list of targets that starts and ends on 
+        the same target, inside the strongly connected component.
+        """
+
+        members = set(component)
+        start = min(component, key=self._key)
+        parent = dict()
+        workqueue = [start]
+        while len(workqueue) > 0:
+            i = workqueue.pop(0)
+            for succ in self._successors(i, members):
+                if succ is start:
+                    path = [start, i]
+                    while path[-1] is not start:
+                        path.append(parent[path[-1]])
+                    path.reverse()
+                    return [j.dst() for j in path]
+                if succ not in parent:
+                    parent[succ] = i
+                    workqueue.append(succ)
+        return [start.dst(), start.dst()]
+
+    def _heap_entry(self, target):
+        """ Entry of the target in the priority queue, the highest 
+        priority first."""
+
+        return (-target.priority(), self._key(target), id(target), target)
+
+    def _start(self, targets):
+        """ Prepares the resolution of the targets, i.e. sorts the targets
+        they depend upon and queues the ones that can be resolved first.
+        """
+
+        self._requested = set(targets)
+        self._resolved = []
+        self._failed = []
+        self._skipped = []
+        self._unmet = None
+        self._live = set(self._sort(targets))
+        self._running = set()
+        self._pending = dict()
+        self._ready = dict()
+        for target in self._live:
+            self._schedule(target)
+
+    def _unfinished(self, target):
+        """ A target is unfinished while it is dirty or being resolved."""
 
-    def _resolve_one_iteration(self, targets, callback):
-        """ 'resolve' all targets which the input targets depend upon
-        in the right order. If resolving one of these targets
-        creates new targets, the function is interrupted and returns
-        False. Otherwise, the function completes and returns True.
+        return target.is_dirty() or target in self._running
+
+    def _schedule(self, target):
+        """ Counts the unfinished sources of the target and, if it has 
+        none, puts the target in the queue of the ready ones."""
+
+        pending = 0
+        for src in target.src():
+            if src in self._targets:
+                source = self._targets[src]
+                if source in self._live and self._unfinished(source):
+                    pending = pending + 1
+        self._pending[target] = pending
+        self._push(target)
+
+    def _push(self, target):
+        """ Queues the target if it can be resolved right now."""
+
+        if (target.is_dirty() and target not in self._running and 
+            self._pending[target] == 0):
+            heapq.heappush(self._ready.setdefault(target.group(), []), 
+                           self._heap_entry(target))
+
+    def _is_ready(self, target):
+        """ Verifies if a queued target can still be resolved, as the graph
+        may have changed after it was queued."""
+
+        return (target in self._live and target.is_dirty() and 
+                target not in self._running and 
+                self._pending.get(target) == 0)
+
+    def _splice(self, target, reopened, src=None):
+        """ Takes into account, on the running resolution, the new target,
+        or the new dependency src of the target. Only the targets that were
+        added are counted and prioritized, the counts of unfinished sources
+        of the other targets are updated one dependency at a time, there is
+        no need to sort the whole graph again.
         """
-        
-        self._dirty = False
-        
-        # sort in a way that the nodes that have no dependencies are first
-        queue = self._sort(targets)
-        dirty = [i for i in queue if i.is_dirty()]
-        for i in dirty:
-            i.clean();
-            assert self._is_clean(i.src())
-            success = True
-            if callback is None and i.context() is not None:
-                try:
-                    success = i.context()()
-                except TaskError as e:
-                    success = False
-                    print("  > Error: " + e._reason)
-#                except SystemExit as e:
-#                    print(sys.exc_info())
+
+        added = []
+        if target not in self._live:
+            # nobody we resolve depends on the target, nothing to do
+            if target.dst() not in self._requested:
+                for i in self._sources.get(target.dst(), ()):
+                    if i in self._live:
+                        break
+                else:
+                    return
+            self._live.add(target)
+            added.append(target)
+        elif src in self._targets and self._targets[src] not in self._live:
+            self._live.add(self._targets[src])
+            added.append(self._targets[src])
+        # the targets the new dependencies bring into the resolution
+        workqueue = list(added)
+        while len(workqueue) > 0:
+            i = workqueue.pop()
+            for name in i.src():
+                if name in self._targets:
+                    source = self._targets[name]
+                    if source not in self._live:
+                        self._live.add(source)
+                        added.append(source)
+                        workqueue.append(source)
+        self._prioritize(added, self._live)
+        fresh = set(added + reopened)
+        for i in added + reopened:
+            self._schedule(i)
+
+        # the other targets wait for the new and reopened ones
+        for i in added + reopened:
+            for j in self._sources.get(i.dst(), ()):
+                if j in self._live and j not in fresh:
+                    self._pending[j] = self._pending[j] + 1
+        if src in self._targets and self._targets[src] not in added:
+            source = self._targets[src]
+            # the new dependency makes its source more urgent
+            self._raise_priority(source, target)
+            if (target not in fresh and source not in fresh and 
+                self._unfinished(source)):
+                self._pending[target] = self._pending[target] + 1
+
+    def _raise_priority(self, source, target):
+        """ Raises the priorities of the source, that the target now 
+        depends on, and of the targets the source depends on."""
+
+        workqueue = [(source, target.priority())]
+        while len(workqueue) > 0:
+            i, priority = workqueue.pop()
+            priority = i.cost() + priority
+            if priority <= i.priority():
+                continue
+            i.set_priority(priority)
+            if i in self._pending:
+                # queue it again with its new priority
+                self._push(i)
+            for src in i.src():
+                if src in self._targets and self._targets[src] in self._live:
+                    workqueue.append((self._targets[src], priority))
+
+    def _next(self, groups=None):
+        """ Pops the ready target with the highest priority among the given
+        groups, or all the groups if None."""
+
+        best = None
+        for group, heap in self._ready.items():
+            if groups is not None and group not in groups:
+                continue
+            while len(heap) > 0 and not self._is_ready(heap[0][-1]):
+                heapq.heappop(heap)
+            if len(heap) > 0 and (best is None or 
+                                  heap[0][:-1] < best[0][:-1]):
+                best = heap
+        if best is None:
+            return None
+        return heapq.heappop(best)[-1]
+
+    def _dispatch(self, target):
+        """ Marks the target as being resolved."""
+
+        target.clean()
+        self._running.add(target)
+
+    def _finished(self, target):
+        """ Updates the targets that depend on a just resolved target."""
+
+        self._running.discard(target)
+        if target.is_dirty():
+            # new dependencies were added while it was being resolved
+            self._schedule(target)
+            return
+        for i in self._sources.get(target.dst(), ()):
+            if i in self._live and i in self._pending:
+                self._pending[i] = self._pending[i] - 1
+                self._push(i)
+
+    def _skip(self, target):
+        """ Skips all the targets that, directly or not, depend on the 
+        failed target, but not through optional dependencies."""
+
+        workqueue = [target]
+        while len(workqueue) > 0:
+            i = workqueue.pop()
+            for j in self._sources.get(i.dst(), ()):
+                if (j in self._live and j.is_dirty() and 
+                    not j.is_src_optional(i.dst())):
+                    j.clean()
+                    self._skipped.append(j.dst())
+                    # for whoever optionally depends on it, it is over
+                    self._finished(j)
+                    workqueue.append(j)
+
+    def _completed(self, i, success):
+        """ Takes into account the result of a resolved target. Raises 
+        DependencyUnmet if a mandatory target failed, unless on keep going
+        mode. The targets that cannot do without it are skipped, even when
+        the failed target is an optional dependency, like the build of a 
+        module whose download failed.
+        """
+
+        with self._lock:
+            if success:
+                self._resolved.append(i.dst())
+            else:
+                self._failed.append(i.dst())
+                self._skip(i)
+            self._finished(i)
+        if success:
+            return
+        if not self._keep_going:
+            self._target_failed(i)
+            return
+        try:
+            self._target_failed(i)
+        except DependencyUnmet as e:
+            if self._unmet is None:
+                self._unmet = e
+
+    def resolved(self):
+        """ The targets resolved by the last resolution."""
+        return self._resolved
+
+    def failed(self):
+        """ The targets that failed on the last resolution."""
+        return self._failed
+
+    def skipped(self):
+        """ The targets skipped, on keep going mode, because they depend on
+        targets that failed."""
+        return self._skipped
+
+    def _check_finished(self):
+        """ Verifies that all the targets were resolved, whatever is still 
+        dirty at the end was waiting on a cycle."""
+
+        left = [i for i in self._live if i.is_dirty()]
+        if len(left) > 0:
+            cycles = self._cycles(left)
+            if len(cycles) > 0:
+                raise CycleDetected(self._cycle_path(cycles[0]))
+
+    def _call_target(self, i, callback):
+        """ Invokes the callback, or the target's own context, for one target
+        and returns True if it succeeded.
+        """
+
+        success = True
+        if callback is None and i.context() is not None:
+            try:
+                success = i.context()()
+            except TaskError as e:
+                success = False
+                print("  > Error: " + e._reason)
+#            except SystemExit as e:
+#                print(sys.exc_info())
 #
-#                    success = False
-#                    print ("  > Error: " + e._reason)
-                except:
-                    success = False
-                    import sys
+#                success = False
+#                print ("  > Error: " + e._reason)
+            except:
+                success = False
+                er = sys.exc_info()[1]
+                print("  > Error: " + str(er))
+                from bake.ModuleEnvironment import ModuleEnvironment
+                if ModuleEnvironment._stopOnError:
                     er = sys.exc_info()[1]
-                    print("  > Error: " + str(er))
-                    from bake.ModuleEnvironment import ModuleEnvironment
-                    if ModuleEnvironment._stopOnError:
-                        er = sys.exc_info()[1]
-                        sys.exit(1)
-                    
-            elif callback is not None:
-                try:
-                    success = callback(i.dst(), i.context())
-                except TaskError as e:
-                    success = False
-                    print("  > Error: " + e._reason)
-                    from bake.ModuleEnvironment import ModuleEnvironment
-                    if ModuleEnvironment._stopOnError:
-                        er = sys.exc_info()[1]
-                        sys.exit(1)
-                except:
-                    success = False
-                    import sys
+                    sys.exit(1)
+                
+        elif callback is not None:
+            try:
+                success = callback(i.dst(), i.context())
+            except TaskError as e:
+                success = False
+                print("  > Error: " + e._reason)
+                from bake.ModuleEnvironment import ModuleEnvironment
+                if ModuleEnvironment._stopOnError:
                     er = sys.exc_info()[1]
-                    print("  > Unexpected error: " + str(er))
-                    from bake.ModuleEnvironment import ModuleEnvironment
-                    if ModuleEnvironment._stopOnError:
-                        er = sys.exc_info()[1]
-                        sys.exit(1)
-            if not success:
-                if not i.dst() in self._sources:
-                    raise DependencyUnmet(i.dst())
-                else:
-                    for j in self._sources[i.dst()]:
-                        dependencyTmp= self.dependencies.get(i.dst()._name)
-                        if dependencyTmp:
-                            if isinstance(i.dst()._source, SystemDependency):
-                                tailError =  'not available'
-                            else:
-                                tailError =  'failed'
-                                
-                            if not dependencyTmp.optionalChain:
-                                raise DependencyUnmet(i.dst(), tailError)
-                            
-                            if not self.dependencies[i.dst()._name].moduleProblem:
-                                
-                                print(' > Problem: Optional dependency,'
-                                             ' module "%s" %s\n'
-                                             '   This may reduce the  '
-                                             'functionality of the final build. \n'
-                                             '   However, bake will continue since'
-                                             ' "%s" is not an essential dependency.\n'
-                                             '   For more'
-                                             ' information call bake with -v or -vvv, for full verbose mode.\n' 
-                                             % (i.dst()._name,tailError, i.dst()._name))
-                                self.dependencies[i.dst()._name].moduleProblem = True
-            if self._dirty:
-                self._dirty = False
-                return False
-        return True
+                    sys.exit(1)
+            except:
+                success = False
+                er = sys.exc_info()[1]
+                print("  > Unexpected error: " + str(er))
+                from bake.ModuleEnvironment import ModuleEnvironment
+                if ModuleEnvironment._stopOnError:
+                    er = sys.exc_info()[1]
+                    sys.exit(1)
+        return success
+
+    def _target_failed(self, i):
+        """ Handles a target whose callback failed. Raises DependencyUnmet 
+        if the target is a mandatory dependency, otherwise warns the user 
+        that an optional dependency is missing.
+        """
+
+        if not i.dst() in self._sources:
+            raise DependencyUnmet(i.dst())
+        else:
+            for j in self._sources[i.dst()]:
+                dependencyTmp= self.dependencies.get(getattr(i.dst(), 
+                                                             '_name', None))
+                if dependencyTmp:
+                    if isinstance(i.dst()._source, SystemDependency):
+                        tailError =  'not available'
+                    else:
+                        tailError =  'failed'
+                        
+                    if not dependencyTmp.optionalChain:
+                        raise DependencyUnmet(i.dst(), tailError)
+                    
+                    if not self.dependencies[i.dst()._name].moduleProblem:
+                        
+                        print(' > Problem: Optional dependency,'
+                                     ' module "%s" %s\n'
+                                     '   This may reduce the  '
+                                     'functionality of the final build. \n'
+                                     '   However, bake will continue since'
+                                     ' "%s" is not an essential dependency.\n'
+                                     '   For more'
+                                     ' information call bake with -v or -vvv, for full verbose mode.\n' 
+                                     % (i.dst()._name,tailError, i.dst()._name))
+                        self.dependencies[i.dst()._name].moduleProblem = True
 
     def _resolve_serial(self, targets, callback):
         """ Resolves the dependencies in serial mode."""
         
-        finished = self._resolve_one_iteration(targets, callback)
-        while not finished:
-            finished = self._resolve_one_iteration(targets, callback)
+        while True:
+            with self._lock:
+                i = self._next()
+                if i is None:
+                    self._check_finished()
+                    return
+                self._dispatch(i)
+            success = self._call_target(i, callback)
+            self._completed(i, success)
+
+    def _resolve_parallel(self, targets, callback, n, limits=None):
+        """ Resolves the dependencies in parallel mode. Every target whose 
+        dependencies are already resolved is handed to a worker thread, with 
+        at most n targets, plus the ones of each group in limits, being 
+        resolved at the same time.
+        """
 
-    def _resolve_parallel(self, targets, callback, n):
-        """ Resolves the dependencies in parallel mode. Not yet functional."""
-        
-        # todo: implement parallel version
-        self._resolve_serial(targets, callback)
-        
-    
-    dependencies=dict()
-    modTmp = dict()
-    def recDependencies(self, targetModule, optionalDepChain):
-        existModule = self.dependencies.get(targetModule._name)
-        
-        # verify if the module exist or not if does not insert it as a dependency
-        if not existModule:
-            self.dependencies[targetModule._name] = DependencyLink(optionalDepChain, targetModule)
-        elif existModule.optionalChain and not optionalDepChain : # if it exists check if the 
-            self.dependencies[targetModule._name].optionalChain = optionalDepChain
-            
-        if targetModule._dependencies:
-            for j in targetModule._dependencies:
-                if j._optional:
-                    optionalDepChain= j._optional
-                self.recDependencies(self.modTmp[j._name], optionalDepChain)
-        
+        if limits is None:
+            limits = dict()
+        done = Queue()
+        # number of running targets per group
+        slots = dict()
+        error = None
+
+        def worker(target):
+            try:
+                done.put((target, self._call_target(target, callback), None))
+            except BaseException:
+                done.put((target, False, sys.exc_info()[1]))
+
+        while True:
+            # once something went wrong, we just wait for the targets 
+            # that are still running and do not start anything new
+            if error is None:
+                with self._lock:
+                    while True:
+                        groups = [group for group in self._ready 
+                                  if slots.get(group, 0) < 
+                                     limits.get(group, n)]
+                        i = self._next(groups)
+                        if i is None:
+                            break
+                        self._dispatch(i)
+                        slots[i.group()] = slots.get(i.group(), 0) + 1
+                        thread = threading.Thread(target=worker, args=(i,))
+                        thread.daemon = True
+                        thread.start()
+
+            with self._lock:
+                if len(self._running) == 0:
+                    if error is None:
+                        self._check_finished()
+                    break
+
+            i, success, exception = done.get()
+            with self._lock:
+                slots[i.group()] -= 1
+            if exception is not None or error is not None:
+                with self._lock:
+                    self._finished(i)
+                if error is None:
+                    error = exception
+            else:
+                try:
+                    self._completed(i, success)
+                except DependencyUnmet as e:
+                    error = e
 
+        if error is not None:
+            raise error
         
+    
     def checkDependencies(self, targets, modules):
-        enabled = copy.copy(targets)
+        """ Finds, for each module the targets depend upon, if the module 
+        is only reachable through optional dependencies, i.e. if it is on an
+        optional chain. Each module and dependency is visited only once.
+        """
         
+        modules_by_name = dict()
         for i in modules:
-            self.modTmp[i._name]=i
+            modules_by_name[i._name] = i
         
-        for i in enabled:
-            self.dependencies[i._name]= DependencyLink(False, i)
-            if i._dependencies:
+        self.dependencies = dict()
+        # first the modules reachable through mandatory dependencies only,
+        # then the ones that can only be reached through optional ones
+        mandatory = list(targets)
+        optional = []
+        for workqueue, optionalChain in [(mandatory, False), (optional, True)]:
+            while len(workqueue) > 0:
+                i = workqueue.pop()
+                if i._name in self.dependencies:
+                    continue
+                self.dependencies[i._name] = DependencyLink(optionalChain, i)
                 for j in i._dependencies:
-                    self.recDependencies(self.modTmp[j._name], j._optional)
+                    module = modules_by_name.get(j._name)
+                    if module is None:
+                        continue
+                    if j._optional and not optionalChain:
+                        optional.append(module)
+                    else:
+                        workqueue.append(module)
         
         return self.dependencies
-
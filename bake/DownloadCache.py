@@ -0,0 +1,235 @@
+###############################################################################
+# Copyright (c) 2013 INRIA
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation;
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Authors: Daniel Camara  <daniel.camara@inria.fr>
+#          Mathieu Lacage <mathieu.lacage@sophia.inria.fr>
+###############################################################################
+'''
+ DownloadCache.py
+
+ Cache of the downloads, that may be shared by all the workspaces of a
+ machine. It keeps a bare mirror of each git repository the modules come
+ from, so that a new workspace only copies the objects from it and 
+ fetches what changed since the last download of the repository. The
+ mercurial repositories are pooled the same way, the workspaces are local
+ clones of the pool, that share its files through hardlinks. The archives
+ are stored under their SHA-256 digest, once verified.
+'''
+
+import os
+import re
+import shutil
+import hashlib
+import tempfile
+import subprocess
+
+from bake.Exceptions import TaskError
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+class DownloadCache:
+    """ Download cache stored on a directory. The mirrors are refreshed 
+    while holding a file lock, so that the bake runs sharing the cache do
+    not update a same mirror at once.
+    """
+
+    GIT = 'git'
+    HG = 'hg'
+    ARCHIVES = 'archives'
+    LOCKS = 'locks'
+    # prefix of the mirrors being created
+    TMP = '.tmp-'
+
+    def __init__(self, directory, dissolve=False):
+        self._directory = os.path.abspath(directory)
+        self._dissolve = dissolve
+
+    def directory(self):
+        return self._directory
+
+    def dissolve(self):
+        """ Verifies if the workspaces get their own copy of the objects,
+        instead of reading them from the mirrors."""
+        return self._dissolve
+
+    def _makedirs(self, dirname):
+        """ Creates the directory, other processes may be creating it too."""
+
+        if not os.path.isdir(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError:
+                if not os.path.isdir(dirname):
+                    raise
+
+    @classmethod
+    def _name(cls, url):
+        """ Name of the entry of the url: a hash of the url, followed by its
+        last component to be readable."""
+
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()[:16]
+        base = re.sub(r'[^A-Za-z0-9._-]', '_', 
+                      os.path.basename(url.rstrip('/')))
+        return key + '-' + (base or 'repository')
+
+    def lock(self, name):
+        """ Lock of the entry with the given name, shared with the other 
+        processes, to be used in a with statement."""
+
+        dirname = os.path.join(self._directory, self.LOCKS)
+        self._makedirs(dirname)
+        return _FileLock(os.path.join(dirname, name + '.lock'))
+
+    def git_mirror(self, env, url):
+        """ Returns the path of the mirror of the git repository, after
+        fetching into it what changed on the repository."""
+
+        name = self._name(url)
+        if not name.endswith('.git'):
+            name = name + '.git'
+        dirname = os.path.join(self._directory, self.GIT)
+        path = os.path.join(dirname, name)
+        with self.lock(self.GIT + '-' + name):
+            if os.path.isdir(path):
+                env.run(['git', 'fetch', '--prune', '--quiet', 'origin'], 
+                        directory=path)
+                return path
+            self._makedirs(dirname)
+            tmp = tempfile.mkdtemp(prefix=self.TMP, dir=dirname)
+            try:
+                env.run(['git', 'clone', '--mirror', '--quiet', url, tmp], 
+                        directory=dirname)
+                # the workspaces borrow its objects, they are never removed
+                env.run(['git', 'config', 'gc.pruneExpire', 'never'], 
+                        directory=tmp)
+                os.rename(tmp, path)
+                tmp = None
+            finally:
+                if tmp is not None:
+                    shutil.rmtree(tmp, ignore_errors=True)
+        return path
+
+    def archive(self, digest, filename):
+        """ Path of the archive with the given SHA-256 digest and file 
+        name in the cache, the archive may not be there."""
+
+        return os.path.join(self._directory, self.ARCHIVES, digest[:2], 
+                            digest, filename)
+
+    def temporary(self):
+        """ Returns a new temporary file of the cache, to download an 
+        archive into."""
+
+        dirname = os.path.join(self._directory, self.ARCHIVES)
+        self._makedirs(dirname)
+        fd, path = tempfile.mkstemp(prefix=self.TMP, dir=dirname)
+        os.close(fd)
+        return path
+
+    def add_archive(self, path, digest, filename):
+        """ Publishes the temporary file, a verified archive, under its 
+        digest. The archive becomes visible at once, when it is complete.
+        """
+
+        archive = self.archive(digest, filename)
+        self._makedirs(os.path.dirname(archive))
+        # readable by the other users of a shared cache
+        os.chmod(path, 0o644)
+        os.rename(path, archive)
+
+    def hg_repository(self, env, url, revision=None):
+        """ Returns the path of the pooled copy of the mercurial 
+        repository, after pulling into it the new changesets. Nothing is 
+        pulled if the pool already has the revision, and the revision 
+        cannot move, i.e. it is a changeset id or a tag."""
+
+        dirname = os.path.join(self._directory, self.HG)
+        path = os.path.join(dirname, self._name(url))
+        with self.lock(self.HG + '-' + self._name(url)):
+            if os.path.isdir(path):
+                if not self._hg_fixed(path, revision):
+                    env.run(['hg', 'pull', '-q', url], directory=path)
+                return path
+            self._makedirs(dirname)
+            tmp = tempfile.mkdtemp(prefix=self.TMP, dir=dirname)
+            try:
+                try:
+                    # the server sends its store files as they are
+                    env.run(['hg', 'clone', '-U', '-q', '--stream', url, 
+                             tmp], directory=dirname)
+                except TaskError:
+                    # servers that do not allow stream clones
+                    shutil.rmtree(tmp)
+                    env.run(['hg', 'clone', '-U', '-q', url, tmp], 
+                            directory=dirname)
+                os.rename(tmp, path)
+                tmp = None
+            finally:
+                if tmp is not None:
+                    shutil.rmtree(tmp, ignore_errors=True)
+        return path
+
+    def _hg_fixed(self, path, revision):
+        """ Verifies if the pool has the revision, and if it always names
+        the same changeset."""
+
+        if not revision or revision == 'tip':
+            return False
+        node = self._output(['hg', 'log', '-r', revision, '-T', '{node}'],
+                            path)
+        if not node:
+            return False
+        if re.match(r'^[0-9a-f]{12,40}$', revision) and \
+           node.startswith(revision):
+            return True
+        tags = self._output(['hg', 'tags', '-q'], path)
+        return tags is not None and revision in tags.split()
+
+    def _output(self, args, directory):
+        """ Returns the output of the given command, None if it fails."""
+
+        try:
+            popen = subprocess.Popen(args, stdout=subprocess.PIPE,
+                                     stderr=subprocess.PIPE, cwd=directory)
+            out = popen.communicate()[0]
+        except OSError:
+            return None
+        if popen.returncode != 0:
+            return None
+        return out.decode('utf-8', 'replace').strip()
+
+class _FileLock:
+    """ Exclusive lock on a file, held inside a with statement."""
+
+    def __init__(self, path):
+        self._path = path
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self._path, 'a')
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
+        return False
@@ -22,60 +22,377 @@
 
  Monitors the file system to keep track of files changes.
 
- The idea is that we want to implement a version of this class
- that uses the OS native FS monitoring API. Someday, will do this
- but this code works well anywhere.
+ On Linux the changes are watched with inotify, elsewhere, or when the 
+ watches cannot be set, two snapshots of the directory are compared. When
+ the watch loses changes, the files changed since the start are found from
+ their change times.
 ''' 
 
 import os
+import select
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+class Inotify:
+    """ Recursive inotify watch of a directory, that keeps the files 
+    created, modified and deleted under it. The events are read by a 
+    thread, so that the kernel queue does not overflow during long builds.
+    """
+
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_DONT_FOLLOW = 0x02000000
+    IN_ISDIR = 0x40000000
+    IN_CLOEXEC = 0o2000000
+    IN_NONBLOCK = 0o4000
+
+    MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | 
+            IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR | IN_DONT_FOLLOW)
+    EVENT = struct.Struct('iIII')
+    # seconds between two checks of the end of the watch
+    POLL_INTERVAL = 0.1
+
+    _libc = None
+
+    @classmethod
+    def _load(cls):
+        """ The C library, if it has inotify, None otherwise."""
+
+        if cls._libc is None:
+            cls._libc = False
+            if sys.platform.startswith('linux'):
+                try:
+                    import ctypes
+                    import ctypes.util
+                    libc = ctypes.CDLL(ctypes.util.find_library('c') or 
+                                       'libc.so.6', use_errno=True)
+                    libc.inotify_init1
+                    libc.inotify_add_watch.argtypes = [ctypes.c_int, 
+                                                       ctypes.c_char_p, 
+                                                       ctypes.c_uint32]
+                    cls._libc = libc
+                except (ImportError, OSError, AttributeError):
+                    pass
+        return cls._libc or None
+
+    @classmethod
+    def watch(cls, dirname):
+        """ Starts watching the directory, returns None if inotify is not 
+        available or the directory cannot be watched."""
+
+        libc = cls._load()
+        if libc is None or not os.path.isdir(dirname):
+            return None
+        fd = libc.inotify_init1(cls.IN_NONBLOCK | cls.IN_CLOEXEC)
+        if fd < 0:
+            return None
+        inotify = cls(libc, fd)
+        if not inotify._add(dirname, False):
+            os.close(fd)
+            return None
+        inotify._thread.start()
+        return inotify
+
+    def __init__(self, libc, fd):
+        self._libc = libc
+        self._fd = fd
+        self._watches = dict()
+        self._created = set()
+        self._modified = set()
+        self._deleted = set()
+        self._overflow = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def _add(self, dirname, created):
+        """ Watches the directory and the ones under it. When they were 
+        created during the watch, their files are created too."""
+
+        def watch(root):
+            # the watch is set before the directory is listed, the files
+            # created in between are both listed and seen
+            path = root
+            if not isinstance(path, bytes):
+                path = path.encode(sys.getfilesystemencoding())
+            wd = self._libc.inotify_add_watch(self._fd, path, self.MASK)
+            if wd < 0:
+                # the directory is already gone, or there are no watches
+                # left, in which case the changes under it are not seen
+                if os.path.isdir(root):
+                    self._overflow = True
+                return False
+            self._watches[wd] = root
+            return True
+
+        for root, dirs, files in _walk(dirname, visit=watch):
+            if created:
+                for name in files:
+                    self._created.add(os.path.join(root, name))
+        return created or dirname in self._watches.values()
+
+    def _run(self):
+        """ Reads the events until the watch ends."""
+
+        while not self._stop.is_set():
+            try:
+                ready = select.select([self._fd], [], [], 
+                                      self.POLL_INTERVAL)[0]
+            except (OSError, select.error):
+                continue
+            if ready:
+                self._read()
+
+    def _read(self):
+        """ Reads and handles the events waiting in the queue."""
+
+        while True:
+            try:
+                data = os.read(self._fd, 65536)
+            except OSError:
+                return
+            if not data:
+                return
+            offset = 0
+            while offset + self.EVENT.size <= len(data):
+                wd, mask, cookie, length = self.EVENT.unpack_from(data, 
+                                                                  offset)
+                offset = offset + self.EVENT.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset = offset + length
+                self._event(wd, mask, name)
+
+    def _event(self, wd, mask, name):
+        """ Keeps the change the event is about."""
+
+        if mask & self.IN_Q_OVERFLOW:
+            self._overflow = True
+            return
+        if mask & self.IN_IGNORED:
+            self._watches.pop(wd, None)
+            return
+        directory = self._watches.get(wd)
+        if directory is None or not name:
+            return
+        if not isinstance(directory, bytes):
+            name = name.decode(sys.getfilesystemencoding(), 'surrogateescape'
+                               if sys.version_info[0] > 2 else 'strict')
+        path = os.path.join(directory, name)
+
+        if mask & self.IN_ISDIR:
+            if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                self._add(path, True)
+            elif mask & self.IN_MOVED_FROM:
+                # what was under it is not known, but is gone
+                self._deleted.add(path)
+                prefix = path + os.sep
+                self._created = set([f for f in self._created 
+                                     if not f.startswith(prefix)])
+            return
+        if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+            if path in self._deleted:
+                self._deleted.discard(path)
+                self._modified.add(path)
+            elif not path in self._modified:
+                self._created.add(path)
+        elif mask & (self.IN_MODIFY | self.IN_ATTRIB | self.IN_CLOSE_WRITE):
+            if not path in self._created:
+                self._modified.add(path)
+        elif mask & (self.IN_DELETE | self.IN_MOVED_FROM):
+            if path in self._created:
+                self._created.discard(path)
+            else:
+                self._modified.discard(path)
+                self._deleted.add(path)
+
+    def end(self):
+        """ Ends the watch and returns the files created, modified and 
+        deleted, None if some of the changes were lost."""
+
+        self._stop.set()
+        self._thread.join()
+        self._read()
+        os.close(self._fd)
+        if self._overflow:
+            return None
+        # files that came and went only appear as created
+        self._created = set([f for f in self._created if os.path.lexists(f)])
+        return (self._created, self._modified, self._deleted)
+
 
 class FilesystemMonitor:
     """ Main file monitoring class."""
 
-    def __init__(self, dirname):
+    # seconds to wait at most for the clock of the file system to tick
+    CLOCK_WAIT = 2
+
+    def __init__(self, dirname, inotify=True, known=()):
         self._files = None
         self._dirname = dirname
-        
-    def _parse(self, dirname):
-        """ Search for the files on the target directory."""
-    
-        result = []
-        for root, dirs, files in os.walk(dirname):
-            result.extend([os.path.join(root, f) for f in files])
-        result.sort()
-        return result
-    
+        self._inotify = inotify
+        self._known = known
+        self._watch = None
+        self._start = None
+        self._changes = (set(), set(), set())
+
+    @classmethod
+    def _snapshot(cls, dirname):
+        """ The inode, size and modification time of the files under the
+        directory."""
+
+        snapshot = dict()
+        for root, dirs, files in _walk(dirname, True):
+            for name, st in files.items():
+                if st is None:
+                    try:
+                        st = os.lstat(os.path.join(root, name))
+                    except OSError:
+                        continue
+                mtime = getattr(st, 'st_mtime_ns', None)
+                if mtime is None:
+                    mtime = int(st.st_mtime * 1000000000)
+                snapshot[os.path.join(root, name)] = (st.st_ino, st.st_size, 
+                                                      mtime)
+        return snapshot
+
+    @classmethod
+    def _now(cls, dirname):
+        """ The current time of the file system of the directory, that may
+        run behind time.time() and tick coarsely. The files changed before
+        the call have older change times, the ones changed after it have
+        the same or later change times."""
+
+        try:
+            (fd, path) = tempfile.mkstemp(dir=dirname, prefix='.bake-monitor')
+        except (IOError, OSError):
+            return time.time()
+        try:
+            before = now = os.fstat(fd).st_ctime
+            # waits for the clock to tick, some file systems keep seconds
+            deadline = time.time() + cls.CLOCK_WAIT
+            while now <= before and time.time() < deadline:
+                time.sleep(0.001)
+                os.utime(path, None)
+                now = os.fstat(fd).st_ctime
+            return now
+        finally:
+            os.close(fd)
+            os.remove(path)
+
+    def _scan(self):
+        """ The files created, modified and deleted since the start, found
+        from their change times, that the installers cannot set back, and
+        the files known to be there before."""
+
+        changed = set()
+        for root, dirs, files in _walk(self._dirname, True):
+            for name, st in files.items():
+                path = os.path.join(root, name)
+                if st is None:
+                    try:
+                        st = os.lstat(path)
+                    except OSError:
+                        continue
+                if max(st.st_ctime, st.st_mtime) >= self._start:
+                    changed.add(path)
+        known = set(self._known)
+        deleted = set([f for f in known if not os.path.lexists(f)])
+        return (changed - known, changed & known, deleted)
+
     def start(self):
-        self._files = self._parse(self._dirname)
-        
-    def _skip_until_different(self, a, ai, b, bi):
-        """ Stops if find any difference between the presented lists."""
-        
-        while ai < len(a) and bi < len(b) and a[ai] == b[bi]:
-            ai = ai + 1
-            bi = bi + 1
-        return (ai,bi)
-    
-    def _skip_until_equal(self, files, i, value):
-        """ Stops if find the given file on the presented list."""
-        
-        while i < len(files) and files[i] != value:
-            i = i + 1
-        return i
-    
+        """ Starts monitoring the directory."""
+
+        self._watch = None
+        if self._inotify:
+            # taken before the watch, that does not see the time probe
+            self._start = self._now(self._dirname)
+            self._watch = Inotify.watch(self._dirname)
+        if self._watch is None:
+            self._files = self._snapshot(self._dirname)
+
     def end(self):
-        """ Finds the changed files list."""
-        
-        files = self._parse(self._dirname)
-        result = []
-        i = 0
-        j = 0
-        while j < len(files):
-            i, j = self._skip_until_different(self._files, i, files, j)
-            if i != len(self._files):
-                k = self._skip_until_equal(files, j, self._files[i])
-            else:
-                k = len(files)
-            result.extend(files[j:k])
-            j = k
-        return result
+        """ Finds the files created or modified since the start, sorted."""
+
+        if self._watch is not None:
+            changes = self._watch.end()
+            self._watch = None
+            if changes is None:
+                # the watch lost changes
+                changes = self._scan()
+        else:
+            after = self._snapshot(self._dirname)
+            before = self._files
+            created = set(after) - set(before)
+            deleted = set(before) - set(after)
+            modified = set([f for f in after if f in before and 
+                            after[f] != before[f]])
+            changes = (created, modified, deleted)
+        self._changes = changes
+        self._files = None
+        return sorted(changes[0] | changes[1])
+
+    def created(self):
+        """ The files created between the start and the end, sorted."""
+        return sorted(self._changes[0])
+
+    def modified(self):
+        """ The files that existed at the start and were modified, sorted."""
+        return sorted(self._changes[1])
+
+    def deleted(self):
+        """ The files that existed at the start and were deleted, sorted."""
+        return sorted(self._changes[2])
+
+
+def _walk(dirname, stat=False, visit=None):
+    """ Walks the directory tree like os.walk, the files are given as a 
+    dictionary of their stat, if asked for and os.scandir is there, or of 
+    None. The visit function is called on the directories before they are
+    listed, those it returns False for are skipped."""
+
+    pending = [dirname]
+    while pending:
+        root = pending.pop()
+        if visit is not None and not visit(root):
+            continue
+        dirs = []
+        files = dict()
+        if not hasattr(os, 'scandir'):
+            try:
+                names = os.listdir(root)
+            except OSError:
+                continue
+            for name in names:
+                path = os.path.join(root, name)
+                if os.path.isdir(path) and not os.path.islink(path):
+                    dirs.append(name)
+                else:
+                    files[name] = None
+        else:
+            try:
+                entries = list(os.scandir(root))
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.append(entry.name)
+                    elif stat:
+                        files[entry.name] = entry.stat(follow_symlinks=False)
+                    else:
+                        files[entry.name] = None
+                except OSError:
+                    pass
+        yield root, dirs, files
+        pending.extend([os.path.join(root, d) for d in dirs])
@@ -0,0 +1,92 @@
+###############################################################################
+# Copyright (c) 2013 INRIA
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation;
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Authors: Daniel Camara  <daniel.camara@inria.fr>
+#          Mathieu Lacage <mathieu.lacage@sophia.inria.fr>
+###############################################################################
+'''
+ HostLimiter.py
+
+ Limits the downloads that run at the same time, in total and per host, so
+ that parallel downloads do not flood the servers of the modules.
+'''
+
+import threading
+
+class HostLimiter:
+    """ Slots of the downloads. A download takes one of the total slots and 
+    one of the slots of its host for as long as it runs. A limit of 0 means
+    there is no limit.
+    """
+
+    # downloads from the same host that may run at the same time, by default
+    DEFAULT_HOST_JOBS = 4
+
+    def __init__(self, jobs=0, host_jobs=DEFAULT_HOST_JOBS):
+        self._jobs = jobs
+        self._host_jobs = host_jobs
+        self._condition = threading.Condition()
+        self._running = 0
+        self._hosts = dict()
+
+    def jobs(self):
+        """ Downloads that may run at the same time, 0 if not limited."""
+        return self._jobs
+
+    def _full(self, host):
+        """ Verifies if a new download from the host has to wait."""
+
+        if self._jobs > 0 and self._running >= self._jobs:
+            return True
+        return (host != '' and self._host_jobs > 0 and 
+                self._hosts.get(host, 0) >= self._host_jobs)
+
+    def acquire(self, host):
+        """ Waits until a download from the host may start."""
+
+        with self._condition:
+            while self._full(host):
+                self._condition.wait()
+            self._running = self._running + 1
+            self._hosts[host] = self._hosts.get(host, 0) + 1
+
+    def release(self, host):
+        """ Signals the end of a download from the host."""
+
+        with self._condition:
+            self._running = self._running - 1
+            self._hosts[host] = self._hosts[host] - 1
+            self._condition.notify_all()
+
+    def slot(self, host):
+        """ Slot of a download from the host, to be used in a with 
+        statement."""
+        return _Slot(self, host)
+
+class _Slot:
+    """ A download slot, held inside a with statement."""
+
+    def __init__(self, limiter, host):
+        self._limiter = limiter
+        self._host = host
+
+    def __enter__(self):
+        self._limiter.acquire(self._host)
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self._limiter.release(self._host)
+        return False
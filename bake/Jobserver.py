@@ -0,0 +1,134 @@
+###############################################################################
+# Copyright (c) 2013 INRIA
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation;
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Authors: Daniel Camara  <daniel.camara@inria.fr>
+#          Mathieu Lacage <mathieu.lacage@sophia.inria.fr>
+###############################################################################
+'''
+ Jobserver.py
+
+ GNU make compatible jobserver. When several modules are built at the
+ same time, their build tools share the job slots of a single token pipe,
+ instead of each one of them running as many jobs as asked for.
+'''
+
+import os
+import errno
+import fcntl
+import select
+
+class Jobserver:
+    """ Token pipe shared by the build tools of the modules being built.
+    As with make, each running build has one implicit job slot, the pipe
+    holds the tokens of the other jobs.
+    """
+
+    def __init__(self, jobs, parent=None):
+        self._jobs = max(1, jobs)
+        # the jobserver the tokens were taken from, if any
+        self._parent = parent
+        self._read, self._write = os.pipe()
+        for fd in [self._read, self._write]:
+            # python 3 pipes are not inherited by default
+            if hasattr(os, 'set_inheritable'):
+                os.set_inheritable(fd, True)
+        # another thread, or a build tool, may take the token that select
+        # saw, the read then fails instead of waiting. make 4 sets it too
+        flags = fcntl.fcntl(self._read, fcntl.F_GETFL)
+        fcntl.fcntl(self._read, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self.release(self._jobs - 1)
+
+    @classmethod
+    def supported(cls):
+        """ The token pipe is only understood by the posix build tools."""
+
+        return os.name == 'posix'
+
+    def jobs(self):
+        return self._jobs
+
+    def fds(self):
+        """ The pipe descriptors the build tools have to inherit."""
+
+        return (self._read, self._write)
+
+    def makeflags(self, makeflags=''):
+        """ Returns the MAKEFLAGS that make the tools join the jobserver,
+        keeping the flags the user may already have set.
+        """
+
+        auth = '%d,%d' % (self._read, self._write)
+        # make < 4.2 only knows --jobserver-fds
+        flags = ' -j%d --jobserver-fds=%s --jobserver-auth=%s' % (self._jobs,
+                                                                  auth, auth)
+        return makeflags.strip() + flags
+
+    def acquire(self, tokens=None, wait=False):
+        """ Takes up to tokens free job slots, by default all the free 
+        slots. This is for tools that cannot join the jobserver themselves,
+        they run with the returned number of tokens plus their implicit 
+        slot. With wait, it waits for the first token, if any is asked for,
+        otherwise it never waits.
+        """
+
+        if tokens is None:
+            tokens = self._jobs - 1
+        acquired = 0
+        while acquired < tokens:
+            timeout = 0
+            if wait and acquired == 0:
+                timeout = None
+            try:
+                readable = select.select([self._read], [], [], timeout)[0]
+                if not readable:
+                    break
+                acquired = acquired + len(os.read(self._read, 
+                                                  tokens - acquired))
+            except (OSError, IOError, select.error) as e:
+                # the token was taken by someone else meanwhile
+                if e.args[0] not in [errno.EAGAIN, errno.EINTR]:
+                    raise
+        return acquired
+
+    def share(self, jobs):
+        """ Returns a jobserver of at most jobs slots, for a build tool that
+        has to run less jobs than this jobserver allows. Its tokens are 
+        taken from this jobserver, waiting for the first one, and are given
+        back when it is closed.
+        """
+
+        tokens = self.acquire(jobs - 1, wait=True)
+        return Jobserver(tokens + 1, (self, tokens))
+
+    def release(self, tokens):
+        """ Gives back job slots to the jobserver."""
+
+        if tokens > 0:
+            os.write(self._write, b'+' * tokens)
+
+    def close(self):
+        """ Closes the token pipe, and gives the tokens back to the 
+        jobserver they were taken from, if any."""
+
+        for fd in [self._read, self._write]:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        if self._parent is not None:
+            parent, tokens = self._parent
+            self._parent = None
+            parent.release(tokens)
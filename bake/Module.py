@@ -30,6 +30,10 @@ import os
 import re
 import sys
 import shutil
+import time
+import hashlib
+import threading
+import bake.Utils
 
 from bake.FilesystemMonitor import FilesystemMonitor
 from bake.Exceptions import TaskError
@@ -120,7 +124,9 @@ class Module:
                  max_ver,
                  dependencies = [],
                  built_once = False,
-                 installed = []):
+                 installed = [],
+                 durations = None,
+                 fingerprint = None):
         self._name = name
         self._type = mtype
         self._dependencies = copy.copy(dependencies)
@@ -128,6 +134,10 @@ class Module:
         self._build = build
         self._built_once = built_once
         self._installed = installed
+        # seconds the last download and build of the module took
+        self._durations = dict(durations or {})
+        # fingerprint of the sources and dependencies of the last build
+        self._fingerprint = fingerprint
         self._minVersion = min_ver
         self._maxVersion = max_ver
 
@@ -141,6 +151,31 @@ class Module:
         """ Stores the given value on the module installed option. """
         self._installed = copy.copy(value)
 
+    @property
+    def durations(self):
+        """ Returns the time, in seconds, the last runs of each phase 
+        of the module took. """
+        return self._durations
+    @durations.setter
+    def durations(self, value):
+        """ Stores the times the phases of the module took. """
+        self._durations = dict(value)
+
+    @property
+    def fingerprint(self):
+        """ Returns the fingerprint of the module when it was last built,
+        None if it was not built. """
+        return self._fingerprint
+    @fingerprint.setter
+    def fingerprint(self, value):
+        """ Stores the fingerprint of the module last build. """
+        self._fingerprint = value
+
+    def duration(self, phase):
+        """ Returns the time the last run of the phase took, or None if 
+        it was never recorded. """
+        return self._durations.get(phase)
+
     def _directory(self):
         return self._name
 
@@ -170,14 +205,17 @@ class Module:
 
     def _do_download(self, env, source, name, forceDownload):
         """ Recursive download function, do the download for each 
-        target module. """
+        target module. Returns True if something was really downloaded.
+        """
         
+        downloaded = False
         srcDirTmp = name
         if source.attribute('module_directory').value :
             srcDirTmp = source.attribute('module_directory').value
             
         env.start_source(name, srcDirTmp)
-        rt = source.check_version(env)
+        with env.trace('source check'):
+            rt = source.check_version(env)
         
         if forceDownload:
             try: # when forced download, removes the repository if it exists
@@ -210,18 +248,55 @@ class Module:
             env.end_source()
         else:
             try:
-                source.download(env)
+                downloaded = True
+                with env.trace('download'):
+                    with env.downloads.slot(source.host()):
+                        source.download(env)
                 if self._source.attribute('patch').value != '':
-                    self._build.threat_patch(env, self._source.attribute('patch').value)
+                    with env.trace('patch'):
+                        self._build.threat_patch(env, self._source.attribute('patch').value)
                 if self._source.attribute('new_variable').value != '':
                     elements = env.replace_variables(self._source.attribute('new_variable').value).split(";")
                     env.add_variables(elements)
                 if self._source.attribute('post_download').value != '':
-                    self._source.perform_post_download(env)
+                    with env.trace('post_download'):
+                        self._source.perform_post_download(env)
             finally:
                 env.end_source()
-        for child, child_name in source.children():
-            self._do_download(env, child, os.path.join(name, child_name))
+        children = source.children()
+        if len(children) > 1 and env.downloads.jobs() > 1:
+            return self._download_children(env, children, name, 
+                                           forceDownload) or downloaded
+        for child, child_name in children:
+            downloaded = self._do_download(env, child, 
+                                           os.path.join(name, child_name),
+                                           forceDownload) or downloaded
+        return downloaded
+
+    def _download_children(self, env, children, name, forceDownload):
+        """ Downloads the children sources in parallel, each one with its
+        own environment. Returns True if something was really downloaded.
+        """
+
+        results = []
+        errors = []
+        def download(child, child_name):
+            try:
+                results.append(self._do_download(env.fork(), child, 
+                                                 os.path.join(name, 
+                                                              child_name),
+                                                 forceDownload))
+            except BaseException:
+                errors.append(sys.exc_info()[1])
+        threads = [threading.Thread(target=download, args=child) 
+                   for child in children]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+        return True in results
 
     def download(self, env, forceDownload):
         """ General download function. """
@@ -238,7 +313,10 @@ class Module:
                        self._name, platform.system(), distname,version,ids))
             
         try:
-            self._do_download(env, self._source, self._name, forceDownload)
+            start = time.time()
+            if self._do_download(env, self._source, self._name, 
+                                 forceDownload):
+                self._durations['download'] = time.time() - start
 
             if isinstance(self._source, SystemDependency):
                 self.printResult(env, "Dependency ", self.OK)
@@ -414,8 +492,103 @@ class Module:
         self._installed = []
 
 
-    def build(self, env, jobs, force_clean):
-        """ Main build function. """
+    def current_fingerprint(self, env, dependencies):
+        """ Fingerprint of the module as it is now: of its source tree, from
+        the VCS head and the sizes and modification times of the files, of
+        its build attributes and of the given (name, fingerprint) of its 
+        dependencies. No tool is run. None if the sources are not there.
+        """
+
+        srcDirTmp = self._name
+        if self._source.attribute('module_directory').value :
+            srcDirTmp = self._source.attribute('module_directory').value
+
+        env.start_source(self._name, srcDirTmp)
+        try:
+            srcdir = env.srcdir
+            if not os.path.isdir(srcdir):
+                return None
+            head = self._source.head(env)
+        finally:
+            env.end_source()
+
+        skip = set()
+        if self._build.objdir:
+            skip.add(os.path.normpath(os.path.join(srcdir, 
+                                                   self._build.objdir)))
+        fields = [('head', head), 
+                  ('tree', bake.Utils.stat_tree_hash(srcdir, skip)),
+                  ('installdir', env.installdir),
+                  ('dependencies', sorted(dependencies))]
+        for prefix, block in [('source.', self._source), 
+                              ('build.', self._build)]:
+            for attribute in sorted(block.attributes(), 
+                                    key=lambda a: a.name):
+                fields.append((prefix + attribute.name, str(attribute.value)))
+        return hashlib.sha256(repr(fields).encode('utf-8')).hexdigest()
+
+    def is_up_to_date(self, fingerprint):
+        """ Verifies if the module was built with the given fingerprint, and
+        its installed files are still there."""
+
+        if not self._built_once or fingerprint is None:
+            return False
+        if fingerprint != self._fingerprint:
+            return False
+        for installed in self._installed:
+            if not os.path.lexists(installed):
+                return False
+        return True
+
+    def keep_build(self, env):
+        """ Keeps the previous build of the module, that is up to date, only
+        the variables it defines are set for the next modules."""
+
+        srcDirTmp = self._name
+        if self._source.attribute('module_directory').value :
+            srcDirTmp = self._source.attribute('module_directory').value
+
+        env.start_build(self._name, srcDirTmp, self._build.objdir)
+        try:
+            self._build.threat_variables(env)
+            if env._logger._verbose == 0:
+                colorTool = ColorTool()
+                colorTool.cPrint(colorTool.OK, "(Up to date) - ")
+            self.printResult(env, "Up to date", self.OK)
+        finally:
+            env.end_build()
+
+    def restore(self, env, cached):
+        """ Restores the installed files of the module from the build 
+        cache, instead of building it. Returns False if they are not there.
+        """
+
+        srcDirTmp = self._name
+        if self._source.attribute('module_directory').value :
+            srcDirTmp = self._source.attribute('module_directory').value
+
+        env.start_build(self._name, srcDirTmp, self._build.objdir)
+        try:
+            with env.trace('restore'):
+                with env.install_lock:
+                    installed = cached.restore(env.installdir)
+            if installed is None:
+                return False
+            self._build.threat_variables(env)
+            self._installed = installed
+            self._built_once = True
+            if env._logger._verbose == 0:
+                colorTool = ColorTool()
+                colorTool.cPrint(colorTool.OK, 
+                                 "(Restored from the build cache) - ")
+            self.printResult(env, "Restored", self.OK)
+            return True
+        finally:
+            env.end_build()
+
+    def build(self, env, jobs, force_clean, cached=None):
+        """ Main build function. If the cache entry of the build is given,
+        the installed files are stored on it."""
         
         # if there is no build we do not need to proceed 
         if self._build.name() == 'none' or self._source.name() == 'system_dependency':
@@ -448,10 +621,6 @@ class Module:
         env.start_build(self._name, srcDirTmp,
                         self._build.objdir)
         
-        # setup the monitor
-        monitor = FilesystemMonitor(env.installdir)
-        monitor.start()
-
         if self._build.attribute('supported_os').value :
             if not self._build.check_os(self._build.attribute('supported_os').value) : 
                 import platform
@@ -465,11 +634,28 @@ class Module:
                        self._name, platform.system(), distname,version,ids))
                 return
 
+        staged = self._build.stages_install(env)
         if not os.path.isdir(env.installdir):
             os.mkdir(env.installdir)
+        if staged:
+            env.destdir = self._stage_directory(env)
+            if os.path.lexists(env.destdir):
+                shutil.rmtree(env.destdir)
         if self._build.objdir != '' and not os.path.isdir(env.objdir):
             os.mkdir(env.objdir)
 
+        # setup the monitor, unless the module is installed in a staging 
+        # directory. No other module installs files while it looks at the 
+        # installation directory, or their files would be taken as the ones
+        # of this module
+        monitor = None
+        if not staged:
+            env.install_lock.acquire()
+            monitor = FilesystemMonitor(env.installdir, 
+                                        known=self._installed)
+            monitor.start()
+
+        start = time.time()
         try:
             if not os.path.isdir(env.srcdir):
                 raise TaskError('Source is not available for module %s: '
@@ -477,19 +663,40 @@ class Module:
                             (env._module_name,env.srcdir, sys.argv[0]))
 
             if self._build.attribute('pre_installation').value != '':
-                self._build.perform_pre_installation(env)
+                with env.trace('pre_installation'):
+                    self._build.perform_pre_installation(env)
                 
             self._build.threat_variables(env)
 
             if self._build.attribute('patch').value != '':
-                self._build.threat_patch(env, self._build.attribute('patch').value)
+                with env.trace('patch'):
+                    self._build.threat_patch(env, self._build.attribute('patch').value)
 
             self._build.build(env, jobs)
-            self._installed = monitor.end()
+            # files installed over the ones of a previous build are not
+            # seen by the monitor, but are still installed by the module
+            if monitor is None:
+                with env.install_lock:
+                    installed = set(self._merge_stage(env))
+                if not installed:
+                    raise TaskError('Module %s installed no files in its '
+                                    'staging directory, its installation may'
+                                    ' not honor DESTDIR. Set its '
+                                    'staged_install attribute to False.' % 
+                                    self._name)
+            else:
+                installed = set(monitor.end())
+            installed.update([f for f in self._installed 
+                              if os.path.lexists(f)])
+            self._installed = sorted(installed)
             if self._build.attribute('post_installation').value != '':
-                self._build.perform_post_installation(env)
-            env.end_build()
+                with env.trace('post_installation'):
+                    self._build.perform_post_installation(env)
+            if cached is not None:
+                cached.store(self._name, env.installdir, self._installed)
+            self._end_build(env)
             self._built_once = True
+            self._durations['build'] = time.time() - start
             self.printResult(env, "Built", self.OK)
             return True
         except TaskError as e:
@@ -498,15 +705,16 @@ class Module:
             if env.debug :
                 import bake.Utils
                 bake.Utils.print_backtrace()           
-            env.end_build()
+            self._end_build(env)
             
             if env.stopOnErrorEnabled:
                 self.handleStopOnError(e)
 
             return False
         except:
-            self._installed = monitor.end()
-            env.end_build()
+            if monitor is not None:
+                self._installed = monitor.end()
+            self._end_build(env)
             if env.debug :
                 import bake.Utils
                 bake.Utils.print_backtrace()
@@ -514,6 +722,76 @@ class Module:
                 er = sys.exc_info()[1]
                 self.handleStopOnError(TaskError('Error: %s' % (er)))
             return False
+        finally:
+            if monitor is not None:
+                env.install_lock.release()
+
+    def _stage_directory(self, env):
+        """ The directory the module is installed in before its files are
+        moved to the installation directory. It is next to the installation
+        directory, on the same file system."""
+
+        installdir = os.path.abspath(env.installdir).rstrip(os.sep)
+        return os.path.join(os.path.dirname(installdir), '.bake-stage', 
+                            self._name)
+
+    def _merge_stage(self, env):
+        """ Moves the files installed in the staging directory to their 
+        place, and returns them. Only the files of the module are visited.
+        The files staged outside the installation directory are refused, 
+        before anything is moved."""
+
+        installdir = os.path.normpath(os.path.abspath(env.installdir))
+        stage = env.destdir
+        directories = []
+        moves = []
+        outside = []
+        for root, dirs, files in os.walk(stage):
+            # links to directories are moved as they are
+            links = [d for d in dirs if os.path.islink(os.path.join(root, d))]
+            dirs[:] = [d for d in dirs if not d in links]
+            target = os.path.normpath(os.sep + os.path.relpath(root, stage))
+            if target == installdir or target.startswith(installdir + os.sep):
+                directories.append(target)
+            for name in files + links:
+                path = os.path.join(target, name)
+                if not path.startswith(installdir + os.sep):
+                    outside.append(path)
+                else:
+                    moves.append((os.path.join(root, name), path))
+        if outside:
+            raise TaskError('Module %s installed files outside of the '
+                            'installation directory %s: %s' % 
+                            (self._name, installdir, ', '.join(outside[:5])))
+
+        for target in directories:
+            if not os.path.isdir(target):
+                os.makedirs(target)
+        installed = []
+        for source, path in moves:
+            if os.path.isdir(path) and not os.path.islink(path):
+                raise TaskError('Could not install %s, there is a '
+                                'directory with its name' % path)
+            # replaces the file or link, moving into a link to a 
+            # directory would put the entry inside that directory
+            if os.path.lexists(path):
+                os.unlink(path)
+            shutil.move(source, path)
+            installed.append(path)
+        return installed
+
+    def _end_build(self, env):
+        """ Ends the build of the module, and removes its staging 
+        directory, if any."""
+
+        if env.destdir is not None:
+            shutil.rmtree(env.destdir, ignore_errors=True)
+            try:
+                os.rmdir(os.path.dirname(env.destdir))
+            except OSError:
+                pass
+            env.destdir = None
+        env.end_build()
 
     def check_build_version(self, env):
         """ Checks the version of the selected build tool in the machine. """
@@ -38,16 +38,25 @@ except ImportError:
 import re
 import sys
 import shlex
+import ast
+import hashlib
+import shutil
+import threading
 from bake.Utils import ModuleAttributeBase
 from bake.Exceptions import NotImplemented
 from bake.Exceptions import TaskError 
 from bake.Module import ModuleDependency
+from bake.CompilerCache import CompilerCache
 
 class ModuleBuild(ModuleAttributeBase):
     """ Generic build, to be extended by the specialized classes, 
     one for each handled kind of tool. 
     """
 
+    # file, in the build directory, with the digest of the last successful
+    # configuration
+    CONFIGURE_STAMP = '.bake-configure'
+
     def __init__(self):
         """ Default values for the generic attributes."""
         
@@ -76,6 +85,31 @@ class ModuleBuild(ModuleAttributeBase):
         self.add_attribute('new_variable', '', 'Appends the value to the'
                            ' system variable on the format VARIABLE1=value1'
                            ';VARIABLE2=value2', mandatory=False)
+        self.add_attribute('memory_per_job', '', 'Memory, in megabytes,'
+                           ' each compile job of the module is expected to'
+                           ' use, limits the number of parallel jobs',
+                           mandatory=False)
+        self.add_attribute('max_jobs', '', 'Maximum number of parallel jobs'
+                           ' worth using to build the module', 
+                           mandatory=False)
+        self.add_attribute('compiler_cache', '', 'Compiler cache to build'
+                           ' the module through: ccache, sccache, auto for'
+                           ' the first one installed, or none. By default'
+                           ' the one of the --compiler-cache option',
+                           mandatory=False)
+        self.add_attribute('staged_install', '', 'True if the module should'
+                           ' be installed in a staging directory, with'
+                           ' DESTDIR, and then moved to the installation'
+                           ' directory, False if not. By default if the'
+                           ' --staged-install option is given and the build'
+                           ' type honors DESTDIR: autotools, cmake, waf and'
+                           ' python',
+                           mandatory=False)
+        self.add_attribute('fused_install', '', 'True if the module should'
+                           ' be built and installed by a single run of its'
+                           ' build tool, False if not. By default if the'
+                           ' --fused-install option is given',
+                           mandatory=False)
         # self.add_attribute('condition_to_build', '', 'Condition that, if '
         # 'existent, should be true for allowing the instalation')        
 
@@ -96,6 +130,25 @@ class ModuleBuild(ModuleAttributeBase):
     @property
     def objdir(self):
         return self.attribute('objdir').value
+
+    def _int_attribute(self, name):
+        """ Returns the value of an integer attribute, None if not set."""
+        
+        value = self.attribute(name).value
+        if value == '' or value is None:
+            return None
+        try:
+            return int(value)
+        except ValueError:
+            raise TaskError('Attribute %s should be an integer, got "%s"' % 
+                            (name, value))
+
+    @property
+    def memory_per_job(self):
+        return self._int_attribute('memory_per_job')
+    @property
+    def max_jobs(self):
+        return self._int_attribute('max_jobs')
     def build(self, env, jobs):
         raise NotImplemented()
     def clean(self, env):
@@ -241,6 +294,198 @@ class ModuleBuild(ModuleAttributeBase):
             variables.append('CXXFLAGS=%s'% (self.attribute('CXXFLAGS').value))
         return variables
 
+    def _compiler_cache(self, env):
+        """ The compiler cache the module is built through, None if the 
+        module is not built through one."""
+
+        tool = self.attribute('compiler_cache').value
+        if tool == '':
+            return env.compiler_cache
+        if tool == 'none':
+            return None
+        return CompilerCache.get(tool)
+
+    def _compiler_env(self, env):
+        """ Environment variables that make the C and C++ compilers run 
+        through the compiler cache, if any."""
+
+        cache = self._compiler_cache(env)
+        if cache is None:
+            return dict()
+        variables = dict()
+        for name, default in [('CC', 'cc'), ('CXX', 'c++')]:
+            compiler = os.environ.get(name, default)
+            if self.attribute(name) is not None and \
+               self.attribute(name).value != '':
+                compiler = self.attribute(name).value
+            variables[name] = cache.wrap(compiler)
+        return variables
+
+    @classmethod
+    def honors_destdir(cls):
+        """ Verifies if the installation of the build type is known to put
+        the files under DESTDIR. Makefiles, for instance, may ignore it."""
+
+        return False
+
+    def stages_install(self, env):
+        """ Verifies if the module is installed in a staging directory, 
+        that is then merged into the installation directory. By default 
+        only for the build types that honor DESTDIR, never if the 
+        installation runs with sudo, or there is no installation."""
+
+        staged = self.attribute('staged_install').value
+        if staged == '':
+            staged = env.staged_install and self.honors_destdir()
+        else:
+            staged = staged == 'True'
+        if not staged or env.sudoEnabled:
+            return False
+        return self.attribute('no_installation').value != str(True)
+
+    def _install_env(self, env, variables=None):
+        """ Adds the staging directory of the installation, if any, to the
+        environment of the installation."""
+
+        variables = dict(variables or {})
+        if env.destdir is not None:
+            variables['DESTDIR'] = env.destdir
+        return variables
+
+    def _fused(self, env):
+        """ Verifies if the module is built and installed by a single run of
+        the build tool. Never the case if the installation runs with sudo,
+        or there is no installation."""
+
+        fused = self.attribute('fused_install').value
+        if fused == '':
+            fused = env.fused_install
+        else:
+            fused = fused == 'True'
+        if not fused or env.sudoEnabled:
+            return False
+        return self.attribute('no_installation').value != str(True)
+
+    def _run_make(self, env, args, jobs, directory=None, run_env=dict()):
+        """ Runs a make like tool, that joins the jobserver if there is one,
+        otherwise it is given the number of jobs. When the module has to 
+        run less jobs than the jobserver allows, the tool joins a smaller
+        jobserver, whose slots are taken from the shared one.  """
+
+        if env.jobserver is None:
+            if jobs != -1:
+                args = args + ['-j', str(jobs)]
+            env.run(args, directory=directory, env=run_env)
+            return
+        jobserver = env.jobserver
+        if jobs > 0 and jobs < jobserver.jobs():
+            jobserver = jobserver.share(jobs)
+        try:
+            env.run(args, directory=directory, env=run_env, 
+                    jobserver=jobserver)
+        finally:
+            if jobserver is not env.jobserver:
+                jobserver.close()
+
+    def _run_jobs(self, env, args, jobs, directory=None, run_env=dict()):
+        """ Runs a tool that takes -j but cannot join the jobserver, if 
+        there is one the tool runs with the job slots that are free, once
+        it has at least one more than its implicit slot.  """
+        
+        tokens = 0
+        jobsrt = []
+        if env.jobserver is not None:
+            if jobs > 0:
+                tokens = env.jobserver.acquire(jobs - 1, wait=True)
+            else:
+                tokens = env.jobserver.acquire(wait=True)
+            jobsrt = ['-j', str(tokens + 1)]
+        elif jobs != -1:
+            jobsrt = ['-j', str(jobs)]
+        try:
+            env.run(args + jobsrt, directory=directory, env=run_env)
+        finally:
+            if env.jobserver is not None:
+                env.jobserver.release(tokens)
+
+    def _toolchain(self, env, tools):
+        """ Identifies the compilers and the given tools from the location,
+        size and modification time of their executables, without running 
+        them."""
+
+        identity = []
+        launchers = self._compiler_env(env)
+        for name, default in [('CC', 'cc'), ('CXX', 'c++')]:
+            compiler = os.environ.get(name, default)
+            if self.attribute(name) is not None and \
+               self.attribute(name).value != '':
+                compiler = self.attribute(name).value
+            identity.append((name, launchers.get(name, compiler)))
+            tools = tools + compiler.split()[:1]
+        for tool in tools:
+            stamp = None
+            location = env._program_location(tool)
+            if location is not None:
+                try:
+                    st = os.stat(location)
+                    stamp = (os.path.realpath(location), st.st_size, 
+                             int(st.st_mtime))
+                except OSError:
+                    pass
+            identity.append((tool, stamp))
+        return identity
+
+    def _configure_digest(self, env, args, tools, inputs=[]):
+        """ Digest of a configuration of the module: of the arguments of 
+        the configuration, of the toolchain and of the modification times of 
+        the given input files."""
+
+        fields = [('args', args), ('toolchain', self._toolchain(env, tools))]
+        for path in sorted(inputs):
+            try:
+                fields.append((path, os.stat(path).st_mtime))
+            except OSError:
+                fields.append((path, None))
+        return hashlib.sha256(repr(fields).encode('utf-8')).hexdigest()
+
+    def _stamp(self, digest, outputs):
+        """ The content of the stamp of a configuration: its digest, and
+        the modification times of the files it wrote, that change when the
+        module is configured again by hand."""
+
+        fields = [digest]
+        for path in sorted(outputs):
+            try:
+                st = os.stat(path)
+                fields.append((path, getattr(st, 'st_mtime_ns', st.st_mtime)))
+            except OSError:
+                fields.append((path, None))
+        return hashlib.sha256(repr(fields).encode('utf-8')).hexdigest()
+
+    def _is_configured(self, directory, digest, outputs=[]):
+        """ Verifies if the last successful configuration in the directory
+        had the given digest, and if its output files were not written 
+        since."""
+
+        try:
+            with open(os.path.join(directory, self.CONFIGURE_STAMP)) as f:
+                return f.read().strip() == self._stamp(digest, outputs)
+        except IOError:
+            return False
+
+    def _set_configured(self, directory, digest, outputs=[]):
+        """ Records the digest of the configuration of the directory, and
+        the state of its output files, None when the directory is not 
+        configured anymore."""
+
+        stamp = os.path.join(directory, self.CONFIGURE_STAMP)
+        if digest is None:
+            if os.path.exists(stamp):
+                os.remove(stamp)
+            return
+        with open(stamp, 'w') as f:
+            f.write(self._stamp(digest, outputs) + '\n')
+
 
 class NoneModuleBuild(ModuleBuild):
     """ Class defined for the modules that do not need a build mechanism, 
@@ -296,29 +541,42 @@ class PythonModuleBuild(ModuleBuild):
         """ Specific build type identifier."""
         
         return 'python'
+
+    @classmethod
+    def honors_destdir(cls):
+        return True
     
     def build(self, env, jobs):
         """ Specific build implementation method. Basically call the setup.py 
         program passed as parameter."""
         
         # TODO: Add the options, there is no space for the configure_arguments
-        env.run([sys.executable, os.path.join(env.srcdir, 'setup.py'), 'build',
-                  '--build-base=' + env.objdir], directory=env.srcdir)
+        with env.trace('build'):
+            env.run([sys.executable, os.path.join(env.srcdir, 'setup.py'), 'build',
+                      '--build-base=' + env.objdir], directory=env.srcdir)
         
         if self.attribute('no_installation').value != True:
             sudoOp=[]
             if(env.sudoEnabled):
                 sudoOp = ['sudo']
                 
-            env.run(sudoOp + [sys.executable, os.path.join(env.srcdir, 'setup.py'), 'install',
-                              '--install-base=' + env.installdir,
-                              '--install-purelib=' + env.installdir + '/lib',
-#                             --install-platlib=' + env.installdir + '/lib.$PLAT,
-                              '--install-scripts=' + env.installdir + '/scripts',
-                              '--install-headers=' + env.installdir + '/include',
-                              '--install-data=' + env.installdir + '/data',
-                              ],
-                    directory=env.srcdir)
+            with env.trace('install'):
+                env.run(sudoOp + [sys.executable, os.path.join(env.srcdir, 'setup.py'), 'install',
+                                  '--install-base=' + env.installdir,
+                                  '--install-purelib=' + env.installdir + '/lib',
+#                                 --install-platlib=' + env.installdir + '/lib.$PLAT,
+                                  '--install-scripts=' + env.installdir + '/scripts',
+                                  '--install-headers=' + env.installdir + '/include',
+                                  '--install-data=' + env.installdir + '/data',
+                                  ] + self._root(env),
+                        directory=env.srcdir)
+
+    def _root(self, env):
+        """ The setup.py option of the staging directory, if any."""
+
+        if env.destdir is None:
+            return []
+        return ['--root=' + env.destdir]
 
     def clean(self, env):
         """ Call the code with the setup.py with the clean option, 
@@ -370,6 +628,10 @@ class WafModuleBuild(ModuleBuild):
         """ Specific build type identifier."""
     
         return 'waf'
+
+    @classmethod
+    def honors_destdir(cls):
+        return True
     
     def _binary(self, srcdir):
         """ Searches for the waf program."""
@@ -397,10 +659,86 @@ class WafModuleBuild(ModuleBuild):
 #        implement something on this line
 #        env['WAFLOCK'] = '.lock-waf_%s_build'%sys.platform #'.lock-%s' % os.path.basename(objdir)
         return env
+
+    def _cached_env(self, env):
+        """ The waf environment, with the compilers run through the
+        compiler cache, and the object cache of waf on, if the module is 
+        built through a compiler cache."""
+
+        variables = self._env(env.objdir)
+        cached = self._compiler_env(env)
+        if cached:
+            variables.update(cached)
+            variables['WAFCACHE'] = CompilerCache.wafcache()
+        return variables
+
+    def _out_dir(self, env):
+        """ The build directory waf was configured with, read from its lock
+        file, None if waf is not configured."""
+
+        lock = os.environ.get('WAFLOCK', '.lock-waf_%s_build' % sys.platform)
+        try:
+            with open(os.path.join(env.srcdir, lock)) as f:
+                for line in f:
+                    if line.startswith('out_dir = '):
+                        return ast.literal_eval(line[10:].strip())
+        except (IOError, ValueError, SyntaxError):
+            pass
+        return None
+
+    def _lock_files(self, env, out_dir):
+        """ The lock files waf writes in the sources and the output 
+        directory on each configuration."""
+
+        files = []
+        for directory in sorted(set([env.srcdir, out_dir])):
+            try:
+                names = os.listdir(directory)
+            except OSError:
+                continue
+            files.extend([os.path.join(directory, name) for name in names 
+                          if name.startswith('.lock-waf')])
+        return files
+
+    def _inputs(self, env, out_dir):
+        """ The wscript files of the sources, that are read by the 
+        configuration."""
+
+        inputs = []
+        for root, dirs, files in os.walk(env.srcdir):
+            dirs[:] = [d for d in dirs if not d in bake.Utils.VCS_DIRECTORIES 
+                       and os.path.join(root, d) != out_dir]
+            if 'wscript' in files:
+                inputs.append(os.path.join(root, 'wscript'))
+        return inputs
+
+    def _configure(self, env, args, variables):
+        """ Runs waf configure, unless waf is already configured with the
+        same options, environment, toolchain and wscript files."""
+
+        def digest(out_dir):
+            return self._configure_digest(env, 
+                                          [args, sorted(variables.items())],
+                                          args[:2], 
+                                          self._inputs(env, out_dir))
+
+        out_dir = self._out_dir(env)
+        if out_dir is not None and os.path.isdir(out_dir):
+            if self._is_configured(out_dir, digest(out_dir), 
+                                   self._lock_files(env, out_dir)):
+                return
+            self._set_configured(out_dir, None)
+        with env.trace('configure'):
+            env.run(args, directory=env.srcdir, env=variables)
+        out_dir = self._out_dir(env)
+        if out_dir is not None and os.path.isdir(out_dir):
+            self._set_configured(out_dir, digest(out_dir), 
+                                 self._lock_files(env, out_dir))
     
     def build(self, env, jobs):
         """ Specific build implementation method. In order: 
-        1. Call waf configuration, if the configuration is set, 
+        1. Call waf configuration, if the configuration is set and waf is 
+        not configured with it yet, 
         2. Call waf with the set build arguments, 
         3. Call waf with the install parameter. 
         """
@@ -428,21 +766,28 @@ class WafModuleBuild(ModuleBuild):
             extra_configure_options = [env.replace_variables(tmp) for tmp in
                                        bake.Utils.split_args(env.replace_variables(configure_arguments))]
             
-            env.run(self._binary(env.srcdir) + extra_configure_options,
-                    directory=env.srcdir,
-                    env=self._env(env.objdir))
+            self._configure(env, self._binary(env.srcdir) + 
+                            extra_configure_options, self._cached_env(env))
 
         extra_build_options = []
         if self.attribute('build_arguments').value != '':
             extra_build_options = [env.replace_variables(tmp) for tmp in
                                    bake.Utils.split_args(env.replace_variables(self.attribute('build_arguments').value))]
-        jobsrt=[]
-        if not jobs == -1:
-            jobsrt = ['-j', str(jobs)]
-            
-        env.run(self._binary(env.srcdir) + extra_build_options + jobsrt,
-                directory=env.srcdir,
-                env=self._env(env.objdir))
+
+        if self._fused(env):
+            options = bake.Utils.split_args(env.replace_variables(self.attribute('install_arguments').value))
+            with env.trace('build+install'):
+                self._run_jobs(env, self._binary(env.srcdir) + 
+                               extra_build_options + ['install'] + options,
+                               jobs, directory=env.srcdir, 
+                               run_env=self._install_env(env, 
+                                   self._cached_env(env)))
+            return
+
+        with env.trace('build'):
+            self._run_jobs(env, self._binary(env.srcdir) + extra_build_options, 
+                           jobs, directory=env.srcdir, 
+                           run_env=self._cached_env(env))
         
         if self.attribute('no_installation').value != True:
 
@@ -452,9 +797,10 @@ class WafModuleBuild(ModuleBuild):
 
             try :
                 options = bake.Utils.split_args(env.replace_variables(self.attribute('install_arguments').value))
-                env.run(sudoOp + self._binary(env.srcdir) + ['install'] + options,
-                directory=env.srcdir,
-                env=self._env(env.objdir))
+                with env.trace('install'):
+                    env.run(sudoOp + self._binary(env.srcdir) + ['install'] + options,
+                            directory=env.srcdir,
+                            env=self._install_env(env, self._cached_env(env)))
             except TaskError as e:
                 print('    Could not install, probably you do not have permission to'
                       ' install  %s: Verify if you have the required rights. Original'
@@ -474,6 +820,9 @@ class WafModuleBuild(ModuleBuild):
         last build.
         """
 
+        out_dir = self._out_dir(env)
+        if out_dir is not None and os.path.isdir(out_dir):
+            self._set_configured(out_dir, None)
         env.run(self._binary(env.srcdir) + ['-k', 'distclean'],
                 directory=env.srcdir,
                 env=self._env(env.objdir))
@@ -515,6 +864,10 @@ class Cmake(ModuleBuild):
         
         return 'cmake'
 
+    @classmethod
+    def honors_destdir(cls):
+        return True
+
     def _variables(self):
         """ Verifies if the main environment variables were defined and 
         sets them accordingly.
@@ -531,9 +884,81 @@ class Cmake(ModuleBuild):
                 
         return variables
 
+    def _launchers(self, env):
+        """ Makes cmake launch the compilers through the compiler cache, 
+        if the module is built through one."""
+
+        cache = self._compiler_cache(env)
+        if cache is None:
+            return []
+        return ['-DCMAKE_%s_COMPILER_LAUNCHER=%s' % (lang, cache.launcher())
+                for lang in ['C', 'CXX']]
+
+    def _ninja(self, env):
+        """ Verifies if the build directory was configured for ninja."""
+        
+        try:
+            with open(os.path.join(env.objdir, 'CMakeCache.txt')) as cache:
+                for line in cache:
+                    if line.startswith('CMAKE_GENERATOR:'):
+                        return line.strip().endswith('=Ninja')
+        except IOError:
+            pass
+        return False
+
+    def _generator(self, env, options):
+        """ Makes cmake generate ninja files, when ninja is installed and
+        neither the module nor the user chose a generator. A build directory
+        already configured keeps its generator."""
+
+        for option in options:
+            if option.startswith('-G') or \
+               option.startswith('-DCMAKE_GENERATOR'):
+                return []
+        if 'CMAKE_GENERATOR' in os.environ:
+            return []
+        if os.path.exists(os.path.join(env.objdir, 'CMakeCache.txt')):
+            if self._ninja(env):
+                return ['-G', 'Ninja']
+            return []
+        if env.check_program('ninja'):
+            return ['-G', 'Ninja']
+        return []
+
+    def _inputs(self, env):
+        """ The CMake files of the sources, that are read by the 
+        configuration."""
+
+        objdir = os.path.normpath(env.objdir)
+        inputs = []
+        for root, dirs, files in os.walk(env.srcdir):
+            dirs[:] = [d for d in dirs if not d in bake.Utils.VCS_DIRECTORIES 
+                       and os.path.normpath(os.path.join(root, d)) != objdir]
+            for name in files:
+                if name == 'CMakeLists.txt' or name.endswith('.cmake'):
+                    inputs.append(os.path.join(root, name))
+        return inputs
+
+    def _configure(self, env, args):
+        """ Runs the cmake configuration, unless the build directory was 
+        already configured with the same arguments, toolchain and CMake 
+        files."""
+
+        digest = self._configure_digest(env, args, ['cmake'], 
+                                        self._inputs(env))
+        cache = os.path.join(env.objdir, 'CMakeCache.txt')
+        if (os.path.exists(cache) and 
+            self._is_configured(env.objdir, digest, [cache])):
+            return
+        self._set_configured(env.objdir, None)
+        with env.trace('configure'):
+            env.run(args, directory=env.objdir)
+        self._set_configured(env.objdir, digest, [cache])
+
     def build(self, env, jobs):
         """ Specific build implementation method. In order: 
-        1. Call cmake to create the make files, with configure arguments
+        1. Call cmake to create the make files, with configure arguments,
+        if the build directory is not configured with them yet
         2. Call cmake --build to build the code, with cmake arguments
         3. Call 'cmake --build . --target install' with install arguments
         """
@@ -548,24 +973,41 @@ class Cmake(ModuleBuild):
         except:
             raise TaskError('objdir %s configured but missing; possible problem in ModuleEnvironment.start_build()' % env.objdir)
 
-        jobsrt=[]
-        if not jobs == -1:
-            jobsrt = ['-j', str(jobs)]
-
         options = []
         if self.attribute('configure_arguments').value != '':
             options = bake.Utils.split_args(
                           env.replace_variables(self.attribute('configure_arguments').value))
 
-        env.run(['cmake', env.srcdir, '-DCMAKE_INSTALL_PREFIX:PATH='
-            + env.installdir] + self._variables() + options, directory=env.objdir)
+        self._configure(env, ['cmake', env.srcdir, 
+                              '-DCMAKE_INSTALL_PREFIX:PATH=' + env.installdir]
+                        + self._generator(env, options) + self._variables() 
+                        + self._launchers(env) + options)
         
         options = []
         if self.attribute('cmake_arguments').value != '':
             options = bake.Utils.split_args(
                           env.replace_variables(self.attribute('cmake_arguments').value))
 
-        env.run(['cmake', '--build', env.objdir] + options + jobsrt, directory=env.objdir)
+        phase = 'build'
+        variables = dict()
+        if self._fused(env):
+            # the install target depends on the build of the project
+            phase = 'build+install'
+            options = ['--target', 'install'] + options + \
+                bake.Utils.split_args(env.replace_variables(self.attribute('install_arguments').value))
+            variables = self._install_env(env)
+
+        with env.trace(phase):
+            if self._ninja(env):
+                # ninja does not read the make jobserver
+                self._run_jobs(env, ['cmake', '--build', env.objdir] + options,
+                               jobs, directory=env.objdir, run_env=variables)
+            else:
+                self._run_make(env, ['cmake', '--build', env.objdir] + 
+                               options, jobs, directory=env.objdir, 
+                               run_env=variables)
+        if phase != 'build':
+            return
 
         if self.attribute('no_installation').value != True:
 
@@ -575,7 +1017,9 @@ class Cmake(ModuleBuild):
 
             try:
                 options = bake.Utils.split_args(env.replace_variables(self.attribute('install_arguments').value))
-                env.run(sudoOp + ['cmake', '--build', '.', '--target', 'install'] + options, directory=env.objdir)
+                with env.trace('install'):
+                    env.run(sudoOp + ['cmake', '--build', '.', '--target', 'install'] + options, directory=env.objdir,
+                            env=self._install_env(env))
             except TaskError as e:
                 print('    Could not install, probably you do not have permission to'
                       ' install  %s: Verify if you have the required rights. Original'
@@ -584,6 +1028,11 @@ class Cmake(ModuleBuild):
     def clean(self, env):
         """ Call make clean to remove the results of the last build."""
 
+        if self._ninja(env):
+            env.run(['cmake', '--build', env.objdir, '--target', 'clean'], 
+                    directory=env.objdir)
+            return
+
         if not os.path.isfile(os.path.join(env.objdir, 'Makefile')):
             return
         
@@ -592,6 +1041,7 @@ class Cmake(ModuleBuild):
     def distclean(self, env):
         """ Call make distclean to remove the results of the last build."""
 
+        self._set_configured(env.objdir, None)
         if not os.path.isfile(os.path.join(env.objdir, 'Makefile')):
             return
         
@@ -653,15 +1103,28 @@ class Make(ModuleBuild):
         options = []      
         if self.attribute('configure_arguments').value != '':
             options = bake.Utils.split_args(env.replace_variables(self.attribute('configure_arguments').value))
-            env.run(['make'] + self._flags() + options,  directory=env.srcdir)
+            with env.trace('configure'):
+                env.run(['make'] + self._flags() + options,  directory=env.srcdir,
+                        env=self._compiler_env(env))
         
         
-        jobsrt=[]
-        if not jobs == -1:
-            jobsrt = ['-j', str(jobs)]
-
         options = bake.Utils.split_args(env.replace_variables(self.attribute('build_arguments').value))
-        env.run(['make']+jobsrt + self._flags() + options, directory=env.srcdir)
+
+        # with jobs make may run several goals at once, install is only
+        # fused when it is the one goal
+        if self._fused(env) and not options:
+            options = bake.Utils.split_args(env.replace_variables(self.attribute('install_arguments').value))
+            with env.trace('build+install'):
+                self._run_make(env, ['make', 'install'] + self._flags() + 
+                               options, jobs, directory=env.srcdir,
+                               run_env=self._install_env(env, 
+                                   self._compiler_env(env)))
+            return
+
+        with env.trace('build'):
+            self._run_make(env, ['make'] + self._flags() + options, jobs, 
+                           directory=env.srcdir, 
+                           run_env=self._compiler_env(env))
            
         if self.attribute('no_installation').value != str(True):
 
@@ -671,7 +1134,9 @@ class Make(ModuleBuild):
 
             try:
                 options = bake.Utils.split_args(env.replace_variables(self.attribute('install_arguments').value))
-                env.run(sudoOp + ['make', 'install']  + self._flags() + options, directory=env.srcdir)
+                with env.trace('install'):
+                    env.run(sudoOp + ['make', 'install']  + self._flags() + options, directory=env.srcdir,
+                            env=self._install_env(env))
             except TaskError as e:
                 raise TaskError('    Could not install, probably you do not have permission to'
                       ' install  %s: Verify if you have the required rights. Original'
@@ -712,6 +1177,12 @@ class Make(ModuleBuild):
 
 
 class Autotools(ModuleBuild):
+
+    # configure options with which the module chooses its own cache
+    CACHE_OPTIONS = ['-C', '--config-cache', '--cache-file']
+    # the shared caches are updated by one module at a time
+    _cache_lock = threading.Lock()
+
     def __init__(self):
         """ Instantiate the list of specific attributes for the Autotools build."""
         
@@ -726,6 +1197,12 @@ class Autotools(ModuleBuild):
                            ' to pass to configure')
         self.add_attribute('install_arguments', '', 'Command-line arguments'
                            ' to pass to make install')
+        self.add_attribute('shared_config_cache', '', 'True if configure'
+                           ' should start from, and add its results to, the'
+                           ' autoconf cache shared by the modules built with'
+                           ' the same toolchain, False if not. By default if'
+                           ' the --shared-config-cache option is given',
+                           mandatory=False)
         
     @classmethod
     def name(cls):
@@ -733,6 +1210,119 @@ class Autotools(ModuleBuild):
   
         return 'autotools'
 
+    @classmethod
+    def honors_destdir(cls):
+        return True
+
+    def _config_cache(self, env):
+        """ The autoconf cache shared by the modules built with the same
+        compilers and flags as this one, None if the module does not use 
+        it."""
+
+        shared = self.attribute('shared_config_cache').value
+        if shared == '':
+            shared = env.shared_config_cache
+        else:
+            shared = shared == 'True'
+        if not shared:
+            return None
+        identity = [self._toolchain(env, []), self._variables()]
+        for variable in ['CFLAGS', 'CXXFLAGS', 'CPPFLAGS', 'LDFLAGS', 'LIBS']:
+            identity.append((variable, os.environ.get(variable)))
+        key = hashlib.sha256(repr(identity).encode('utf-8')).hexdigest()
+        return os.path.join(env.srcrepo, '.config-cache', key[:16] + '.cache')
+
+    @classmethod
+    def _read_cache(cls, path):
+        """ The entries of an autoconf cache file, by variable."""
+
+        entries = dict()
+        try:
+            with open(path) as f:
+                for line in f:
+                    match = re.match(r'(?:test "\$\{)?([A-Za-z_]\w*)[=+]', 
+                                     line)
+                    if match is not None:
+                        entries[match.group(1)] = line.rstrip('\n')
+        except IOError:
+            pass
+        return entries
+
+    def _merge_cache(self, shared, local):
+        """ Adds the results of the configuration of the module to the 
+        shared cache. The cached environment variables are kept out, 
+        configure refuses to run if they differ from the ones it is given.
+        """
+
+        with Autotools._cache_lock:
+            entries = self._read_cache(shared)
+            for name, line in self._read_cache(local).items():
+                if not name in entries and not name.startswith('ac_cv_env_'):
+                    entries[name] = line
+            tmp = '%s.%d' % (shared, os.getpid())
+            with open(tmp, 'w') as f:
+                f.write('# autoconf cache shared by the modules built by'
+                        ' bake with the same toolchain\n')
+                for name in sorted(entries):
+                    f.write(entries[name] + '\n')
+            os.rename(tmp, shared)
+
+    def _configure(self, env, command):
+        """ Runs configure with a copy of the shared autoconf cache, and
+        adds its results to the shared cache when it succeeds. If configure
+        fails with the shared results, it is run again from scratch."""
+
+        shared = None
+        if not any(o == c or o.startswith(c + '=') 
+                   for o in command for c in self.CACHE_OPTIONS):
+            shared = self._config_cache(env)
+        if shared is None:
+            env.run(command, directory=env.objdir, 
+                    env=self._compiler_env(env))
+            return
+
+        local = os.path.join(env.objdir, 'config.cache')
+        command = command + ['--cache-file=' + local]
+        if os.path.exists(local):
+            os.remove(local)
+        if os.path.exists(shared):
+            shutil.copyfile(shared, local)
+            try:
+                env.run(command, directory=env.objdir, 
+                        env=self._compiler_env(env))
+            except TaskError:
+                if os.path.exists(local):
+                    os.remove(local)
+                env.run(command, directory=env.objdir, 
+                        env=self._compiler_env(env))
+        else:
+            env.run(command, directory=env.objdir, 
+                    env=self._compiler_env(env))
+        if not os.path.isdir(os.path.dirname(shared)):
+            os.makedirs(os.path.dirname(shared))
+        self._merge_cache(shared, local)
+
+    def _is_generated(self, env):
+        """ Verifies if the configure script is newer than the autoconf and
+        automake files it is generated from."""
+
+        try:
+            generated = os.stat(os.path.join(env.srcdir, 'configure')).st_mtime
+        except OSError:
+            return False
+        for root, dirs, files in os.walk(env.srcdir):
+            dirs[:] = [d for d in dirs if not d in bake.Utils.VCS_DIRECTORIES]
+            for name in files:
+                if name in ['configure.ac', 'configure.in', 'Makefile.am'] or \
+                   name.endswith('.m4'):
+                    try:
+                        if os.stat(os.path.join(root, name)).st_mtime > \
+                           generated:
+                            return False
+                    except OSError:
+                        pass
+        return True
+
     def _variables(self):
         """ Verifies if the main environment variables where defined and 
         sets them accordingly."""
@@ -746,32 +1336,44 @@ class Autotools(ModuleBuild):
     
     def build(self, env, jobs):
         """ Specific build implementation method. In order: 
-        1. Call autoreconf, if on maintainer mode
+        1. Call autoreconf, if on maintainer mode and configure is older 
+        than its inputs
         2. Call make configure, if the configure arguments are available, 
+        with the shared autoconf cache
         3. Call make to perform the build 
         4. Call make with the install arguments.
         """
 
-        if self.attribute('maintainer').value != 'no':
-            env.run(['autoreconf', '--install'],
-                    directory=env.srcdir)
-            
-        options = []
-        if self.attribute('configure_arguments').value != '':
-            command= (env.replace_variables(env.replace_variables(self.attribute('configure_arguments').value)))
-            
-            if not "--prefix" in command:
-                command = command + ' --prefix=' + env.objdir
+        with env.trace('configure'):
+            if self.attribute('maintainer').value != 'no' and \
+               not self._is_generated(env):
+                env.run(['autoreconf', '--install'],
+                        directory=env.srcdir)
+                
+            options = []
+            if self.attribute('configure_arguments').value != '':
+                command= (env.replace_variables(env.replace_variables(self.attribute('configure_arguments').value)))
                 
-            command = shlex.split(command)
-            env.run(command, directory=env.objdir)
+                if not "--prefix" in command:
+                    command = command + ' --prefix=' + env.objdir
+                    
+                command = shlex.split(command)
+                self._configure(env, command)
         
         
-        jobsrt=[]
-        if not jobs == -1:
-            jobsrt = ['-j', str(jobs)]
+        if self._fused(env):
+            # the automake install target depends on all
+            options = bake.Utils.split_args(env.replace_variables(self.attribute('install_arguments').value))
+            with env.trace('build+install'):
+                self._run_make(env, ['make', 'install'] + options, jobs,
+                               directory=env.objdir, 
+                               run_env=self._install_env(env, 
+                                   self._compiler_env(env)))
+            return
     
-        env.run(['make']+jobsrt, directory=env.objdir)
+        with env.trace('build'):
+            self._run_make(env, ['make'], jobs, directory=env.objdir, 
+                           run_env=self._compiler_env(env))
         
         if self.attribute('no_installation').value != True:
 
@@ -781,7 +1383,9 @@ class Autotools(ModuleBuild):
 
             try :
                 options = bake.Utils.split_args(env.replace_variables(self.attribute('install_arguments').value))
-                env.run(sudoOp + ['make', 'install'] + options, directory=env.objdir)
+                with env.trace('install'):
+                    env.run(sudoOp + ['make', 'install'] + options, directory=env.objdir,
+                            env=self._install_env(env))
             except TaskError as e:
                 print('    Could not install, probably you do not have permission to'
                       ' install  %s: Verify if you have the required rights. Original'
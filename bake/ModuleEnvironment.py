@@ -26,12 +26,16 @@
 ''' 
 
 import os
+import copy
 import subprocess
 import sys
+import threading
 import platform
 
 from bake.Exceptions import TaskError 
 from bake.Utils import ColorTool
+from bake.Trace import NoSpan
+from bake.HostLimiter import HostLimiter
 
 class ModuleEnvironment:
     ''' Main class to interact with the host system to execute the external 
@@ -42,6 +46,9 @@ class ModuleEnvironment:
     _binpaths = set([])
     _pkgpaths =  set([])
     _variables =  set([])
+    # the paths and variables are shared by the modules processed in 
+    # parallel, they are only used through copies taken under this lock
+    _paths_lock = threading.Lock()
      
     (HIGHER, LOWER, EQUAL) = range(0,3)
 
@@ -60,6 +67,27 @@ class ModuleEnvironment:
 #         self._variables =  set([])
         self._debug = debug
         self._sudoEnabled = False
+        self._jobserver = None
+        self._tracer = None
+        self._compiler_cache = None
+        self._fused_install = False
+        self._staged_install = False
+        self._shared_config_cache = False
+        self._destdir = None
+        self._downloads = HostLimiter()
+        self._git_defaults = {}
+        self._download_cache = None
+        # shared with the forked environments
+        self._install_lock = threading.Lock()
+
+    def fork(self):
+        ''' Returns a copy of the environment, with its own logger, to be 
+        used by a module that is processed in parallel with other modules.
+        '''
+
+        env = copy.copy(self)
+        env._logger = self._logger.fork()
+        return env
 
     def _module_directory(self):
         ''' Returns the name of the directory of the on use module.'''
@@ -124,6 +152,149 @@ class ModuleEnvironment:
         
         return self._sudoEnabled
 
+    @property
+    def jobserver(self):
+        ''' Returns the jobserver shared by the modules built in parallel, 
+        or None if there is none.'''
+        
+        return self._jobserver
+
+    @jobserver.setter
+    def jobserver(self, jobserver):
+        ''' Sets the jobserver the build tools should join.'''
+        
+        self._jobserver = jobserver
+
+    @property
+    def compiler_cache(self):
+        ''' Returns the compiler cache the modules are built through, by
+        default, or None if there is none.'''
+
+        return self._compiler_cache
+
+    @compiler_cache.setter
+    def compiler_cache(self, compiler_cache):
+        ''' Sets the default compiler cache of the modules.'''
+
+        self._compiler_cache = compiler_cache
+
+    @property
+    def fused_install(self):
+        ''' Returns if the modules are, by default, built and installed by
+        a single run of their build tool.'''
+
+        return self._fused_install
+
+    @fused_install.setter
+    def fused_install(self, fused_install):
+        ''' Sets if the modules are built and installed in a single run.'''
+
+        self._fused_install = fused_install
+
+    @property
+    def shared_config_cache(self):
+        ''' Returns if the autotools modules share, by default, the results
+        of configure with the modules built with the same toolchain.'''
+
+        return self._shared_config_cache
+
+    @shared_config_cache.setter
+    def shared_config_cache(self, shared_config_cache):
+        ''' Sets if the autotools modules share the results of configure.'''
+
+        self._shared_config_cache = shared_config_cache
+
+    @property
+    def downloads(self):
+        ''' Returns the limits of the downloads running at the same time.'''
+
+        return self._downloads
+
+    @downloads.setter
+    def downloads(self, downloads):
+        ''' Sets the limits of the downloads running at the same time.'''
+
+        self._downloads = downloads
+
+    @property
+    def install_lock(self):
+        ''' Returns the lock held by the modules while they install files 
+        into the installation directory, or watch it.'''
+
+        return self._install_lock
+
+    @property
+    def download_cache(self):
+        ''' Returns the cache of the downloads, None if there is none.'''
+
+        return self._download_cache
+
+    @download_cache.setter
+    def download_cache(self, download_cache):
+        ''' Sets the cache of the downloads.'''
+
+        self._download_cache = download_cache
+
+    @property
+    def git_defaults(self):
+        ''' Returns the depth, filter and single_branch settings of the git
+        downloads, for the modules that do not set them.'''
+
+        return self._git_defaults
+
+    @git_defaults.setter
+    def git_defaults(self, git_defaults):
+        ''' Sets the default settings of the git downloads.'''
+
+        self._git_defaults = git_defaults
+
+    @property
+    def staged_install(self):
+        ''' Returns if the modules are, by default, installed in a staging
+        directory that is then merged into the installation directory.'''
+
+        return self._staged_install
+
+    @staged_install.setter
+    def staged_install(self, staged_install):
+        ''' Sets if the modules are installed in a staging directory.'''
+
+        self._staged_install = staged_install
+
+    @property
+    def destdir(self):
+        ''' Returns the staging directory the present module is installed
+        in, None if it is installed directly.'''
+
+        return self._destdir
+
+    @destdir.setter
+    def destdir(self, destdir):
+        ''' Sets the staging directory of the present module.'''
+
+        self._destdir = destdir
+
+    @property
+    def tracer(self):
+        ''' Returns the trace of the run, or None if it is not traced.'''
+
+        return self._tracer
+
+    @tracer.setter
+    def tracer(self, tracer):
+        ''' Sets the trace the phases of the modules are recorded on.'''
+
+        self._tracer = tracer
+
+    def trace(self, phase):
+        ''' Returns the span that records, on the trace of the run, the
+        given phase of the on use module. To be used in a with statement.'''
+
+        if self._tracer is None:
+            return NoSpan()
+        return self._tracer.span(phase, 'phase',
+                                 {'module': str(self._module_name)})
+
     @property
     def stopOnErrorEnabled(self):
         ''' Returns the setting of the --stop_on_error option'''
@@ -183,6 +354,18 @@ class ModuleEnvironment:
         else:
             d[name] = d[name] + sep + value
 
+    def _makedirs(self, dirname):
+        ''' Creates the directory, if it does not exist yet. Other modules,
+        processed in parallel, may be creating the same directory.
+        '''
+
+        if not os.path.isdir(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError:
+                if not os.path.isdir(dirname):
+                    raise
+
     def start_source(self, name, dir):
         ''' Sets the environment to be used by the given source module.'''
         
@@ -191,8 +374,7 @@ class ModuleEnvironment:
         self._logger.set_current_module(name)
         
         # ensure source directory exists
-        if not os.path.isdir(self._sourcedir):
-            os.makedirs(self._sourcedir)
+        self._makedirs(self._sourcedir)
 
     def end_source(self):
         ''' Cleans the environment regarding the informations of the last used
@@ -211,10 +393,8 @@ class ModuleEnvironment:
         self._objdir = objdir
         self._logger.set_current_module(name)
 
-        if not os.path.isdir(self.installdir):
-            os.makedirs(self.installdir)
-        if not os.path.isdir(self.objdir):
-            os.makedirs(self.objdir)
+        self._makedirs(self.installdir)
+        self._makedirs(self.objdir)
 
     def end_build(self):
         ''' Cleans the environment regarding the informations of the last used
@@ -263,7 +443,7 @@ class ModuleEnvironment:
             if index>0 :
                 toFindIn=['/usr/lib','/usr/lib64','/usr/lib32','/usr/local/lib',
                      '/lib','/opt/local/lib','/opt/local/Library', '/usr/local/opt']
-                for libpath in self._libpaths:
+                for libpath in self._snapshot(self._libpaths):
                     toFindIn.append(libpath)
                 stdLibs = []
                 try:
@@ -328,37 +508,48 @@ class ModuleEnvironment:
         else:
             assert False
 
+    def _snapshot(self, paths):
+        ''' Returns a copy of the paths, that other modules may not change
+        while it is used.'''
+
+        with self._paths_lock:
+            return list(paths)
+
     def add_libpaths(self, libpaths):
         ''' Adds the list of paths to the in-use library path environment 
         variable.
         '''
         
-        for element in libpaths :
-            self._libpaths.add(self.replace_variables(element))
+        elements = [self.replace_variables(element) for element in libpaths]
+        with self._paths_lock:
+            self._libpaths.update(elements)
         
     def add_binpaths(self, libpaths):
         ''' Adds the list of paths to the in-use binary path environment 
         variable.
         '''
         
-        for element in libpaths :
-            self._binpaths.add(self.replace_variables(element))
+        elements = [self.replace_variables(element) for element in libpaths]
+        with self._paths_lock:
+            self._binpaths.update(elements)
         
     def add_pkgpaths(self, libpaths):
         ''' Adds the list of paths to the in-use package path environment 
         variable.
         '''
         
-        for element in libpaths :
-            self._pkgpaths.add(self.replace_variables(element))
+        elements = [self.replace_variables(element) for element in libpaths]
+        with self._paths_lock:
+            self._pkgpaths.update(elements)
 
     def add_variables(self, libpaths):
         ''' Adds/replace the list of variables to the in-use set of environment 
         variables.
         '''
         
-        for element in libpaths :
-            self._variables.add(self.replace_variables(element))
+        elements = [self.replace_variables(element) for element in libpaths]
+        with self._paths_lock:
+            self._variables.update(elements)
             
     def create_environment_file(self, fileName):
         ''' Creates the set environment file to help users to call the Bake 
@@ -371,20 +562,24 @@ class ModuleEnvironment:
                  "    exit 1 \n" + \
                  "fi \n\n"
 
-        self._binpaths.add(self._bin_path())
-        if os.path.isdir(self._lib_path()):
-            self._libpaths.add(self._lib_path())
-        if os.path.isdir(self._lib_path()+'64'):
-            self._libpaths.add(self._lib_path()+'64')
-
-        if len(self._libpaths) > 0:
-            script = script + self.add_onPath("LD_LIBRARY_PATH", self._libpaths) + "\n"
+        with self._paths_lock:
+            self._binpaths.add(self._bin_path())
+            if os.path.isdir(self._lib_path()):
+                self._libpaths.add(self._lib_path())
+            if os.path.isdir(self._lib_path()+'64'):
+                self._libpaths.add(self._lib_path()+'64')
+
+        libpaths = self._snapshot(self._libpaths)
+        binpaths = self._snapshot(self._binpaths)
+        pkgpaths = self._snapshot(self._pkgpaths)
+        if len(libpaths) > 0:
+            script = script + self.add_onPath("LD_LIBRARY_PATH", libpaths) + "\n"
             
-        if len(self._binpaths) > 0:
-            script = script + self.add_onPath("PATH", self._binpaths) + "\n"
+        if len(binpaths) > 0:
+            script = script + self.add_onPath("PATH", binpaths) + "\n"
             
-        if len(self._pkgpaths) > 0:
-            script = script + self.add_onPath("PKG_CONFIG_PATH", self._pkgpaths) + "\n"
+        if len(pkgpaths) > 0:
+            script = script + self.add_onPath("PKG_CONFIG_PATH", pkgpaths) + "\n"
 
         from distutils.sysconfig import get_python_lib
         localLibPath=''
@@ -396,7 +591,7 @@ class ModuleEnvironment:
         
         script = script + self.add_onPath("PYTHONPATH", [sys.path[0],self._lib_path(),localLibPath]) + "\n"
         
-        for element in self._variables:
+        for element in self._snapshot(self._variables):
             script = script + " export " + element  + "\n"
         
         fout = open(fileName, "w")
@@ -464,19 +659,19 @@ class ModuleEnvironment:
     def append_to_path(self, env_vars):
         """Sets the library and binary paths."""
         
-        for libpath in self._libpaths:
+        for libpath in self._snapshot(self._libpaths):
             self._append_path(env_vars, self._lib_var(), libpath, os.pathsep)
             if self.debug:
                 print("  -> " + self._lib_var() + " " + libpath + " ")
         
         self._append_path(env_vars, self._lib_var(), self._lib_path(), os.pathsep)
-        for libpath in self._binpaths:
+        for libpath in self._snapshot(self._binpaths):
             self._append_path(env_vars, self._bin_var(), libpath, os.pathsep)
             if self.debug:
                 print("  -> " + self._bin_var() + " " + libpath + " ")
         
         self._append_path(env_vars, self._bin_var(), self._bin_path(), os.pathsep)
-        for libpath in self._pkgpaths:
+        for libpath in self._snapshot(self._pkgpaths):
             self._append_path(env_vars, self._pkgconfig_var(), libpath, os.pathsep)
             if self.debug:
                 print("  -> " + self._pkgconfig_var() + " " + libpath + " ")
@@ -487,9 +682,11 @@ class ModuleEnvironment:
         
         return env_vars
 
-    def run(self, args, directory = None, env = dict(), interactive = False):
+    def run(self, args, directory = None, env = dict(), interactive = False,
+            jobserver = None):
         '''Executes a system program adding the libraries and over the correct 
-        directories.
+        directories. The build tools that take their job slots from a 
+        jobserver are given it, the other programs do not see it.
         '''
         
         if not interactive:
@@ -517,20 +714,34 @@ class ModuleEnvironment:
         # sets the library and binary paths 
         tmp = self.append_to_path(tmp)
         
-        # Calls the third party executable with the whole context
-        try:
-            popen = subprocess.Popen(args,
-                                     stdin = stdin,
-                                     stdout = stdout,
-                                     stderr = stderr,
-                                     cwd = directory,
-                                     env = tmp)
-        except Exception as e:
-            raise TaskError('could not execute: %s %s. \nUnexpected error: %s' 
-                                % (str(directory), str(args), str(e)))
-        
-        # Waits for the full execution of the third party software
-        retcode = popen.wait()
+        # makes the build tools share the jobserver job slots
+        extra = dict()
+        if jobserver is not None:
+            tmp['MAKEFLAGS'] = jobserver.makeflags(tmp.get('MAKEFLAGS', ''))
+            if sys.version_info[0] >= 3:
+                extra['pass_fds'] = jobserver.fds()
+        
+        span = NoSpan()
+        if self._tracer is not None:
+            span = self._tracer.command(args, directory)
+
+        with span:
+            # Calls the third party executable with the whole context
+            try:
+                popen = subprocess.Popen(args,
+                                         stdin = stdin,
+                                         stdout = stdout,
+                                         stderr = stderr,
+                                         cwd = directory,
+                                         env = tmp,
+                                         **extra)
+            except Exception as e:
+                raise TaskError('could not execute: %s %s. \nUnexpected error: %s' 
+                                    % (str(directory), str(args), str(e)))
+            
+            # Waits for the full execution of the third party software
+            retcode = popen.wait()
+            span.args()['status'] = retcode
         if retcode != 0:
             raise TaskError('Subprocess failed with error %d: %s' % (retcode, str(args)))
 
@@ -27,6 +27,8 @@
 
 import sys
 import os
+import tempfile
+import threading
 from bake.Exceptions import NotImplemented
 
 class ModuleLogger:
@@ -69,6 +71,13 @@ class ModuleLogger:
         raise NotImplemented()
     def clear_current_module(self):
         raise NotImplemented()
+
+    def fork(self):
+        """ Returns the logger to be used by a module that is processed in 
+        parallel with other modules. By default the outputs are shared.
+        """
+        
+        return self
     
     @property
     def stdout(self):
@@ -85,6 +94,57 @@ class ModuleLogger:
         return self._command_file
 
 
+class BufferedModuleLogger(ModuleLogger):
+    """ Logger of a module processed in parallel with other modules. The
+    outputs of the module are kept in a temporary file, and written at once
+    to the output of the logger it comes from when the module is done, so 
+    that the outputs of the modules do not mix.
+    """
+
+    # one module at a time writes its output
+    _lock = threading.Lock()
+
+    def __init__(self, output=None):
+        """ Initializes the used variables. Without output, the outputs go
+        to the standard output of the moment they are written."""
+
+        ModuleLogger.__init__(self)
+        self._output = output
+        self._file = None
+
+    def set_current_module(self, name):
+        """ Starts keeping the outputs of the module."""
+
+        if self._file is None:
+            self._file = tempfile.TemporaryFile('w+', 1)
+        self._update_file(self._file)
+
+    def clear_current_module(self):
+        """ Writes the outputs kept for the module."""
+
+        if self._file is None:
+            return
+        self._file.flush()
+        fd = self._file.fileno()
+        os.lseek(fd, 0, os.SEEK_SET)
+        data = []
+        while True:
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                break
+            data.append(chunk)
+        self._file.close()
+        self._file = None
+        data = b''.join(data)
+        if sys.version_info[0] >= 3:
+            data = data.decode('utf-8', 'replace')
+        output = self._output or sys.stdout
+        with BufferedModuleLogger._lock:
+            output.write(data)
+            output.flush()
+        self._update_file(output)
+
+
 class StdoutModuleLogger(ModuleLogger):
     """ The Standard output logger, where all the outputs go to the stdout."""
 
@@ -106,6 +166,15 @@ class StdoutModuleLogger(ModuleLogger):
         """
         pass
 
+    def fork(self):
+        """ The outputs of a module processed in parallel are buffered, 
+        and then go through the standard output of the module, that keeps
+        them in order with its messages."""
+
+        logger = BufferedModuleLogger()
+        logger.set_verbose(self._verbose)
+        return logger
+
 class LogfileModuleLogger(ModuleLogger):
     """ The file output logger, all the outputs go to the same log file."""
     
@@ -126,6 +195,14 @@ class LogfileModuleLogger(ModuleLogger):
         """
         pass
 
+    def fork(self):
+        """ The outputs of a module processed in parallel are buffered, 
+        and then written to the log file at once."""
+
+        logger = BufferedModuleLogger(self._file)
+        logger.set_verbose(self._verbose)
+        return logger
+
 class LogdirModuleLogger(ModuleLogger):
     """ Logs the output for a repository,  i.e. one log file per module."""
     
@@ -155,3 +232,12 @@ class LogdirModuleLogger(ModuleLogger):
         self._file.close()
         self._file = None
 
+    def fork(self):
+        """ As there is one log file per module, each module processed in 
+        parallel needs its own logger.
+        """
+
+        logger = LogdirModuleLogger(self._dirname)
+        logger.set_verbose(self._verbose)
+        return logger
+
@@ -27,10 +27,10 @@
 import urllib
 try:
     from urllib.parse import urlparse
-    from urllib.request import urlretrieve
+    from urllib.request import urlopen
 except ImportError:
     from urlparse import urlparse
-    from urllib import urlretrieve
+    from urllib2 import urlopen
 import bake.Utils
 from bake.Exceptions import TaskError
 from bake.Utils import ModuleAttributeBase
@@ -45,6 +45,7 @@ except ImportError:
     sys.exit(1)
 import subprocess
 import importlib
+import binascii
 try:
     import commands
     from commands import getoutput
@@ -97,6 +98,46 @@ class ModuleSource(ModuleAttributeBase):
         raise NotImplemented()
     def check_version(self, env):
         raise NotImplemented()
+
+    def revision(self, env):
+        """ Returns the revision of the downloaded source tree, or None if 
+        the tree has local changes or the revision is not known."""
+        return None
+
+    def head(self, env):
+        """ Returns the revision the source tree is at, read from the VCS
+        metadata without running the VCS tool, '' if there is none. Local 
+        changes are not taken into account."""
+        return ''
+
+    def host(self):
+        """ Returns the host the source is downloaded from, '' if it does
+        not come from the network."""
+
+        url = self.attribute('url')
+        if url is None or not url.value:
+            return ''
+        parsed = urlparse(url.value)
+        if parsed.netloc or '://' in url.value:
+            return parsed.hostname or ''
+        # scp like locations of git and ssh, [user@]host:path
+        match = re.match(r'(?:[^@/:]+@)?([^/:]+):', url.value)
+        if match is not None and len(match.group(1)) > 1:
+            return match.group(1).lower()
+        return ''
+
+    def _output(self, args, directory):
+        """ Returns the output of the given command, None if it fails."""
+
+        try:
+            popen = subprocess.Popen(args, stdout=subprocess.PIPE,
+                                     stderr=subprocess.PIPE, cwd=directory)
+            out = popen.communicate()[0]
+        except OSError:
+            return None
+        if popen.returncode != 0:
+            return None
+        return out.decode('utf-8', 'replace').strip()
     
     def perform_post_download(self, env):
         """ Executes a list of Linux commands AFTER the download is finished """
@@ -353,15 +394,34 @@ class MercurialModuleSource(ModuleSource):
     def download(self, env):
         """ Downloads the code, of a specific version, using Mercurial."""
         
-        env.run(['hg', 'clone', '-U', self.attribute('url').value, env.srcdir])
+        if env.download_cache is None:
+            env.run(['hg', 'clone', '-U', self.attribute('url').value, 
+                     env.srcdir])
+        else:
+            # a local clone, with hardlinks to the files of the pool
+            env.run(['hg', 'clone', '-U', self._pool(env), env.srcdir])
+            with open(os.path.join(env.srcdir, '.hg', 'hgrc'), 'w') as f:
+                f.write('[paths]\ndefault = %s\n' % 
+                        self.attribute('url').value)
         env.run(['hg', 'update', '-r', self.attribute('revision').value],
                     directory=env.srcdir)
+
+    def _pool(self, env):
+        """ The repository of the download cache to get the changesets 
+        from."""
+
+        return env.download_cache.hg_repository(
+            env, self.attribute('url').value, 
+            self.attribute('revision').value)
         
     def update(self, env):
         """ Updates the code using a specific version from the repository."""
 
-        env.run(['hg', 'pull', self.attribute('url').value], 
-                directory=env.srcdir)
+        if env.download_cache is None:
+            env.run(['hg', 'pull', self.attribute('url').value], 
+                    directory=env.srcdir)
+        else:
+            env.run(['hg', 'pull', self._pool(env)], directory=env.srcdir)
         env.run(['hg', 'update', '-r', self.attribute('revision').value],
                 directory=env.srcdir)
         
@@ -369,6 +429,28 @@ class MercurialModuleSource(ModuleSource):
         """ Checks if the tool is available and with the needed version."""
         return env.check_program('hg')
 
+    def head(self, env):
+        """ The first parent of the working directory, at the start of the
+        dirstate file."""
+
+        try:
+            with open(os.path.join(env.srcdir, '.hg', 'dirstate'), 'rb') as f:
+                parent = f.read(20)
+        except IOError:
+            return ''
+        return binascii.hexlify(parent).decode('ascii')
+
+    def revision(self, env):
+        """ The changeset of the working directory, hg marks it with a + 
+        when there are local changes."""
+
+        if not os.path.isdir(os.path.join(env.srcdir, '.hg')):
+            return None
+        changeset = self._output(['hg', 'id', '-i'], env.srcdir)
+        if not changeset or changeset.endswith('+'):
+            return None
+        return 'hg:' + changeset
+
 
 import shutil
 class ArchiveModuleSource(ModuleSource):
@@ -389,6 +471,10 @@ class ArchiveModuleSource(ModuleSource):
                            "be extracted to naturally. If no value is "
                            "specified, directory is assumed to be equal to "
                            "the  archive without the file extension.")
+        self.add_attribute('sha256', '', 'SHA-256 digest of the archive.'
+                           ' When given, archives with another digest are'
+                           ' rejected, and the archive is kept in the'
+                           ' download cache, if there is one.')
     @classmethod
     def name(cls):
         """ Identifier of the type of the tool used."""
@@ -417,7 +503,14 @@ class ArchiveModuleSource(ModuleSource):
         # finds the right tool
         for extension, command in extensions:
             if filename.endswith(extension):
-                env.run(command + [filename], directory=tempdir)
+                archive = filename
+                if command[0] == 'unxz':
+                    # unxz replaces the archive by its content, that would
+                    # consume the archive of the download cache, it works 
+                    # on a copy in the extraction directory instead
+                    archive = os.path.join(tempdir, os.path.basename(filename))
+                    shutil.copy(filename, archive)
+                env.run(command + [archive], directory=tempdir)
                 if self.attribute('extract_directory').value is not None:
                     actual_extract_dir = self.attribute('extract_directory').value
                 else:
@@ -444,6 +537,43 @@ class ArchiveModuleSource(ModuleSource):
         raise TaskError('Unknown Archive Type: %s, for module: %s' % 
                         (filename, env._module_name))
 
+    def _retrieve(self, env, path):
+        """ Downloads the archive into the given file, and returns its 
+        SHA-256 digest, computed while the data arrives."""
+
+        import hashlib
+        digest = hashlib.sha256()
+        try:
+            response = urlopen(self.attribute('url').value)
+            try:
+                with open(path, 'wb') as f:
+                    while True:
+                        block = response.read(1024 * 1024)
+                        if not block:
+                            break
+                        digest.update(block)
+                        f.write(block)
+            finally:
+                response.close()
+        except (IOError, OSError) as e:
+            if os.path.exists(path):
+                os.remove(path)
+            raise TaskError('Download problem for module: %s, URL: %s, Error: %s' 
+                            % (env._module_name,self.attribute('url').value, e))
+        return digest.hexdigest()
+
+    def _verify(self, env, path, digest):
+        """ Rejects the downloaded archive if it has not the expected 
+        digest."""
+
+        expected = self.attribute('sha256').value.strip().lower()
+        if expected != '' and digest != expected:
+            os.remove(path)
+            raise TaskError('Checksum mismatch for module: %s, URL: %s,'
+                            ' expected sha256 %s, got %s' 
+                            % (env._module_name, self.attribute('url').value,
+                               expected, digest))
+
     def download(self, env):
         """Downloads the specific file."""
         
@@ -452,13 +582,20 @@ class ArchiveModuleSource(ModuleSource):
         url_local = self.attribute('url').value
        
         filename = os.path.basename(urlparse(url_local).path)
+        expected = self.attribute('sha256').value.strip().lower()
+        cache = env.download_cache
+        if cache is not None and expected != '':
+            # archives are kept in the cache by digest, hits need no network
+            archive = cache.archive(expected, filename)
+            if not os.path.isfile(archive):
+                tmpfile = cache.temporary()
+                self._verify(env, tmpfile, self._retrieve(env, tmpfile))
+                cache.add_archive(tmpfile, expected, filename)
+            self._decompress(archive, env)
+            return
+
         tmpfile = os.path.join(env.srcrepo, filename)
-        try:
-            urlretrieve(url_local, filename=tmpfile)
-        except IOError as e:
-            raise TaskError('Download problem for module: %s, URL: %s, Error: %s' 
-                            % (env._module_name,self.attribute('url').value, e))
-            
+        self._verify(env, tmpfile, self._retrieve(env, tmpfile))
         self._decompress(tmpfile, env)
         
     def update(self, env):
@@ -888,12 +1025,101 @@ class GitModuleSource(ModuleSource):
                            " reference.")
         self.add_attribute('branch', '', 'Branch to checkout.')
         self.add_attribute('fetch_option', '', 'Options to add git fetch command.')
+        self.add_attribute('depth', '', 'Number of commits of history to'
+                           ' fetch, 0 for the whole history. By default the'
+                           ' one of the --git-depth option')
+        self.add_attribute('single_branch', '', 'True to fetch only the'
+                           ' branch and revision to checkout, False to fetch'
+                           ' all of them. By default True if the'
+                           ' --git-single-branch option is given')
+        self.add_attribute('filter', '', 'Partial clone filter, e.g.'
+                           ' blob:none to fetch the file contents only when'
+                           ' they are needed, none to fetch everything. By'
+                           ' default the one of the --git-filter option')
     @classmethod
     def name(cls):
         """ Identifier of the type of the tool used."""
         
         return 'git'
 
+    def _fetch_settings(self, env):
+        """ The depth, filter and single branch settings of the download,
+        from the attributes of the module or else the global options."""
+
+        defaults = env.git_defaults
+        depth = self.attribute('depth').value or defaults.get('depth', '')
+        if depth in ['', '0']:
+            depth = None
+        elif not depth.isdigit():
+            raise TaskError('Attribute depth should be an integer, got "%s"' %
+                            depth)
+        spec = self.attribute('filter').value or defaults.get('filter', '')
+        if spec in ['', 'none']:
+            spec = None
+        single = self.attribute('single_branch').value
+        if single == '':
+            single = defaults.get('single_branch', False)
+        else:
+            single = single == 'True'
+        return depth, spec, single
+
+    def _narrow_download(self, env, directory, depth, spec, single):
+        """ Fetches, in one round trip, only the branch and the revision
+        to checkout, with at most depth commits of history, and without 
+        the objects the filter leaves out."""
+
+        branch = self.attribute('branch').value
+        revision = self.attribute('revision').value
+        refs = [ref for ref in [branch, revision] if ref != '']
+        if not refs:
+            branch = 'master'
+            refs = [branch]
+        if single and branch != '':
+            # the next fetches, of bake update, stay on the branch
+            env.run(['git', 'config', 'remote.origin.fetch', 
+                     '+refs/heads/%s:refs/remotes/origin/%s' % 
+                     (branch, branch)], directory=directory)
+        fetch = ['git', 'fetch']
+        if depth is not None:
+            fetch.append('--depth=' + depth)
+        if spec is not None:
+            # the objects that are left out come later from the remote
+            env.run(['git', 'config', 'remote.origin.promisor', 'true'],
+                    directory=directory)
+            env.run(['git', 'config', 'remote.origin.partialclonefilter', 
+                     spec], directory=directory)
+            fetch.append('--filter=' + spec)
+        if self.attribute('fetch_option').value != '':
+            fetch.append(self.attribute('fetch_option').value)
+        env.run(fetch + ['origin'] + refs, directory=directory)
+        self._store_fetched(env, directory)
+        for ref in [branch, revision]:
+            if ref != '':
+                env.run(['git', 'checkout', ref], directory=directory)
+
+    def _store_fetched(self, env, directory):
+        """ Keeps the branches and tags fetched by name under their usual
+        references, so that checkout and rebase find them."""
+
+        try:
+            with open(os.path.join(directory, '.git', 'FETCH_HEAD')) as f:
+                lines = f.readlines()
+        except IOError:
+            return
+        for line in lines:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) < 3:
+                continue
+            match = re.match(r"(branch|tag) '(.+)' of ", fields[2])
+            if match is None:
+                continue
+            if match.group(1) == 'branch':
+                ref = 'refs/remotes/origin/' + match.group(2)
+            else:
+                ref = 'refs/tags/' + match.group(2)
+            env.run(['git', 'update-ref', ref, fields[0]], 
+                    directory=directory)
+
     def download(self, env):
         import tempfile
         import os
@@ -909,6 +1135,14 @@ class GitModuleSource(ModuleSource):
         env.run(['git', 'init'], directory=tempdir)
         env.run(['git', 'remote', 'add', 'origin', self.attribute('url').value],
                 directory=tempdir)
+        self._borrow(env, tempdir)
+        depth, spec, single = self._fetch_settings(env)
+        if depth is not None or spec is not None or single:
+            self._narrow_download(env, tempdir, depth, spec, single)
+            self._dissolve(env, tempdir)
+            os.rename(tempdir, env.srcdir)
+            return
+
         if self.attribute('fetch_option').value != '':
             env.run(['git', 'fetch', self.attribute('fetch_option').value],
                     directory=tempdir)
@@ -928,11 +1162,50 @@ class GitModuleSource(ModuleSource):
         if not checkedOut:
             env.run(['git', 'pull', 'origin', 'master'], directory=tempdir)
 
+        self._dissolve(env, tempdir)
         os.rename(tempdir, env.srcdir)
 
+    def _alternates(self, directory):
+        return os.path.join(directory, '.git', 'objects', 'info', 
+                            'alternates')
+
+    def _borrow(self, env, directory):
+        """ Makes the repository read the objects of the mirror of the 
+        download cache, as git clone --reference does, so that the fetches
+        only transfer what the mirror does not have."""
+
+        if env.download_cache is None:
+            return
+        mirror = env.download_cache.git_mirror(env, self.attribute('url').value)
+        with open(self._alternates(directory), 'w') as f:
+            f.write(os.path.join(mirror, 'objects') + '\n')
+
+    def _dissolve(self, env, directory):
+        """ Copies the objects borrowed from the mirror into the 
+        repository, if the download cache says so, as git clone --dissolve
+        does."""
+
+        if env.download_cache is None or not env.download_cache.dissolve():
+            return
+        env.run(['git', 'repack', '-a', '-d', '-q'], directory=directory)
+        os.remove(self._alternates(directory))
+
     def update(self, env):
         """ Updates the code using a specific version from the repository."""
 
+        remote = 'origin'
+        if env.download_cache is not None:
+            remote = env.download_cache.git_mirror(env, 
+                                                   self.attribute('url').value)
+        self._deepen(env, remote)
+        if remote != 'origin':
+            # the fetch from the mirror stays on the machine
+            refspecs = self._output(['git', 'config', '--get-all', 
+                                     'remote.origin.fetch'], env.srcdir)
+            if not refspecs:
+                refspecs = '+refs/heads/*:refs/remotes/origin/*'
+            env.run(['git', 'fetch', '--tags', remote] + refspecs.split(),
+                    directory=env.srcdir)
         env.run(['git', 'stash'], directory=env.srcdir)
         env.run(['git', 'rebase', self.attribute('revision').value], directory=env.srcdir)
         try:
@@ -947,6 +1220,72 @@ class GitModuleSource(ModuleSource):
 #        env.run(['git', 'checkout', self.attribute('revision').value],
 #                          directory=env.srcdir)
 
+    def _deepen(self, env, remote='origin'):
+        """ Fetches the whole history of a shallow repository, and the 
+        revision to update to if it is not there, as the update rebases on
+        it."""
+
+        if not os.path.exists(os.path.join(env.srcdir, '.git', 'shallow')):
+            return
+        env.run(['git', 'fetch', '--unshallow', remote], 
+                directory=env.srcdir)
+        revision = self.attribute('revision').value
+        if revision == '' or self._output(['git', 'rev-parse', '--quiet', 
+                                           '--verify', revision + 
+                                           '^{commit}'], 
+                                          env.srcdir) is not None:
+            return
+        env.run(['git', 'fetch', remote, revision], directory=env.srcdir)
+        self._store_fetched(env, env.srcdir)
+
     def check_version(self, env):
         """ Checks if the tool is available and with the needed version."""
         return env.check_program('git')
+
+    def head(self, env):
+        """ The commit checked out, read from HEAD and the references of the
+        repository."""
+
+        gitdir = os.path.join(env.srcdir, '.git')
+        try:
+            if os.path.isfile(gitdir):
+                # worktrees and submodules point to their repository
+                with open(gitdir) as f:
+                    line = f.read().strip()
+                if line.startswith('gitdir:'):
+                    gitdir = os.path.join(env.srcdir, line[7:].strip())
+            with open(os.path.join(gitdir, 'HEAD')) as f:
+                head = f.read().strip()
+        except IOError:
+            return ''
+        if not head.startswith('ref:'):
+            return head
+        ref = head[4:].strip()
+        try:
+            with open(os.path.join(gitdir, ref)) as f:
+                return f.read().strip()
+        except IOError:
+            pass
+        try:
+            with open(os.path.join(gitdir, 'packed-refs')) as f:
+                for line in f:
+                    fields = line.split()
+                    if len(fields) == 2 and fields[1] == ref:
+                        return fields[0]
+        except IOError:
+            pass
+        return head
+
+    def revision(self, env):
+        """ The commit checked out, if there are no local changes, nor 
+        untracked files."""
+
+        if not os.path.exists(os.path.join(env.srcdir, '.git')):
+            return None
+        status = self._output(['git', 'status', '--porcelain'], env.srcdir)
+        if status is None or status != '':
+            return None
+        commit = self._output(['git', 'rev-parse', 'HEAD'], env.srcdir)
+        if not commit:
+            return None
+        return 'git:' + commit
@@ -0,0 +1,163 @@
+###############################################################################
+# Copyright (c) 2013 INRIA
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation;
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Authors: Daniel Camara  <daniel.camara@inria.fr>
+#          Mathieu Lacage <mathieu.lacage@sophia.inria.fr>
+###############################################################################
+'''
+ Trace.py
+
+ Timeline of a bake run, in the Chrome Trace Event format. The resulting
+ file can be opened in chrome://tracing or in Perfetto, to see where the
+ time of a build goes.
+'''
+
+import json
+import os
+import threading
+import time
+
+class Span:
+    """ One traced interval, to be used in a with statement."""
+
+    def __init__(self, trace, name, category, args):
+        self._trace = trace
+        self._name = name
+        self._category = category
+        self._args = args
+        self._start = None
+
+    def args(self):
+        return self._args
+
+    def __enter__(self):
+        self._start = time.time()
+        self._trace._push(self)
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if type is not None:
+            self._args['error'] = str(value)
+        self._trace._complete(self._name, self._category, self._start,
+                              time.time(), self._args)
+        self._trace._pop(self)
+        return False
+
+class NoSpan:
+    """ Span that records nothing, used when no trace is asked for."""
+
+    def args(self):
+        return dict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        return False
+
+class Trace:
+    """ Collects the spans of the modules processed by bake. The spans
+    of a thread are shown nested on a lane of the timeline, that is given
+    back when the outermost span of the thread ends. The number of lanes
+    is then the number of modules that were processed at the same time.
+    """
+
+    def __init__(self, filename):
+        self._filename = filename
+        self._events = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._lanes = set()
+        self._named = set()
+        self._pid = os.getpid()
+        self._origin = time.time()
+
+    def filename(self):
+        return self._filename
+
+    def span(self, name, category='phase', args=None):
+        """ Returns the span of the given name, to be used in a with
+        statement."""
+
+        if args is None:
+            args = dict()
+        return Span(self, name, category, args)
+
+    def current(self):
+        """ Innermost span open in the calling thread, None if there is
+        none."""
+
+        stack = getattr(self._local, 'stack', None)
+        if not stack:
+            return None
+        return stack[-1]
+
+    def command(self, args, directory=None):
+        """ Returns the span of an external program run on behalf of the
+        current span, which also keeps the argv of the program."""
+
+        argv = [str(arg) for arg in args]
+        parent = self.current()
+        if parent is not None:
+            parent.args().setdefault('argv', []).append(argv)
+        return self.span(os.path.basename(argv[0]), 'command',
+                         {'argv': argv, 'cwd': str(directory)})
+
+    def _push(self, span):
+        if not getattr(self._local, 'stack', None):
+            self._local.stack = []
+            with self._lock:
+                lane = 1
+                while lane in self._lanes:
+                    lane = lane + 1
+                self._lanes.add(lane)
+            self._local.lane = lane
+        self._local.stack.append(span)
+
+    def _pop(self, span):
+        stack = self._local.stack
+        if span in stack:
+            stack.remove(span)
+        if not stack:
+            with self._lock:
+                self._lanes.discard(self._local.lane)
+
+    def _complete(self, name, category, start, end, args):
+        lane = self._local.lane
+        with self._lock:
+            if lane not in self._named:
+                self._named.add(lane)
+                self._events.append({'name': 'thread_name', 'ph': 'M',
+                                     'pid': self._pid, 'tid': lane,
+                                     'args': {'name': 'lane %d' % lane}})
+            self._events.append({'name': name, 'cat': category, 'ph': 'X',
+                                 'ts': int((start - self._origin) * 1000000),
+                                 'dur': int((end - start) * 1000000),
+                                 'pid': self._pid, 'tid': lane,
+                                 'args': args})
+
+    def events(self):
+        """ The events recorded so far."""
+
+        with self._lock:
+            return list(self._events)
+
+    def write(self):
+        """ Writes the trace file."""
+
+        with open(self._filename, 'w') as trace:
+            json.dump({'traceEvents': self.events(),
+                       'displayTimeUnit': 'ms'}, trace)
@@ -28,6 +28,7 @@ import subprocess
 import os
 import shutil
 import sys
+import threading
 from xml.etree import ElementTree
 from xml.dom import minidom
 from bake.Exceptions import TaskError
@@ -136,6 +137,34 @@ def mergeDirs(sourcePath, destPath):
 #                    print 'file "' + f + '" already exists'
                     pass
 
+# metadata directories of the version control systems, not part of the 
+# source trees
+VCS_DIRECTORIES = ['.git', '.hg', '.bzr', '.svn', 'CVS']
+
+def stat_tree_hash(directory, skip=set()):
+    """ Fast hash of a directory tree, from the names, sizes, modes and 
+    modification times of its files, without reading them. The skipped
+    directories, and the VCS metadata, are not entered.
+    """
+
+    import hashlib
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = sorted([d for d in dirs if not d in VCS_DIRECTORIES and 
+                          not os.path.join(root, d) in skip])
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            try:
+                st = os.lstat(path)
+            except OSError:
+                continue
+            mtime = getattr(st, 'st_mtime_ns', None)
+            if mtime is None:
+                mtime = int(st.st_mtime * 1000000000)
+            digest.update(('%s\0%d %d %o\n' % 
+                           (os.path.relpath(path, directory), st.st_size, 
+                            mtime, st.st_mode)).encode('utf-8', 'replace'))
+    return digest.hexdigest()
 
 class ModuleAttribute:
     """ Definition of the Bake attribute. An attribute is basically one of the 
@@ -205,6 +234,54 @@ class ModuleAttributeBase(object):
         else:
             return self._attributes[name]
 
+class ThreadOutput:
+    """ Standard output shared by the modules processed in parallel. What 
+    a thread writes while it buffers its output is kept apart, and written 
+    at once when it stops, so that the lines of the modules do not mix.
+    """
+
+    _local = threading.local()
+    _lock = threading.Lock()
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def write(self, data):
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is not None:
+            buffer.append(data)
+            return
+        with self._lock:
+            self._stream.write(data)
+
+    def flush(self):
+        if getattr(self._local, 'buffer', None) is None:
+            self._stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+    @classmethod
+    def start(cls):
+        """ Starts buffering the standard output of the thread."""
+
+        with cls._lock:
+            if not isinstance(sys.stdout, ThreadOutput):
+                sys.stdout = ThreadOutput(sys.stdout)
+        cls._local.buffer = []
+
+    @classmethod
+    def stop(cls):
+        """ Writes what the thread wrote since the start of the buffering,
+        and stops it."""
+
+        buffer = getattr(cls._local, 'buffer', None)
+        cls._local.buffer = None
+        if buffer and isinstance(sys.stdout, ThreadOutput):
+            with cls._lock:
+                sys.stdout._stream.write(''.join(buffer))
+                sys.stdout._stream.flush()
+
 class ColorTool:
     """ Class responsible to handle the colored message printing."""
         
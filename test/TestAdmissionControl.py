@@ -0,0 +1,99 @@
+###############################################################################
+# Copyright (c) 2013 INRIA
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation;
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Authors: Daniel Camara  <daniel.camara@inria.fr>
+#          Mathieu Lacage <mathieu.lacage@sophia.inria.fr>
+###############################################################################
+import unittest
+# hack to save ourselves from having to use PYTHONPATH
+import sys
+import os
+import threading
+import time
+
+from bake.AdmissionControl import AdmissionControl
+
+sys.path.append(os.path.join (os.getcwd(), '..'))
+
+class Host(AdmissionControl):
+    """ Admission control on a fake host, 8 CPUs and 16GB of memory."""
+
+    POLL_INTERVAL = 0.01
+    host = {'cpus': 8, 'memory': 16 * 1024, 'load': 0.0}
+
+    @classmethod
+    def cpus(cls):
+        return cls.host['cpus']
+    @classmethod
+    def memory(cls):
+        return cls.host['memory']
+    @classmethod
+    def load(cls):
+        return cls.host['load']
+
+class TestAdmissionControl(unittest.TestCase):
+    """Tests cases for the AdmissionControl Class."""
+
+    def setUp(self):
+        """Common set Up environment, available for all tests."""
+        Host.host = {'cpus': 8, 'memory': 16 * 1024, 'load': 0.0}
+
+    def test_jobs(self):
+        """Tests the number of jobs given to the builds. """
+
+        admission = Host()
+        self.assertEqual(admission.default_jobs(), 8)
+        self.assertEqual(admission.default_jobs(4096), 4)
+        self.assertEqual(admission.admit(), 8)
+        admission.release()
+        self.assertEqual(admission.admit(16), 16)
+        admission.release()
+        self.assertEqual(admission.admit(-1, 4096), 4)
+        admission.release()
+        self.assertEqual(admission.admit(-1, None, 2), 2)
+        admission.release()
+        # there is always room for at least one job
+        Host.host['memory'] = 100
+        self.assertEqual(admission.admit(-1, 4096), 1)
+        admission.release()
+
+    def test_hold_back(self):
+        """Tests that builds wait while the host is busy. """
+
+        admission = Host()
+        Host.host['load'] = 12.0
+        # the only build always starts, no matter the load
+        admission.admit()
+        admitted = []
+        def build():
+            admitted.append(admission.admit())
+        thread = threading.Thread(target=build)
+        thread.start()
+        time.sleep(0.1)
+        self.assertEqual(admitted, [])
+        Host.host['load'] = 2.0
+        thread.join(5)
+        self.assertEqual(admitted, [8])
+        admission.release()
+
+        # with a jobserver only the memory holds builds back
+        Host.host['load'] = 12.0
+        self.assertEqual(admission.admit(shared=True), 8)
+        admission.release()
+        admission.release()
+
+if __name__ == '__main__':
+    unittest.main()
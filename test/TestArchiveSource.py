@@ -0,0 +1,126 @@
+###############################################################################
+# Copyright (c) 2013 INRIA
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation;
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Authors: Daniel Camara  <daniel.camara@inria.fr>
+#          Mathieu Lacage <mathieu.lacage@sophia.inria.fr>
+###############################################################################
+import unittest
+# hack to save ourselves from having to use PYTHONPATH
+import sys
+import os
+import shutil
+import hashlib
+import tarfile
+import tempfile
+
+from bake.DownloadCache import DownloadCache
+from bake.Exceptions import TaskError
+from bake.ModuleEnvironment import ModuleEnvironment
+from bake.ModuleLogger import StdoutModuleLogger
+from bake.ModuleSource import ModuleSource
+
+sys.path.append(os.path.join (os.getcwd(), '..'))
+
+class TestArchiveSource(unittest.TestCase):
+    """Tests cases for the verified archive downloads."""
+
+    def setUp(self):
+        """Common set Up environment, available for all tests."""
+        self._dir = tempfile.mkdtemp()
+        content = os.path.join(self._dir, 'pkg-1.0')
+        os.makedirs(content)
+        with open(os.path.join(content, 'file'), 'w') as f:
+            f.write('content\n')
+        os.makedirs(os.path.join(self._dir, 'remote'))
+        self._archive = os.path.join(self._dir, 'remote', 'pkg-1.0.tar.gz')
+        archive = tarfile.open(self._archive, 'w:gz')
+        archive.add(content, arcname='pkg-1.0')
+        archive.close()
+        shutil.rmtree(content)
+        with open(self._archive, 'rb') as f:
+            self._digest = hashlib.sha256(f.read()).hexdigest()
+        self._cache = DownloadCache(os.path.join(self._dir, 'cache'))
+
+    def tearDown(self):
+        """Cleans the environment environment for the next tests."""
+        shutil.rmtree(self._dir)
+
+    def _download(self, name, digest, cache=None):
+        """ Downloads the archive into name, and returns the source 
+        directory."""
+
+        env = ModuleEnvironment(StdoutModuleLogger(), self._dir, self._dir)
+        env.download_cache = cache
+        source = ModuleSource.create('archive')
+        source.attribute('url').value = 'file://' + self._archive
+        source.attribute('sha256').value = digest
+        env.start_source(name, name)
+        try:
+            source.download(env)
+        finally:
+            env.end_source()
+        return os.path.join(self._dir, name)
+
+    def test_download_cache(self):
+        """ Tests the downloads through the download cache. """
+
+        srcdir = self._download('a', self._digest.upper(), self._cache)
+        self.assertTrue(os.path.isfile(os.path.join(srcdir, 'file')))
+        self.assertTrue(os.path.isfile(self._cache.archive(self._digest, 
+                                                           'pkg-1.0.tar.gz')))
+        # the cache hits do not download the archive again
+        os.rename(self._archive, self._archive + '.moved')
+        srcdir = self._download('b', self._digest, self._cache)
+        self.assertTrue(os.path.isfile(os.path.join(srcdir, 'file')))
+        self.assertRaises(TaskError, self._download, 'c', '', self._cache)
+
+    def test_mismatch(self):
+        """ Tests that the archives with another digest are rejected. """
+
+        for cache in [None, self._cache]:
+            self.assertRaises(TaskError, self._download, 'a', '0' * 64, 
+                              cache)
+            self.assertFalse(os.path.exists(os.path.join(self._dir, 'a')))
+        self.assertEqual(os.listdir(os.path.join(self._cache.directory(), 
+                                                 'archives')), [])
+        self.assertFalse(os.path.exists(os.path.join(self._dir, 
+                                                     'pkg-1.0.tar.gz')))
+        self._download('a', '')
+
+    def test_cached_xz(self):
+        """ Tests that extracting a cached xz archive does not consume it. """
+
+        try:
+            import lzma
+        except ImportError:
+            return
+        self._archive = os.path.join(self._dir, 'remote', 'pkg-1.0.xz')
+        with lzma.open(self._archive, 'wb') as f:
+            f.write(b'content\n')
+        with open(self._archive, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        self._download('a', digest, self._cache)
+        # the second extraction is a cache hit, of the same archive
+        os.rename(self._archive, self._archive + '.moved')
+        self._download('b', digest, self._cache)
+        for name in ['a', 'b']:
+            with open(os.path.join(self._dir, name)) as f:
+                self.assertEqual(f.read(), 'content\n')
+        self.assertTrue(os.path.isfile(self._cache.archive(digest, 
+                                                           'pkg-1.0.xz')))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -31,6 +31,7 @@ from bake.ModuleLogger import StdoutModuleLogger
 from bake.ModuleSource import ModuleSource
 from bake.Exceptions import TaskError
 from bake.Bake import Bake
+from bake.Module import ModuleDependency
 
 
 sys.path.append(os.path.join (os.getcwd(), '..'))
@@ -551,7 +552,47 @@ class TestBake(unittest.TestCase):
             self.fail("Should have stoped")
         except SystemExit as e: 
             self.assertTrue(returnValue==None, 'Error during dependencies processing')    
- 
+
+    def test_pipeline_optional(self):
+        """Tests the modules whose download fails under --pipeline, when 
+        they are optional dependencies. """
+
+        class Module:
+            def __init__(self, name, dependencies=[]):
+                self._name = name
+                self._source = None
+                self._dependencies = dependencies
+            def name(self):
+                return self._name
+            def dependencies(self):
+                return self._dependencies
+            def duration(self, phase):
+                return None
+        class Configuration:
+            def __init__(self, modules):
+                self._modules = modules
+            def modules(self):
+                return self._modules
+            def lookup(self, name):
+                return [m for m in self._modules if m._name == name][0]
+            def disabled(self):
+                return []
+            def write(self):
+                pass
+        for keep_going in [False, True]:
+            modules = [Module('main', [ModuleDependency('opt', True), 
+                                       ModuleDependency('a')]), 
+                       Module('opt', [ModuleDependency('a')]), Module('a')]
+            built = []
+            def build(module):
+                built.append(module._name)
+                return True
+            def download(module):
+                return module._name != 'opt'
+            Bake()._iterate(Configuration(modules), build, modules[:1], 
+                            jobs=2, prefetch=download, keep_going=keep_going)
+            # the optional module is not built without its sources
+            self.assertEqual(sorted(built), ['a', 'main'])
 
 
 # main call for the tests        
@@ -0,0 +1,253 @@
+###############################################################################
+# Copyright (c) 2013 INRIA
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation;
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Authors: Daniel Camara  <daniel.camara@inria.fr>
+#          Mathieu Lacage <mathieu.lacage@sophia.inria.fr>
+###############################################################################
+import unittest
+# hack to save ourselves from having to use PYTHONPATH
+import sys
+import os
+import shutil
+import tempfile
+import binascii
+import time
+
+from bake.BuildCache import BuildCache
+from bake.Module import Module, ModuleDependency
+from bake.ModuleSource import ModuleSource
+from bake.ModuleBuild import ModuleBuild
+from bake.ModuleEnvironment import ModuleEnvironment
+from bake.ModuleLogger import StdoutModuleLogger
+
+sys.path.append(os.path.join (os.getcwd(), '..'))
+
+class Configuration:
+    """ The part of the configuration the cache looks at."""
+
+    def __init__(self, modules):
+        self._modules = modules
+
+    def lookup(self, name):
+        for module in self._modules:
+            if module.name() == name:
+                return module
+        return None
+
+    def disabled(self):
+        return []
+
+class TestBuildCache(unittest.TestCase):
+    """Tests cases for the BuildCache Class."""
+
+    def setUp(self):
+        """Common set Up environment, available for all tests."""
+        self._dir = tempfile.mkdtemp()
+        self._sourcedir = os.path.join(self._dir, 'source')
+        self._installdir = os.path.join(self._dir, 'build')
+        self._env = ModuleEnvironment(StdoutModuleLogger(), self._installdir,
+                                      self._sourcedir)
+        for name in ['a', 'b']:
+            os.makedirs(os.path.join(self._sourcedir, name))
+            self._write(os.path.join(self._sourcedir, name, 'Makefile'), 
+                        'all:\n')
+        self._a = self._module('a', [])
+        self._b = self._module('b', [ModuleDependency('a', False)])
+
+    def tearDown(self):
+        """Cleans the environment environment for the next tests."""
+        shutil.rmtree(self._dir)
+
+    def _write(self, path, content):
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def _module(self, name, dependencies):
+        return Module(name, ModuleSource.create('archive'), 
+                      ModuleBuild.create('make'), None, None, None, 
+                      dependencies)
+
+    def _keys(self, env=None):
+        """ Keys of the modules, computed by a new cache, as on a new run."""
+
+        env = env or self._env
+        cache = BuildCache(os.path.join(self._dir, 'cache'))
+        configuration = Configuration([self._a, self._b])
+        return (cache.key(configuration, self._a, env),
+                cache.key(configuration, self._b, env))
+
+    def test_key(self):
+        """Tests what the cache keys depend on. """
+
+        a, b = self._keys()
+        self.assertEqual(self._keys(), (a, b))
+        # the keys do not depend on the installation directory
+        env = ModuleEnvironment(StdoutModuleLogger(), 
+                                os.path.join(self._dir, 'other'), 
+                                self._sourcedir)
+        self.assertEqual(self._keys(env), (a, b))
+        # the key of a module changes with its dependencies
+        self._write(os.path.join(self._sourcedir, 'a', 'Makefile'), 'all:\n\n')
+        a2, b2 = self._keys()
+        self.assertNotEqual(a, a2)
+        self.assertNotEqual(b, b2)
+        # and with its build options
+        self._b.get_build().attribute('build_arguments').value = 'V=1'
+        self.assertEqual(self._keys()[0], a2)
+        self.assertNotEqual(self._keys()[1], b2)
+        # the object directory is not part of the source tree
+        self._b.get_build().attribute('objdir').value = 'objdir'
+        b3 = self._keys()[1]
+        os.makedirs(os.path.join(self._sourcedir, 'b', 'objdir'))
+        self._write(os.path.join(self._sourcedir, 'b', 'objdir', 'b.o'), '')
+        self.assertEqual(self._keys()[1], b3)
+        # a module without sources cannot be cached
+        shutil.rmtree(os.path.join(self._sourcedir, 'a'))
+        self.assertEqual(self._keys(), (None, None))
+
+    def test_store(self):
+        """Tests storing and restoring the installed files. """
+
+        cache = BuildCache(os.path.join(self._dir, 'cache'))
+        lib = os.path.join(self._installdir, 'lib')
+        os.makedirs(lib)
+        self._write(os.path.join(lib, 'liba.so.1'), 'a')
+        os.symlink('liba.so.1', os.path.join(lib, 'liba.so'))
+        installed = [os.path.join(lib, 'liba.so'), 
+                     os.path.join(lib, 'liba.so.1')]
+        
+        self.assertEqual(cache.restore('1234', self._installdir), None)
+        self.assertFalse(cache.store('1234', 'a', self._installdir, []))
+        self.assertTrue(cache.store('1234', 'a', self._installdir, installed))
+        
+        shutil.rmtree(self._installdir)
+        self.assertEqual(cache.restore('1234', self._installdir), installed)
+        with open(os.path.join(lib, 'liba.so')) as f:
+            self.assertEqual(f.read(), 'a')
+        self.assertTrue(os.path.islink(os.path.join(lib, 'liba.so')))
+        # no temporary files left
+        self.assertEqual(sorted(os.listdir(cache.directory())), ['12'])
+
+    def test_workspaces(self):
+        """Tests restoring the files in another installation directory. """
+
+        cache = BuildCache(os.path.join(self._dir, 'cache'))
+        other = os.path.join(self._dir, 'other', 'build')
+        for installdir in [self._installdir, other]:
+            os.makedirs(os.path.join(installdir, 'lib', 'pkgconfig'))
+        lib = os.path.join(self._installdir, 'lib')
+        self._write(os.path.join(lib, 'pkgconfig', 'a.pc'), 
+                    'prefix=%s\n' % self._installdir)
+        os.symlink(os.path.join(lib, 'pkgconfig', 'a.pc'), 
+                   os.path.join(lib, 'a.pc'))
+        installed = [os.path.join(lib, 'a.pc'), 
+                     os.path.join(lib, 'pkgconfig', 'a.pc')]
+        self.assertTrue(cache.store('aa01', 'a', self._installdir, installed))
+
+        # the text files and links are rewritten for the other workspace
+        self.assertEqual(cache.restore('aa01', other), 
+                         [os.path.join(other, 'lib', 'a.pc'), 
+                          os.path.join(other, 'lib', 'pkgconfig', 'a.pc')])
+        with open(os.path.join(other, 'lib', 'a.pc')) as f:
+            self.assertEqual(f.read(), 'prefix=%s\n' % other)
+        self.assertEqual(os.readlink(os.path.join(other, 'lib', 'a.pc')),
+                         os.path.join(other, 'lib', 'pkgconfig', 'a.pc'))
+
+        # binary files are only restored in their workspace, the build in
+        # each workspace has its own entry
+        for installdir in [self._installdir, other]:
+            lib = os.path.join(installdir, 'lib')
+            self.assertEqual(cache.restore('bb02', installdir), None)
+            with open(os.path.join(lib, 'liba.so'), 'wb') as f:
+                f.write(b'\0rpath=' + lib.encode() + b'\0')
+            installed = [os.path.join(lib, 'liba.so')]
+            self.assertTrue(cache.store('bb02', 'a', installdir, installed))
+            os.remove(os.path.join(lib, 'liba.so'))
+            self.assertEqual(cache.restore('bb02', installdir), installed)
+        self.assertEqual(len(cache.entries()), 3)
+
+    def _random(self):
+        """ Content that does not compress, of about 1KB."""
+        return binascii.hexlify(os.urandom(1000)).decode()
+
+    def _store(self, cache, key, content, last_use):
+        lib = os.path.join(self._installdir, 'lib')
+        if not os.path.isdir(lib):
+            os.makedirs(lib)
+        self._write(os.path.join(lib, key), content)
+        self.assertTrue(cache.store(key, key, self._installdir, 
+                                    [os.path.join(lib, key)]))
+        os.utime(os.path.join(cache.directory(), key[:2], key, 
+                              BuildCache.MANIFEST), (last_use, last_use))
+
+    def test_prune(self):
+        """Tests the eviction of the least recently used entries. """
+
+        cache = BuildCache(os.path.join(self._dir, 'cache'))
+        for i, key in enumerate(['aa01', 'bb02', 'cc03']):
+            self._store(cache, key, self._random(), 1000 + i)
+        os.makedirs(os.path.join(cache.directory(), BuildCache.TMP + 'old'))
+        os.utime(os.path.join(cache.directory(), BuildCache.TMP + 'old'), 
+                 (1000, 1000))
+        stats = cache.stats()
+        self.assertEqual(stats['entries'], 3)
+        self.assertEqual(stats['oldest'], 1000)
+
+        # a restore makes the entry the most recently used
+        self.assertNotEqual(cache.restore('aa01', self._installdir), None)
+        size = stats['size'] // 3
+        (removed, freed) = cache.prune(2 * size + size // 2)
+        self.assertEqual(removed, 1)
+        self.assertEqual([e[0] for e in cache.entries()], ['aa01', 'cc03'])
+        # and so does storing the same build again
+        os.utime(os.path.join(cache.directory(), 'aa', 'aa01', 
+                              BuildCache.MANIFEST), (2000, 2000))
+        self.assertTrue(cache.store('cc03', 'cc03', self._installdir, 
+                                    [os.path.join(self._installdir, 'lib', 
+                                                  'cc03')]))
+        self.assertEqual([e[3] > 2000 for e in cache.entries()], 
+                         [False, True])
+        self.assertFalse(os.path.exists(os.path.join(cache.directory(),
+                                                     BuildCache.TMP + 'old')))
+
+        # the budget is also kept when storing
+        cache = BuildCache(os.path.join(self._dir, 'cache'), 
+                           2 * size + size // 2)
+        self._store(cache, 'dd04', self._random(), time.time())
+        self.assertEqual([e[0] for e in cache.entries()], ['cc03', 'dd04'])
+
+    def test_verify(self):
+        """Tests the removal of corrupted entries. """
+
+        cache = BuildCache(os.path.join(self._dir, 'cache'))
+        self._store(cache, 'aa01', 'a', 1000)
+        self._store(cache, 'bb02', 'b', 1000)
+        with open(os.path.join(cache.directory(), 'bb', 'bb02', 
+                               BuildCache.ARCHIVE), 'ab') as f:
+            f.write(b'garbage')
+        self.assertEqual(cache.verify(), (2, ['bb02']))
+        self.assertEqual([e[0] for e in cache.entries()], ['aa01'])
+
+    def test_size(self):
+        """Tests the parsing of the size budgets. """
+
+        self.assertEqual(BuildCache.parse_size('1024'), 1024)
+        self.assertEqual(BuildCache.parse_size('500M'), 500 * 1024 * 1024)
+        self.assertEqual(BuildCache.parse_size('1.5g'), 1536 * 1024 * 1024)
+        self.assertRaises(ValueError, BuildCache.parse_size, 'big')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+###############################################################################
+# Copyright (c) 2013 INRIA
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation;
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Authors: Daniel Camara  <daniel.camara@inria.fr>
+#          Mathieu Lacage <mathieu.lacage@sophia.inria.fr>
+###############################################################################
+import unittest
+# hack to save ourselves from having to use PYTHONPATH
+import sys
+import os
+import shutil
+import tempfile
+
+from bake.CompilerCache import CompilerCache
+from bake.ModuleBuild import ModuleBuild
+from bake.ModuleEnvironment import ModuleEnvironment
+from bake.ModuleLogger import StdoutModuleLogger
+
+sys.path.append(os.path.join (os.getcwd(), '..'))
+
+class TestCompilerCache(unittest.TestCase):
+    """Tests cases for the CompilerCache Class."""
+
+    def setUp(self):
+        """Common set Up environment, available for all tests."""
+        self._dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Cleans the environment environment for the next tests."""
+        shutil.rmtree(self._dir)
+
+    def test_stats(self):
+        """Tests the parsing of the statistics of the tools. """
+
+        self.assertEqual(CompilerCache.parse_ccache_print_stats(
+            'cache_miss\t5\ndirect_cache_hit\t12\n'
+            'preprocessed_cache_hit\t3\nfiles_in_cache\t40\n'), (15, 5))
+        self.assertEqual(CompilerCache.parse_ccache_stats(
+            'cache directory                     /home/u/.ccache\n'
+            'cache hit (direct)                    12\n'
+            'cache hit (preprocessed)               3\n'
+            'cache miss                             5\n'
+            'cache hit rate                     75.00 %\n'), (15, 5))
+        self.assertEqual(CompilerCache.parse_sccache_json(
+            '{"stats": {"cache_hits": {"counts": {"C/C++": 7, "Rust": 1}},'
+            ' "cache_misses": {"counts": {"C/C++": 2}}}}'), (8, 2))
+        self.assertEqual(CompilerCache.parse_sccache_stats(
+            'Compile requests                    20\n'
+            'Cache hits                          12\n'
+            'Cache hits (C/C++)                  12\n'
+            'Cache misses                         6\n'), (12, 6))
+        self.assertEqual(CompilerCache.parse_sccache_stats('error'), None)
+
+    def test_build(self):
+        """Tests how the builds are run through the compiler cache. """
+
+        cache = CompilerCache('ccache', '/opt/bin/ccache')
+        env = ModuleEnvironment(StdoutModuleLogger(), self._dir, self._dir)
+        cmake = ModuleBuild.create('cmake')
+        self.assertEqual(cmake._launchers(env), [])
+
+        env.compiler_cache = cache
+        self.assertEqual(cmake._launchers(env), 
+                         ['-DCMAKE_C_COMPILER_LAUNCHER=/opt/bin/ccache',
+                          '-DCMAKE_CXX_COMPILER_LAUNCHER=/opt/bin/ccache'])
+        cmake.attribute('compiler_cache').value = 'none'
+        self.assertEqual(cmake._launchers(env), [])
+
+        autotools = ModuleBuild.create('autotools')
+        autotools.attribute('CC').value = 'gcc-12'
+        variables = autotools._compiler_env(env)
+        self.assertEqual(variables['CC'], '/opt/bin/ccache gcc-12')
+        # compilers already run through the cache are left alone
+        autotools.attribute('CC').value = 'ccache gcc'
+        self.assertEqual(autotools._compiler_env(env)['CC'], 'ccache gcc')
+
+        waf = ModuleBuild.create('waf')
+        env.start_build('foo', 'foo', None)
+        variables = waf._cached_env(env)
+        self.assertTrue(variables['CXX'].startswith('/opt/bin/ccache '))
+        self.assertTrue('WAFCACHE' in variables)
+        env.compiler_cache = None
+        self.assertFalse('WAFCACHE' in waf._cached_env(env))
+        env.end_build()
+
+        self.assertEqual(cache.report(), 
+                         'Compiler cache (ccache): statistics not available')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,205 @@
+###############################################################################
+# Copyright (c) 2013 INRIA
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation;
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Authors: Daniel Camara  <daniel.camara@inria.fr>
+#          Mathieu Lacage <mathieu.lacage@sophia.inria.fr>
+###############################################################################
+import unittest
+# hack to save ourselves from having to use PYTHONPATH
+import sys
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from bake.ModuleBuild import ModuleBuild
+from bake.ModuleEnvironment import ModuleEnvironment
+from bake.ModuleLogger import StdoutModuleLogger
+
+sys.path.append(os.path.join (os.getcwd(), '..'))
+
+class TestConfigure(unittest.TestCase):
+    """Tests cases for the configuration step of the module builds."""
+
+    def setUp(self):
+        """Common set Up environment, available for all tests."""
+        self._dir = tempfile.mkdtemp()
+        self._srcdir = os.path.join(self._dir, 'source', 'a')
+        os.makedirs(self._srcdir)
+        self._env = ModuleEnvironment(StdoutModuleLogger(), 
+                                      os.path.join(self._dir, 'install'),
+                                      os.path.join(self._dir, 'source'))
+
+    def tearDown(self):
+        """Cleans the environment environment for the next tests."""
+        shutil.rmtree(self._dir)
+
+    def _write(self, name, content):
+        with open(os.path.join(self._srcdir, name), 'w') as f:
+            f.write(content)
+
+    def _configured(self, build, configure):
+        """ Builds the module and verifies if it ran the configuration."""
+
+        commands = []
+        run = ModuleEnvironment.run
+        def record(environment, args, *rest, **options):
+            commands.append(args)
+            return run(environment, args, *rest, **options)
+        self._env.start_build('a', 'a', build.objdir)
+        try:
+            with mock.patch.object(ModuleEnvironment, 'run', record):
+                build.build(self._env, 1)
+        finally:
+            self._env.end_build()
+        return len([c for c in commands if configure(c)]) > 0
+
+    def test_cmake(self):
+        """Tests that cmake only configures when something changed. """
+
+        if not ModuleEnvironment(StdoutModuleLogger(), self._dir, 
+                                 self._dir).check_program('cmake'):
+            self.skipTest('cmake is not available')
+        self._write('CMakeLists.txt', 'cmake_minimum_required(VERSION 3.5)\n'
+                    'project(a NONE)\n'
+                    'install(FILES a.txt DESTINATION share)\n')
+        self._write('a.txt', 'a\n')
+        cmake = ModuleBuild.create('cmake')
+        cmake.attribute('objdir').value = 'build'
+        configure = lambda c: c[0] == 'cmake' and not '--build' in c
+        self.assertTrue(self._configured(cmake, configure))
+        self.assertTrue(os.path.exists(os.path.join(self._dir, 'install', 
+                                                    'share', 'a.txt')))
+        self.assertFalse(self._configured(cmake, configure))
+        # other arguments
+        cmake.attribute('configure_arguments').value = '-DA=1'
+        self.assertTrue(self._configured(cmake, configure))
+        self.assertFalse(self._configured(cmake, configure))
+        # configured again by hand, with other arguments
+        time.sleep(0.01)
+        subprocess.check_call(['cmake', '-DA=2', '.'], 
+                              cwd=os.path.join(self._srcdir, 'build'),
+                              stdout=subprocess.PIPE)
+        self.assertTrue(self._configured(cmake, configure))
+        self.assertFalse(self._configured(cmake, configure))
+        # a CMake file changed
+        time.sleep(0.01)
+        self._write('CMakeLists.txt', 'cmake_minimum_required(VERSION 3.5)\n'
+                    'project(a NONE)\n')
+        self.assertTrue(self._configured(cmake, configure))
+        # the build directory was removed
+        shutil.rmtree(os.path.join(self._srcdir, 'build'))
+        self.assertTrue(self._configured(cmake, configure))
+
+    def test_waf(self):
+        """Tests that waf only configures when something changed. """
+
+        # waf that only writes its lock file and build directory
+        self._write('waf', 'import os, sys\n'
+                    'if "configure" in sys.argv:\n'
+                    '    out = os.path.join(os.getcwd(), "build")\n'
+                    '    if not os.path.isdir(out):\n'
+                    '        os.makedirs(out)\n'
+                    '    with open(".lock-waf_%s_build" % sys.platform,'
+                    ' "w") as f:\n'
+                    '        f.write("out_dir = %r\\n" % out)\n')
+        self._write('wscript', '')
+        waf = ModuleBuild.create('waf')
+        waf.attribute('configure_arguments').value = 'configure'
+        configure = lambda c: 'configure' in c
+        self.assertTrue(self._configured(waf, configure))
+        self.assertFalse(self._configured(waf, configure))
+        # other options
+        waf.attribute('configure_arguments').value = 'configure -d debug'
+        self.assertTrue(self._configured(waf, configure))
+        self.assertFalse(self._configured(waf, configure))
+        # other environment
+        waf.attribute('CXXFLAGS').value = '-O3'
+        self.assertTrue(self._configured(waf, configure))
+        self.assertFalse(self._configured(waf, configure))
+        # configured again by hand
+        time.sleep(0.01)
+        subprocess.check_call([sys.executable, 'waf', 'configure'], 
+                              cwd=self._srcdir)
+        self.assertTrue(self._configured(waf, configure))
+        self.assertFalse(self._configured(waf, configure))
+        # a wscript changed
+        time.sleep(0.01)
+        self._write('wscript', '# a\n')
+        self.assertTrue(self._configured(waf, configure))
+        # the build directory was removed
+        shutil.rmtree(os.path.join(self._srcdir, 'build'))
+        self.assertTrue(self._configured(waf, configure))
+
+    def test_autotools(self):
+        """Tests the shared autoconf cache and that autoreconf only runs
+        when configure is out of date. """
+
+        if not ModuleEnvironment(StdoutModuleLogger(), self._dir, 
+                                 self._dir).check_program('autoreconf'):
+            self.skipTest('autoconf is not available')
+        self._write('configure.ac', 'AC_INIT([a], [1.0])\n'
+                    'AC_PROG_CC\n'
+                    'AC_CHECK_HEADERS([stdio.h])\n'
+                    'AC_CONFIG_FILES([Makefile])\n'
+                    'AC_OUTPUT\n')
+        self._write('Makefile.in', 'all:\n'
+                    'install:\n')
+        autotools = ModuleBuild.create('autotools')
+        autotools.attribute('maintainer').value = 'yes'
+        autotools.attribute('objdir').value = 'build'
+        objdir = os.path.join(self._srcdir, 'build')
+        autotools.attribute('configure_arguments').value = '$SRCDIR/configure'
+        autoreconf = lambda c: c[0] == 'autoreconf'
+        # the shared cache is opt in, through the command line
+        self.assertEqual(autotools._config_cache(self._env), None)
+        self._env.shared_config_cache = True
+        self.assertTrue(self._configured(autotools, autoreconf))
+        caches = os.path.join(self._dir, 'source', '.config-cache')
+        self.assertEqual(len(os.listdir(caches)), 1)
+        shared = os.path.join(caches, os.listdir(caches)[0])
+        with open(shared) as f:
+            content = f.read()
+        self.assertTrue('ac_cv_header_stdio_h' in content)
+        self.assertFalse('ac_cv_env_' in content)
+        # configure is up to date, and starts from the shared results
+        with open(shared, 'a') as f:
+            f.write('ac_cv_bake_test=${ac_cv_bake_test=yes}\n')
+        self.assertFalse(self._configured(autotools, autoreconf))
+        with open(os.path.join(objdir, 'config.cache')) as f:
+            self.assertTrue('ac_cv_bake_test' in f.read())
+        time.sleep(0.01)
+        self._write('Makefile.am', '')
+        self.assertTrue(self._configured(autotools, autoreconf))
+
+        # other flags, other cache
+        autotools.attribute('CFLAGS').value = '-O0'
+        self._configured(autotools, autoreconf)
+        self.assertEqual(len(os.listdir(caches)), 2)
+        # the module can keep its own cache
+        autotools.attribute('shared_config_cache').value = 'False'
+        os.remove(os.path.join(objdir, 'config.cache'))
+        self._configured(autotools, autoreconf)
+        self.assertFalse(os.path.exists(os.path.join(objdir, 'config.cache')))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+###############################################################################
+# Copyright (c) 2013 INRIA
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation;
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Authors: Daniel Camara  <daniel.camara@inria.fr>
+#          Mathieu Lacage <mathieu.lacage@sophia.inria.fr>
+###############################################################################
+import unittest
+# hack to save ourselves from having to use PYTHONPATH
+import sys
+import os
+import shutil
+import tempfile
+import time
+
+from bake.FilesystemMonitor import FilesystemMonitor, Inotify
+
+sys.path.append(os.path.join (os.getcwd(), '..'))
+
+class TestFilesystemMonitor(unittest.TestCase):
+    """Tests cases for the FilesystemMonitor Class."""
+
+    def setUp(self):
+        """Common set Up environment, available for all tests."""
+        self._dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self._dir, 'lib'))
+        for name in ['old', 'gone', 'same']:
+            self._write(os.path.join('lib', name), 'old')
+
+    def tearDown(self):
+        """Cleans the environment environment for the next tests."""
+        shutil.rmtree(self._dir)
+
+    def _write(self, name, content):
+        with open(os.path.join(self._dir, name), 'w') as f:
+            f.write(content)
+
+    def _path(self, *names):
+        return sorted([os.path.join(self._dir, *name.split('/')) 
+                       for name in names])
+
+    def _changes(self, inotify):
+        """ Changes the directory under a monitor."""
+
+        monitor = FilesystemMonitor(self._dir, inotify)
+        monitor.start()
+        # the modification time has to change with the content
+        time.sleep(0.01)
+        self._write('lib/new', 'new')
+        self._write('lib/old', 'modified')
+        os.remove(os.path.join(self._dir, 'lib', 'gone'))
+        os.makedirs(os.path.join(self._dir, 'include', 'a'))
+        self._write('include/a/a.h', 'a')
+        os.symlink('new', os.path.join(self._dir, 'lib', 'link'))
+        # temporary files are not seen
+        self._write('tmp', 'tmp')
+        os.remove(os.path.join(self._dir, 'tmp'))
+        changed = monitor.end()
+        self.assertEqual(changed, self._path('include/a/a.h', 'lib/link', 
+                                             'lib/new', 'lib/old'))
+        self.assertEqual(monitor.created(), 
+                         self._path('include/a/a.h', 'lib/link', 'lib/new'))
+        self.assertEqual(monitor.modified(), self._path('lib/old'))
+        self.assertEqual(monitor.deleted(), self._path('lib/gone'))
+
+    def test_snapshot(self):
+        """Tests the changes found comparing snapshots. """
+
+        self._changes(False)
+
+    def test_inotify(self):
+        """Tests the changes watched with inotify. """
+
+        watch = Inotify.watch(self._dir)
+        if watch is None:
+            self.skipTest('inotify is not available')
+        watch.end()
+        self._changes(True)
+
+    def test_overflow(self):
+        """Tests the changes found when the inotify watch loses some, for
+        files installed with their original times. """
+
+        known = self._path('lib/old', 'lib/gone')
+        monitor = FilesystemMonitor(self._dir, known=known)
+        monitor.start()
+        if monitor._watch is None:
+            self.skipTest('inotify is not available')
+        # only the directories are listed at the start
+        self.assertEqual(monitor._files, None)
+        monitor._watch._overflow = True
+        for name in ['lib/new', 'lib/old']:
+            self._write(name, 'new')
+            os.utime(os.path.join(self._dir, name), (1000000, 1000000))
+        os.remove(os.path.join(self._dir, 'lib', 'gone'))
+        self.assertEqual(monitor.end(), self._path('lib/new', 'lib/old'))
+        self.assertEqual(monitor.created(), self._path('lib/new'))
+        self.assertEqual(monitor.modified(), self._path('lib/old'))
+        self.assertEqual(monitor.deleted(), self._path('lib/gone'))
+
+    def test_new_directory(self):
+        """Tests the files created in a new directory before it is 
+        watched. """
+
+        monitor = FilesystemMonitor(self._dir)
+        monitor.start()
+        if monitor._watch is None:
+            self.skipTest('inotify is not available')
+        test = self
+        class Libc:
+            def __init__(self, libc):
+                self._libc = libc
+            def inotify_add_watch(self, fd, path, mask):
+                # the installer is faster than the watch
+                if path.endswith(b'include'):
+                    test._write('include/a.h', 'a')
+                return self._libc.inotify_add_watch(fd, path, mask)
+        monitor._watch._libc = Libc(monitor._watch._libc)
+        os.makedirs(os.path.join(self._dir, 'include'))
+        self.assertEqual(monitor.end(), self._path('include/a.h'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+###############################################################################
+# Copyright (c) 2013 INRIA
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation;
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Authors: Daniel Camara  <daniel.camara@inria.fr>
+#          Mathieu Lacage <mathieu.lacage@sophia.inria.fr>
+###############################################################################
+import unittest
+# hack to save ourselves from having to use PYTHONPATH
+import sys
+import os
+import shutil
+import subprocess
+import tempfile
+
+from bake.Module import Module
+from bake.ModuleEnvironment import ModuleEnvironment
+from bake.ModuleLogger import StdoutModuleLogger
+from bake.ModuleSource import ModuleSource
+from bake.ModuleBuild import ModuleBuild
+from bake.Utils import stat_tree_hash
+
+sys.path.append(os.path.join (os.getcwd(), '..'))
+
+class TestFingerprint(unittest.TestCase):
+    """Tests cases for the up to date check of the module builds."""
+
+    def setUp(self):
+        """Common set Up environment, available for all tests."""
+        self._dir = tempfile.mkdtemp()
+        self._srcdir = os.path.join(self._dir, 'a')
+        os.makedirs(os.path.join(self._srcdir, 'objdir'))
+        os.makedirs(os.path.join(self._srcdir, '.git'))
+        with open(os.path.join(self._srcdir, 'a.c'), 'w') as f:
+            f.write('int a;\n')
+
+    def tearDown(self):
+        """Cleans the environment environment for the next tests."""
+        shutil.rmtree(self._dir)
+
+    def _touch(self, name, content='x'):
+        with open(os.path.join(self._srcdir, name), 'w') as f:
+            f.write(content)
+
+    def test_tree_hash(self):
+        """Tests the hash of the source trees. """
+
+        objdir = os.path.join(self._srcdir, 'objdir')
+        first = stat_tree_hash(self._srcdir, set([objdir]))
+        self.assertEqual(first, stat_tree_hash(self._srcdir, set([objdir])))
+        # the VCS metadata and the skipped directories do not count
+        self._touch(os.path.join('.git', 'index'))
+        self._touch(os.path.join('objdir', 'a.o'))
+        self.assertEqual(first, stat_tree_hash(self._srcdir, set([objdir])))
+        self.assertNotEqual(first, stat_tree_hash(self._srcdir))
+        # the files of the sources do
+        self._touch('a.c', 'int a = 1;\n')
+        self.assertNotEqual(first, stat_tree_hash(self._srcdir, 
+                                                  set([objdir])))
+
+    def test_git_head(self):
+        """Tests the commit read from the git metadata. """
+
+        env = ModuleEnvironment(StdoutModuleLogger(), self._dir, self._dir)
+        env.start_source('a', 'a')
+        source = ModuleSource.create('git')
+        commit = 'a' * 40
+        self._touch(os.path.join('.git', 'HEAD'), commit + '\n')
+        self.assertEqual(source.head(env), commit)
+        self._touch(os.path.join('.git', 'HEAD'), 'ref: refs/heads/master\n')
+        self._touch(os.path.join('.git', 'packed-refs'), 
+                    '# pack-refs with: peeled\n%s refs/heads/master\n' % 
+                    commit)
+        self.assertEqual(source.head(env), commit)
+        os.makedirs(os.path.join(self._srcdir, '.git', 'refs', 'heads'))
+        self._touch(os.path.join('.git', 'refs', 'heads', 'master'), 
+                    'b' * 40 + '\n')
+        self.assertEqual(source.head(env), 'b' * 40)
+        env.end_source()
+
+    def test_up_to_date(self):
+        """Tests that a module is up to date only while nothing changes. """
+
+        env = ModuleEnvironment(StdoutModuleLogger(), 
+                                os.path.join(self._dir, 'install'), 
+                                self._dir)
+        installed = os.path.join(self._dir, 'liba.so')
+        self._touch(installed)
+        module = Module('a', ModuleSource.create('none'), 
+                        ModuleBuild.create('make'), 'ns', None, None)
+        fingerprint = module.current_fingerprint(env, [])
+        self.assertNotEqual(fingerprint, None)
+        self.assertFalse(module.is_up_to_date(fingerprint))
+
+        module._built_once = True
+        module._installed = [installed]
+        module.fingerprint = fingerprint
+        self.assertTrue(module.is_up_to_date(
+            module.current_fingerprint(env, [])))
+        # a dependency that changed
+        self.assertFalse(module.is_up_to_date(
+            module.current_fingerprint(env, [('b', '1')])))
+        # a build attribute that changed
+        module.get_build().attribute('objdir').value = 'build'
+        self.assertFalse(module.is_up_to_date(
+            module.current_fingerprint(env, [])))
+        module.get_build().attribute('objdir').value = 'objdir'
+        fingerprint = module.current_fingerprint(env, [])
+        module.fingerprint = fingerprint
+        self.assertTrue(module.is_up_to_date(fingerprint))
+        # an installed file that is gone
+        os.remove(installed)
+        self.assertFalse(module.is_up_to_date(fingerprint))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+###############################################################################
+# Copyright (c) 2013 INRIA
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation;
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Authors: Daniel Camara  <daniel.camara@inria.fr>
+#          Mathieu Lacage <mathieu.lacage@sophia.inria.fr>
+###############################################################################
+import unittest
+# hack to save ourselves from having to use PYTHONPATH
+import sys
+import os
+import shutil
+import tempfile
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from bake.ModuleBuild import ModuleBuild
+from bake.ModuleEnvironment import ModuleEnvironment
+from bake.ModuleLogger import StdoutModuleLogger
+
+sys.path.append(os.path.join (os.getcwd(), '..'))
+
+class TestFusedInstall(unittest.TestCase):
+    """Tests cases for the builds that install in the same run."""
+
+    def setUp(self):
+        """Common set Up environment, available for all tests."""
+        self._dir = tempfile.mkdtemp()
+        self._srcdir = os.path.join(self._dir, 'source', 'a')
+        self._installdir = os.path.join(self._dir, 'install')
+        os.makedirs(self._srcdir)
+        self._env = ModuleEnvironment(StdoutModuleLogger(), 
+                                      self._installdir,
+                                      os.path.join(self._dir, 'source'))
+
+    def tearDown(self):
+        """Cleans the environment environment for the next tests."""
+        shutil.rmtree(self._dir)
+
+    def _write(self, name, content):
+        with open(os.path.join(self._srcdir, name), 'w') as f:
+            f.write(content)
+
+    def _build(self, build):
+        """ Builds the module and returns the commands it ran."""
+
+        commands = []
+        run = ModuleEnvironment.run
+        def record(environment, args, *rest, **options):
+            commands.append(args)
+            return run(environment, args, *rest, **options)
+        self._env.start_build('a', 'a', build.objdir)
+        try:
+            with mock.patch.object(ModuleEnvironment, 'run', record):
+                build.build(self._env, 2)
+        finally:
+            self._env.end_build()
+        return commands
+
+    def test_make(self):
+        """Tests the fused build and installation of make modules. """
+
+        self._write('Makefile', 'all:\n'
+                    '\ttouch a.o\n'
+                    'install: all\n'
+                    '\tmkdir -p %s && cp a.o %s\n' % 
+                    (self._installdir, self._installdir))
+        make = ModuleBuild.create('make')
+        self.assertEqual(len(self._build(make)), 3)
+
+        self._env.fused_install = True
+        os.remove(os.path.join(self._srcdir, 'a.o'))
+        commands = self._build(make)
+        self.assertEqual(len(commands), 2)
+        self.assertEqual(commands[1], ['make', 'install', '-j', '2'])
+        self.assertTrue(os.path.exists(os.path.join(self._installdir, 'a.o')))
+
+        # the attribute of the module overrides the option
+        make.attribute('fused_install').value = 'False'
+        self.assertEqual(len(self._build(make)), 3)
+        self._env.fused_install = False
+        make.attribute('fused_install').value = 'True'
+        self.assertEqual(len(self._build(make)), 2)
+        # never with sudo, nor with build targets
+        self._env._sudoEnabled = True
+        self.assertFalse(make._fused(self._env))
+        self._env._sudoEnabled = False
+        make.attribute('build_arguments').value = 'all'
+        self.assertEqual(len(self._build(make)), 3)
+
+    def test_cmake(self):
+        """Tests the fused build and installation of cmake modules. """
+
+        if not ModuleEnvironment(StdoutModuleLogger(), self._dir, 
+                                 self._dir).check_program('cmake'):
+            self.skipTest('cmake is not available')
+        self._write('CMakeLists.txt', 'cmake_minimum_required(VERSION 3.5)\n'
+                    'project(a NONE)\n'
+                    'install(FILES a.txt DESTINATION share)\n')
+        self._write('a.txt', 'a\n')
+        cmake = ModuleBuild.create('cmake')
+        cmake.attribute('objdir').value = 'build'
+        cmake.attribute('fused_install').value = 'True'
+        commands = [c for c in self._build(cmake) if '--build' in c]
+        self.assertEqual(len(commands), 1)
+        self.assertTrue('install' in commands[0])
+        self.assertTrue(os.path.exists(os.path.join(self._installdir, 
+                                                    'share', 'a.txt')))
+
+if __name__ == '__main__':
+    unittest.main()
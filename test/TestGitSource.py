@@ -0,0 +1,171 @@
+###############################################################################
+# Copyright (c) 2013 INRIA
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation;
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Authors: Daniel Camara  <daniel.camara@inria.fr>
+#          Mathieu Lacage <mathieu.lacage@sophia.inria.fr>
+###############################################################################
+import unittest
+# hack to save ourselves from having to use PYTHONPATH
+import sys
+import os
+import shutil
+import subprocess
+import tempfile
+
+from bake.DownloadCache import DownloadCache
+from bake.ModuleEnvironment import ModuleEnvironment
+from bake.ModuleLogger import StdoutModuleLogger
+from bake.ModuleSource import ModuleSource
+
+sys.path.append(os.path.join (os.getcwd(), '..'))
+
+class TestGitSource(unittest.TestCase):
+    """Tests cases for the shallow, single branch and partial git 
+    downloads."""
+
+    def setUp(self):
+        """Common set Up environment, available for all tests."""
+        if os.system('git --version > /dev/null 2>&1') != 0:
+            self.skipTest('git is not available')
+        self._dir = tempfile.mkdtemp()
+        self._remote = os.path.join(self._dir, 'remote')
+        os.makedirs(self._remote)
+        self._git(['init', '-q', '-b', 'master'], self._remote)
+        self._git(['config', 'uploadpack.allowFilter', 'true'], self._remote)
+        self._git(['config', 'uploadpack.allowAnySHA1InWant', 'true'], 
+                  self._remote)
+        for i in range(3):
+            self._commit('%d' % i)
+        self._git(['tag', 'v1', 'HEAD~1'], self._remote)
+        self._git(['branch', 'dev'], self._remote)
+        self._git(['checkout', '-q', 'dev'], self._remote)
+        self._commit('dev')
+        self._git(['checkout', '-q', 'master'], self._remote)
+
+    def tearDown(self):
+        """Cleans the environment environment for the next tests."""
+        shutil.rmtree(self._dir)
+
+    def _git(self, args, directory):
+        return subprocess.check_output(['git', '-c', 'user.name=bake', 
+                                        '-c', 'user.email=bake@localhost'] +
+                                       args, cwd=directory).decode().strip()
+
+    def _commit(self, content):
+        with open(os.path.join(self._remote, 'file'), 'w') as f:
+            f.write(content + '\n')
+        self._git(['add', 'file'], self._remote)
+        self._git(['commit', '-q', '-m', content], self._remote)
+
+    def _download(self, name, cache=None, **attributes):
+        """ Downloads the remote repository into name, with the given 
+        attributes, and returns the environment of the source."""
+
+        env = ModuleEnvironment(StdoutModuleLogger(), self._dir, self._dir)
+        env.download_cache = cache
+        if cache is None:
+            env.git_defaults = {'depth': '1'}
+        source = ModuleSource.create('git')
+        source.attribute('url').value = 'file://' + self._remote
+        for key, value in attributes.items():
+            source.attribute(key).value = value
+        env.start_source(name, name)
+        source.download(env)
+        return env, source
+
+    def test_shallow(self):
+        """Tests the download of a single commit, and its deepening on
+        update. """
+
+        env, source = self._download('a')
+        self.assertEqual(self._git(['rev-list', '--count', 'HEAD'], 
+                                   env.srcdir), '1')
+        self.assertEqual(self._git(['rev-parse', 'HEAD'], env.srcdir),
+                         self._git(['rev-parse', 'master'], self._remote))
+        source.attribute('revision').value = 'v1'
+        source.update(env)
+        self.assertFalse(os.path.exists(os.path.join(env.srcdir, '.git', 
+                                                     'shallow')))
+        self.assertEqual(self._git(['rev-list', '--count', 'HEAD'], 
+                                   env.srcdir), '3')
+        env.end_source()
+
+        # the depth attribute has precedence over the global option
+        env, source = self._download('b', depth='0')
+        self.assertEqual(self._git(['rev-list', '--count', 'HEAD'], 
+                                   env.srcdir), '3')
+        env.end_source()
+
+    def test_branch_and_revision(self):
+        """Tests the checkout of the requested branch and revision. """
+
+        env, source = self._download('a', branch='dev', single_branch='True')
+        self.assertEqual(self._git(['rev-parse', 'HEAD'], env.srcdir),
+                         self._git(['rev-parse', 'dev'], self._remote))
+        self.assertEqual(self._git(['config', 'remote.origin.fetch'], 
+                                   env.srcdir),
+                         '+refs/heads/dev:refs/remotes/origin/dev')
+        env.end_source()
+
+        env, source = self._download('b', revision='v1', filter='blob:none')
+        self.assertEqual(self._git(['rev-parse', 'HEAD'], env.srcdir),
+                         self._git(['rev-parse', 'v1^{commit}'], 
+                                   self._remote))
+        self.assertEqual(self._git(['config', 'remote.origin.promisor'], 
+                                   env.srcdir), 'true')
+        with open(os.path.join(env.srcdir, 'file')) as f:
+            self.assertEqual(f.read(), '1\n')
+        env.end_source()
+
+    def test_download_cache(self):
+        """ Tests the downloads through the mirrors of the download 
+        cache. """
+
+        cache = DownloadCache(os.path.join(self._dir, 'cache'))
+        env, source = self._download('a', cache)
+        alternates = os.path.join(env.srcdir, '.git', 'objects', 'info', 
+                                  'alternates')
+        with open(alternates) as f:
+            mirror = f.read().strip()
+        self.assertTrue(mirror.startswith(cache.directory()))
+        self.assertEqual(self._git(['rev-parse', 'HEAD'], env.srcdir),
+                         self._git(['rev-parse', 'master'], self._remote))
+        # the objects of the workspace are the ones of the mirror
+        self.assertEqual(self._git(['count-objects'], env.srcdir), 
+                         '0 objects, 0 kilobytes')
+        
+        # the update gets the new commits through the mirror
+        self._commit('3')
+        source.attribute('revision').value = 'origin/master'
+        source.update(env)
+        self.assertEqual(self._git(['rev-parse', 'HEAD'], env.srcdir),
+                         self._git(['rev-parse', 'master'], self._remote))
+        self.assertEqual(self._git(['rev-parse', 'master'], 
+                                   os.path.dirname(mirror)),
+                         self._git(['rev-parse', 'master'], self._remote))
+        env.end_source()
+
+        # the workspaces with their own objects do not need the mirror
+        env, source = self._download('b', DownloadCache(cache.directory(), 
+                                                        True))
+        self.assertFalse(os.path.exists(os.path.join(env.srcdir, '.git', 
+                                                     'objects', 'info', 
+                                                     'alternates')))
+        self._git(['fsck', '--connectivity-only'], env.srcdir)
+        env.end_source()
+
+if __name__ == '__main__':
+    unittest.main()
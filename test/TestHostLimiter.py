@@ -0,0 +1,91 @@
+###############################################################################
+# Copyright (c) 2013 INRIA
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation;
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Authors: Daniel Camara  <daniel.camara@inria.fr>
+#          Mathieu Lacage <mathieu.lacage@sophia.inria.fr>
+###############################################################################
+import unittest
+# hack to save ourselves from having to use PYTHONPATH
+import sys
+import os
+import threading
+import time
+
+from bake.HostLimiter import HostLimiter
+from bake.ModuleSource import ModuleSource
+
+sys.path.append(os.path.join (os.getcwd(), '..'))
+
+class TestHostLimiter(unittest.TestCase):
+    """Tests cases for the HostLimiter Class."""
+
+    def _downloads(self, limiter, hosts):
+        """ Runs a download from each host, and returns the most downloads 
+        that ran at once, in total, as *, and per host."""
+
+        lock = threading.Lock()
+        running = dict()
+        most = dict()
+        def download(host):
+            with limiter.slot(host):
+                with lock:
+                    for key in ['*', host]:
+                        running[key] = running.get(key, 0) + 1
+                        most[key] = max(most.get(key, 0), running[key])
+                time.sleep(0.05)
+                with lock:
+                    for key in ['*', host]:
+                        running[key] = running[key] - 1
+        threads = [threading.Thread(target=download, args=(host,)) 
+                   for host in hosts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return most
+
+    def test_limits(self):
+        """Tests the total and per host limits of the downloads. """
+
+        hosts = ['gitlab.com'] * 6 + ['www.nsnam.org'] * 2
+        most = self._downloads(HostLimiter(4, 2), hosts)
+        self.assertEqual(most['*'], 4)
+        self.assertEqual(most['gitlab.com'], 2)
+        self.assertEqual(most['www.nsnam.org'], 2)
+
+        most = self._downloads(HostLimiter(0, 3), hosts)
+        self.assertEqual(most['gitlab.com'], 3)
+        self.assertEqual(most['*'], 5)
+        # the local sources are not limited per host
+        most = self._downloads(HostLimiter(0, 1), [''] * 3)
+        self.assertEqual(most['*'], 3)
+
+    def test_host(self):
+        """Tests the hosts the sources are downloaded from. """
+
+        source = ModuleSource.create('git')
+        for url, host in [('https://gitlab.com/nsnam/ns-3-dev.git', 
+                           'gitlab.com'),
+                          ('git@GitHub.com:nsnam/bake.git', 'github.com'),
+                          ('ssh://user@host.org:2222/repo', 'host.org'),
+                          ('file:///tmp/repo', ''),
+                          ('/tmp/repo', '')]:
+            source.attribute('url').value = url
+            self.assertEqual(source.host(), host)
+        self.assertEqual(ModuleSource.create('none').host(), '')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+###############################################################################
+# Copyright (c) 2013 INRIA
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation;
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Authors: Daniel Camara  <daniel.camara@inria.fr>
+#          Mathieu Lacage <mathieu.lacage@sophia.inria.fr>
+###############################################################################
+import unittest
+# hack to save ourselves from having to use PYTHONPATH
+import sys
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from bake.Jobserver import Jobserver
+from bake.ModuleBuild import ModuleBuild
+from bake.ModuleEnvironment import ModuleEnvironment
+from bake.ModuleLogger import StdoutModuleLogger
+
+sys.path.append(os.path.join (os.getcwd(), '..'))
+
+class TestJobserver(unittest.TestCase):
+    """Tests cases for the make compatible Jobserver Class."""
+
+    def setUp(self):
+        """Common set Up environment, available for all tests."""
+        self._dir = tempfile.mkdtemp()
+        self._jobserver = None
+
+    def tearDown(self):
+        """Cleans the environment environment for the next tests."""
+        if self._jobserver is not None:
+            self._jobserver.close()
+        shutil.rmtree(self._dir)
+
+    def test_tokens(self):
+        """Tests the acquisition and release of job slots. """
+
+        self._jobserver = Jobserver(3)
+        # one of the 3 jobs is the implicit slot of the tool
+        self.assertEqual(self._jobserver.acquire(), 2)
+        self.assertEqual(self._jobserver.acquire(), 0)
+        self._jobserver.release(2)
+        self.assertEqual(self._jobserver.acquire(1), 1)
+        self.assertEqual(self._jobserver.acquire(), 1)
+
+        # waits for the first token, once given back by another build
+        timer = threading.Timer(0.2, self._jobserver.release, [2])
+        timer.start()
+        self.assertEqual(self._jobserver.acquire(wait=True), 2)
+        timer.join()
+
+        # a smaller jobserver takes its tokens from the shared one
+        self._jobserver.release(2)
+        shared = self._jobserver.share(2)
+        self.assertEqual(shared.jobs(), 2)
+        self.assertEqual(self._jobserver.acquire(), 1)
+        self._jobserver.release(1)
+        shared.close()
+        self.assertEqual(self._jobserver.acquire(), 2)
+
+    def test_make(self):
+        """Tests that make, run from the module environment, takes its job
+        slots from the jobserver. """
+
+        if os.system('make --version > /dev/null 2>&1') != 0:
+            self.skipTest('make is not available')
+        with open(os.path.join(self._dir, 'Makefile'), 'w') as makefile:
+            makefile.write('all: a b c d\n'
+                           'a b c d:\n'
+                           '\tsleep 0.5\n')
+        self._jobserver = Jobserver(2)
+        env = ModuleEnvironment(StdoutModuleLogger(), self._dir, self._dir)
+        env.jobserver = self._jobserver
+        # only the build tools see the jobserver
+        env.run(['sh', '-c', 'test -z "$MAKEFLAGS"'])
+        start = time.time()
+        env.run(['make'], directory=self._dir, jobserver=self._jobserver)
+        elapsed = time.time() - start
+        # without the jobserver make would run the 4 jobs one by one
+        self.assertTrue(elapsed < 1.8, 'make took %.2fs' % elapsed)
+        # and not more than 2 at once
+        self.assertTrue(elapsed > 0.9, 'make took %.2fs' % elapsed)
+        self.assertEqual(self._jobserver.acquire(), 1)
+
+    def test_limited(self):
+        """Tests that a module that has to run less jobs than the jobserver
+        allows still takes its job slots from the jobserver. """
+
+        if os.system('make --version > /dev/null 2>&1') != 0:
+            self.skipTest('make is not available')
+        with open(os.path.join(self._dir, 'Makefile'), 'w') as makefile:
+            makefile.write('all: a b c d e f\n'
+                           'a b c d e f:\n'
+                           '\tsleep 0.3\n')
+        self._jobserver = Jobserver(4)
+        env = ModuleEnvironment(StdoutModuleLogger(), self._dir, self._dir)
+        env.jobserver = self._jobserver
+        # other builds hold 2 of the 3 tokens
+        self.assertEqual(self._jobserver.acquire(2), 2)
+        start = time.time()
+        ModuleBuild.create('make')._run_make(env, ['make'], 3, 
+                                             directory=self._dir)
+        elapsed = time.time() - start
+        # 2 jobs at once, its implicit slot and the free token, not 3
+        self.assertTrue(elapsed > 0.85, 'make took %.2fs' % elapsed)
+        self.assertTrue(elapsed < 1.4, 'make took %.2fs' % elapsed)
+        self._jobserver.release(2)
+        self.assertEqual(self._jobserver.acquire(), 3)
+
+if __name__ == '__main__':
+    unittest.main()
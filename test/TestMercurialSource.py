@@ -0,0 +1,106 @@
+###############################################################################
+# Copyright (c) 2013 INRIA
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation;
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Authors: Daniel Camara  <daniel.camara@inria.fr>
+#          Mathieu Lacage <mathieu.lacage@sophia.inria.fr>
+###############################################################################
+import unittest
+# hack to save ourselves from having to use PYTHONPATH
+import sys
+import os
+import shutil
+import subprocess
+import tempfile
+
+from bake.DownloadCache import DownloadCache
+from bake.ModuleEnvironment import ModuleEnvironment
+from bake.ModuleLogger import StdoutModuleLogger
+from bake.ModuleSource import ModuleSource
+
+sys.path.append(os.path.join (os.getcwd(), '..'))
+
+class TestMercurialSource(unittest.TestCase):
+    """Tests cases for the mercurial downloads through the download 
+    cache."""
+
+    def setUp(self):
+        """Common set Up environment, available for all tests."""
+        if os.system('hg --version > /dev/null 2>&1') != 0:
+            self.skipTest('hg is not available')
+        self._dir = tempfile.mkdtemp()
+        self._remote = os.path.join(self._dir, 'remote')
+        self._hg(['init', self._remote], self._dir)
+        self._commit('0')
+        self._hg(['tag', 'v1'], self._remote)
+        self._cache = DownloadCache(os.path.join(self._dir, 'cache'))
+
+    def tearDown(self):
+        """Cleans the environment environment for the next tests."""
+        shutil.rmtree(self._dir)
+
+    def _hg(self, args, directory):
+        return subprocess.check_output(['hg', '--config', 'ui.username=bake']
+                                       + args, cwd=directory).decode().strip()
+
+    def _commit(self, content):
+        with open(os.path.join(self._remote, 'file'), 'w') as f:
+            f.write(content + '\n')
+        self._hg(['commit', '-q', '-A', '-m', content], self._remote)
+
+    def _download(self, name, revision):
+        """ Downloads the remote repository into name, at the revision, and
+        returns the environment and the source."""
+
+        env = ModuleEnvironment(StdoutModuleLogger(), self._dir, self._dir)
+        env.download_cache = self._cache
+        source = ModuleSource.create('mercurial')
+        source.attribute('url').value = self._remote
+        source.attribute('revision').value = revision
+        env.start_source(name, name)
+        source.download(env)
+        return env, source
+
+    def test_download_cache(self):
+        """ Tests the downloads and updates through the pool. """
+
+        env, source = self._download('a', 'tip')
+        self.assertEqual(self._hg(['id', '-i'], env.srcdir),
+                         self._hg(['id', '-i', '-r', 'tip'], self._remote))
+        # the workspace pulls from the remote without the cache
+        self.assertEqual(self._hg(['paths', 'default'], env.srcdir), 
+                         self._remote)
+        env.end_source()
+        pool = os.listdir(os.path.join(self._cache.directory(), 'hg'))
+        self.assertEqual(len(pool), 1)
+
+        # with a warm cache the tag does not need the remote
+        moved = self._remote + '.moved'
+        os.rename(self._remote, moved)
+        env, source = self._download('b', 'v1')
+        with open(os.path.join(env.srcdir, 'file')) as f:
+            self.assertEqual(f.read(), '0\n')
+        os.rename(moved, self._remote)
+
+        # tip moves, the update pulls the new changesets into the pool
+        self._commit('1')
+        source.attribute('revision').value = 'tip'
+        source.update(env)
+        with open(os.path.join(env.srcdir, 'file')) as f:
+            self.assertEqual(f.read(), '1\n')
+        env.end_source()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -173,6 +173,40 @@ class TestModuleEnvironment(unittest.TestCase):
         testResult = self._env._check_version(found, ([2]), 2)
         self.assertFalse(testResult)
         
+    def test_parallel_paths(self):
+        """Tests that the modules processed in parallel add paths while
+        others use them. """
+
+        import threading
+        self._env._logger.set_verbose(0)
+        errors = []
+        def add(env, index):
+            env.start_source('m%d' % index, 'm%d' % index)
+            for i in range(100):
+                env.add_libpaths(['/tmp/bake-test-%d-%d' % (index, i)])
+        def use(env):
+            try:
+                for i in range(100):
+                    env.append_to_path(dict())
+            except RuntimeError as e:
+                errors.append(e)
+        threads = [threading.Thread(target=add, args=(self._env.fork(), i))
+                   for i in range(4)]
+        threads = threads + [threading.Thread(target=use, 
+                                              args=(self._env.fork(),))
+                             for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertTrue('/tmp/bake-test-3-99' in 
+                        self._env._snapshot(self._env._libpaths))
+        with ModuleEnvironment._paths_lock:
+            ModuleEnvironment._libpaths.difference_update(
+                [p for p in ModuleEnvironment._libpaths 
+                 if p.startswith('/tmp/bake-test-')])
+
 
 # main call for the tests        
 if __name__ == '__main__':
@@ -0,0 +1,187 @@
+###############################################################################
+# Copyright (c) 2013 INRIA
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation;
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Authors: Daniel Camara  <daniel.camara@inria.fr>
+#          Mathieu Lacage <mathieu.lacage@sophia.inria.fr>
+###############################################################################
+import unittest
+# hack to save ourselves from having to use PYTHONPATH
+import sys
+import os
+import shutil
+import tempfile
+import threading
+
+from bake.Module import Module
+from bake.ModuleBuild import ModuleBuild
+from bake.ModuleSource import ModuleSource
+from bake.ModuleEnvironment import ModuleEnvironment
+from bake.ModuleLogger import StdoutModuleLogger
+
+sys.path.append(os.path.join (os.getcwd(), '..'))
+
+# installs the files of the module, and overwrites the common one
+MAKEFILE = '''all:
+\tsleep 0.2
+install:
+\tmkdir -p $(DESTDIR)%(prefix)s/lib $(DESTDIR)%(prefix)s/include
+\techo %(name)s > $(DESTDIR)%(prefix)s/lib/lib%(name)s.so
+\tln -sf lib%(name)s.so $(DESTDIR)%(prefix)s/lib/lib%(name)s.so.1
+\techo %(name)s > $(DESTDIR)%(prefix)s/include/common.h
+'''
+
+class TestStagedInstall(unittest.TestCase):
+    """Tests cases for the installation of the modules in a staging 
+    directory."""
+
+    def setUp(self):
+        """Common set Up environment, available for all tests."""
+        self._dir = tempfile.mkdtemp()
+        self._installdir = os.path.join(self._dir, 'build')
+        logger = StdoutModuleLogger()
+        logger.set_verbose(1)
+        self._env = ModuleEnvironment(logger, self._installdir,
+                                      os.path.join(self._dir, 'source'))
+        self._env.staged_install = True
+
+    def tearDown(self):
+        """Cleans the environment environment for the next tests."""
+        shutil.rmtree(self._dir)
+
+    def _module(self, name, makefile=MAKEFILE, staged='True'):
+        srcdir = os.path.join(self._dir, 'source', name)
+        os.makedirs(srcdir)
+        with open(os.path.join(srcdir, 'Makefile'), 'w') as f:
+            f.write(makefile % {'name': name, 'prefix': self._installdir})
+        # the Makefiles of the tests honor DESTDIR
+        build = ModuleBuild.create('make')
+        build.attribute('staged_install').value = staged
+        return Module(name, ModuleSource.create('none'), build, 'ns', None, 
+                      None)
+
+    def _installed(self, *names):
+        return sorted([os.path.join(self._installdir, *name.split('/')) 
+                       for name in names])
+
+    def test_parallel(self):
+        """Tests the exact installed files of modules built in parallel. """
+
+        modules = [self._module('a'), self._module('b')]
+        results = []
+        def build(module):
+            results.append(module.build(self._env.fork(), 1, False))
+        threads = [threading.Thread(target=build, args=(m,)) 
+                   for m in modules]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [True, True])
+
+        for module in modules:
+            name = module.name()
+            self.assertEqual(module._installed, 
+                             self._installed('include/common.h',
+                                             'lib/lib%s.so' % name,
+                                             'lib/lib%s.so.1' % name))
+            self.assertTrue(os.path.islink(os.path.join(
+                self._installdir, 'lib', 'lib%s.so.1' % name)))
+        # the staging directories are gone
+        self.assertEqual(sorted(os.listdir(self._dir)), ['build', 'source'])
+
+        # files installed over the ones of a previous build are seen
+        self.assertTrue(modules[0].build(self._env, 1, False))
+        self.assertTrue('%s/include/common.h' % self._installdir in 
+                        modules[0]._installed)
+        with open(os.path.join(self._installdir, 'include', 'common.h')) as f:
+            self.assertEqual(f.read(), 'a\n')
+
+    def test_directory_link(self):
+        """Tests the merge of a link to a directory over an existing one. """
+
+        libdir = os.path.join(self._installdir, 'lib')
+        os.makedirs(libdir)
+        os.symlink('lib', os.path.join(self._installdir, 'lib64'))
+        module = self._module('a', MAKEFILE + 
+                              '\tln -s lib $(DESTDIR)%(prefix)s/lib64\n')
+        self.assertTrue(module.build(self._env, 1, False))
+        self.assertTrue(os.path.islink(os.path.join(self._installdir, 
+                                                    'lib64')))
+        self.assertEqual(os.readlink(os.path.join(self._installdir, 
+                                                  'lib64')), 'lib')
+        self.assertFalse(os.path.lexists(os.path.join(libdir, 'lib64')))
+        self.assertTrue(os.path.join(self._installdir, 'lib64') in 
+                        module._installed)
+
+    def test_parallel_monitored(self):
+        """Tests that the modules installed without a staging directory do
+        not take the files of the modules built at the same time. """
+
+        monitored = self._module('a', MAKEFILE.replace('sleep 0.2', 
+                                                       'sleep 1'))
+        monitored.get_build().attribute('staged_install').value = 'False'
+        modules = [monitored, self._module('b')]
+        results = []
+        def build(module):
+            results.append(module.build(self._env.fork(), 1, False))
+        threads = [threading.Thread(target=build, args=(m,)) 
+                   for m in modules]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [True, True])
+        for module in modules:
+            name = module.name()
+            self.assertEqual(module._installed, 
+                             self._installed('include/common.h',
+                                             'lib/lib%s.so' % name,
+                                             'lib/lib%s.so.1' % name))
+
+    def test_no_destdir(self):
+        """Tests the modules whose installation ignores DESTDIR. """
+
+        makefile = MAKEFILE.replace('$(DESTDIR)', '')
+        # make modules are not staged by default, they are monitored
+        module = self._module('a', makefile, staged='')
+        self.assertFalse(module.get_build().stages_install(self._env))
+        self.assertTrue(module.build(self._env, 1, False))
+        self.assertEqual(module._installed, 
+                         self._installed('include/common.h', 'lib/liba.so',
+                                         'lib/liba.so.1'))
+        # staging them anyway fails the build, instead of losing their files
+        module = self._module('b', makefile)
+        self.assertFalse(module.build(self._env, 1, False))
+        self.assertEqual(module._installed, [])
+        self.assertTrue(ModuleBuild.create('cmake').stages_install(self._env))
+
+    def test_outside(self):
+        """Tests that the files staged outside of the installation 
+        directory are not installed. """
+
+        outside = os.path.join(self._dir, 'outside')
+        module = self._module('a', MAKEFILE + 
+                              '\tmkdir -p $(DESTDIR)%s\n'
+                              '\techo a > $(DESTDIR)%s/a\n' % 
+                              (outside, outside))
+        self.assertFalse(module.build(self._env, 1, False))
+        self.assertFalse(os.path.exists(outside))
+        # nothing was moved
+        self.assertFalse(os.path.exists(os.path.join(self._installdir, 
+                                                     'lib', 'liba.so')))
+
+if __name__ == '__main__':
+    unittest.main()
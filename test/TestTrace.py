@@ -0,0 +1,106 @@
+###############################################################################
+# Copyright (c) 2013 INRIA
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation;
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Authors: Daniel Camara  <daniel.camara@inria.fr>
+#          Mathieu Lacage <mathieu.lacage@sophia.inria.fr>
+###############################################################################
+import unittest
+# hack to save ourselves from having to use PYTHONPATH
+import sys
+import os
+import json
+import shutil
+import tempfile
+import threading
+
+from bake.Trace import Trace
+from bake.ModuleEnvironment import ModuleEnvironment
+from bake.ModuleLogger import StdoutModuleLogger
+
+sys.path.append(os.path.join (os.getcwd(), '..'))
+
+class TestTrace(unittest.TestCase):
+    """Tests cases for the timeline Trace Class."""
+
+    def setUp(self):
+        """Common set Up environment, available for all tests."""
+        self._dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Cleans the environment environment for the next tests."""
+        shutil.rmtree(self._dir)
+
+    def test_phases(self):
+        """Tests the spans of the phases and of the commands they run. """
+
+        trace = Trace(os.path.join(self._dir, 'trace.json'))
+        env = ModuleEnvironment(StdoutModuleLogger(), self._dir, self._dir)
+        env.tracer = trace
+        env._module_name = 'foo'
+        argv = [sys.executable, '-c', 'pass']
+        with env.trace('build'):
+            env.run(argv, directory=self._dir)
+        with env.trace('install'):
+            pass
+        trace.write()
+
+        with open(trace.filename()) as f:
+            events = json.load(f)['traceEvents']
+        spans = dict([(e['name'], e) for e in events if e['ph'] == 'X'])
+        self.assertEqual(spans['build']['args'], {'module': 'foo',
+                                                  'argv': [argv]})
+        self.assertEqual(spans['install']['args'], {'module': 'foo'})
+        command = spans[os.path.basename(sys.executable)]
+        self.assertEqual(command['args']['argv'], argv)
+        self.assertEqual(command['args']['status'], 0)
+        # the command is shown inside the phase that ran it
+        build = spans['build']
+        self.assertTrue(build['ts'] <= command['ts'])
+        self.assertTrue(command['ts'] + command['dur'] <= 
+                        build['ts'] + build['dur'])
+        self.assertTrue(spans['install']['ts'] >= 
+                        build['ts'] + build['dur'])
+
+    def test_lanes(self):
+        """Tests that the lanes show the modules processed at the same 
+        time. """
+
+        trace = Trace(os.path.join(self._dir, 'trace.json'))
+        started = threading.Barrier(2) if hasattr(threading, 'Barrier') \
+                  else None
+        def module(name, wait=False):
+            with trace.span(name, 'module'):
+                if wait and started is not None:
+                    started.wait()
+        threads = [threading.Thread(target=module, args=(name, True)) 
+                   for name in ['a', 'b']]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # the lane of a module that ended is used by the next one
+        module('c')
+
+        lanes = dict([(e['name'], e['tid']) for e in trace.events() 
+                      if e['ph'] == 'X'])
+        if started is not None:
+            self.assertNotEqual(lanes['a'], lanes['b'])
+        self.assertEqual(lanes['c'], 1)
+        named = [e['tid'] for e in trace.events() if e['ph'] == 'M']
+        self.assertEqual(sorted(named), sorted(set(lanes.values())))
+
+if __name__ == '__main__':
+    unittest.main()